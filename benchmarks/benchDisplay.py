@@ -0,0 +1,40 @@
+###
+# Benchmark for headless PNG renders of cube(): one xvfb-run per render compared
+# with the shared virtual display. Needs openscad, xvfb-run and Xvfb.
+#
+# python -m benchmarks.benchDisplay
+#
+
+import shutil
+import time
+from iopenscad.parser import MimeConverter
+from iopenscad.display import VirtualDisplay, XVFB_RUN
+
+def measure(converter, count):
+    converter.cache.active = False
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        converter.convert(XVFB_RUN+"openscad", "cube();", "image/png")
+        durations.append(time.perf_counter()-start)
+    converter.close()
+    return min(durations), sum(durations)/len(durations)
+
+def main(count=10):
+    for cmd in ["openscad", "xvfb-run", "Xvfb"]:
+        if not shutil.which(cmd):
+            print("{} is not available".format(cmd))
+            return
+
+    print("{:>10} {:>10} {:>10}".format("", "min [s]", "avg [s]"))
+    print("{:>10} {:>10.3f} {:>10.3f}".format("xvfb-run", *measure(MimeConverter(), count)))
+
+    display = VirtualDisplay()
+    display.getDisplay()
+    try:
+        print("{:>10} {:>10.3f} {:>10.3f}".format("Xvfb", *measure(MimeConverter(display), count)))
+    finally:
+        display.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+###
+# Benchmark for %include: includes a synthetic library into new parsers. Only
+# the first include parses the library, the following ones reuse the statements.
+#
+# python -m benchmarks.benchInclude
+#
+
+import time
+from iopenscad.parser import Parser, IncludeLibrary, IncludeRef
+from benchmarks.benchParser import createLibrary
+
+def main():
+    print("{:>8} {:>12} {:>12}".format("modules", "first [s]", "next [s]"))
+    for count in [1000, 5000, 10000]:
+        lib = IncludeRef("bench"+str(count)+".scad", "")
+        lib.content = createLibrary(count)
+        IncludeLibrary.dictionary[lib.name] = lib
+        times = []
+        for _ in range(3):
+            parser = Parser()
+            start = time.perf_counter()
+            parser.parse("%include "+lib.name)
+            times.append(time.perf_counter()-start)
+        print("{:>8} {:>12.4f} {:>12.4f}".format(count, times[0], min(times[1:])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+###
+# End-to-end benchmark for IOpenSCAD.do_execute with the FakeRenderer: the cells
+# are executed in one event loop and the messages are collected instead of being
+# sent to a frontend. The overhead of a cell is its time minus the latency of the
+# renderer. The render cache is off, so that each cell is rendered.
+#
+# python -m benchmarks.benchKernel
+#
+
+import os
+import time
+import asyncio
+from iopenscad.kernel import IOpenSCAD
+from iopenscad.parser import Parser
+from iopenscad.renderer import FakeRenderer
+
+def createKernel(latency, size, pipe):
+    kernel = IOpenSCAD()
+    kernel.parser = Parser()
+    kernel.parser.setScadCommand("openscad")
+    converter = kernel.parser.converter
+    converter.renderer = FakeRenderer(latency, size)
+    converter.cache.active = False
+    converter.pipe = pipe
+    kernel.messageCount = 0
+    def sendResponse(socket, msgType, content):
+        kernel.messageCount += 1
+    kernel.send_response = sendResponse
+    return kernel
+
+async def executeCells(kernel, mime, count):
+    await kernel.do_execute("%mime "+mime+os.linesep+"module part(size) { cube(size); }", False)
+    durations = []
+    for i in range(count):
+        start = time.perf_counter()
+        result = await kernel.do_execute("size = {};".format(i)+os.linesep+"%display part(size);", False)
+        durations.append(time.perf_counter()-start)
+        if result["status"] != "ok" or kernel.parser.isError:
+            raise Exception("The cell failed: "+kernel.parser.getMessages())
+    return durations
+
+def measure(mime, latency, size, pipe, count):
+    kernel = createKernel(latency, size, pipe)
+    durations = asyncio.run(executeCells(kernel, mime, count))
+    kernel.parser.shutdown()
+    total = sum(durations)
+    durations.sort()
+    overhead = durations[len(durations)//2]-latency
+    return overhead, count/total, count*size/total/1024/1024
+
+def main(count=50):
+    print("{:>12} {:>6} {:>12} {:>10} {:>14} {:>10} {:>10}".format("mime", "mode", "size [KB]", "latency [s]", "overhead [ms]", "cells/s", "MB/s"))
+    for mime in ["image/png", "model/stl"]:
+        for pipe in [False, True]:
+            for size in [10*1024, 1024*1024, 10*1024*1024]:
+                for latency in [0.0, 0.01]:
+                    overhead, cells, throughput = measure(mime, latency, size, pipe, count)
+                    print("{:>12} {:>6} {:>12} {:>10g} {:>14.2f} {:>10.1f} {:>10.1f}".format(mime, "pipe" if pipe else "file",
+                        size//1024, latency, overhead*1000, cells, throughput))
+
+if __name__ == "__main__":
+    main()
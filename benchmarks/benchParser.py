@@ -0,0 +1,43 @@
+###
+# Benchmark for Parser.parse: parses synthetic libraries with an increasing
+# number of modules and reports the time per statement. With a linear parse
+# loop the time per module stays (roughly) constant.
+#
+# python -m benchmarks.benchParser
+#
+
+import os
+import time
+from iopenscad.parser import Parser
+
+def createLibrary(moduleCount):
+    lines = []
+    for i in range(moduleCount):
+        lines.append("module m"+str(i)+"(size=1) { translate([0,0,"+str(i)+"]) cube([size,size,size]); }")
+    return os.linesep.join(lines)+os.linesep
+
+def measure(function, repeat=3):
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter()-start
+        if result is None or duration<result:
+            result = duration
+    return result
+
+def parseLoop(scad):
+    # only the parse loop: the statements are not inserted into the parser
+    parser = Parser()
+    parser.insertStatement = lambda statement: None
+    parser.parse(scad)
+
+def main():
+    print("{:>8} {:>12} {:>14}".format("modules", "parse [s]", "per module [us]"))
+    for count in [1000, 2500, 5000, 10000]:
+        scad = createLibrary(count)
+        duration = measure(lambda: parseLoop(scad))
+        print("{:>8} {:>12.4f} {:>14.2f}".format(count, duration, duration/count*1000000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+###
+# Benchmark for Scanner.tokenize: compares the number of tokens, the allocated
+# memory and the runtime with a plain re.split('(\W)') of the same source. The
+# parser tokenizes with blocks, which skips the bodies of the modules.
+#
+# python -m benchmarks.benchScanner
+#
+
+import re
+import time
+import tracemalloc
+from iopenscad.scanner import Scanner
+
+def createLibrary(moduleCount):
+    modules = []
+    for i in range(moduleCount):
+        modules.append('''// module number {0}
+/* block
+   comment */
+module part{0}(size = [10, 20, 30], r = 2.5, label = "part {{{0}}}") {{
+    difference() {{
+        translate([0, 0, {0}]) cube(size, center = true);
+        cylinder(h = size[2] + 1, r = r, $fn = 32);
+    }}
+}}
+'''.format(i))
+    return "".join(modules)
+
+def split(scad):
+    return re.split(r'(\W)', scad)
+
+def tokenize(scad):
+    return Scanner().tokenize(scad).words
+
+def tokenizeBlocks(scad):
+    return Scanner().tokenize(scad, blocks=True).words
+
+def measure(function, scad):
+    start = time.perf_counter()
+    result = function(scad)
+    duration = time.perf_counter()-start
+    tracemalloc.start()
+    result = function(scad)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(result), size, duration
+
+def main():
+    scad = createLibrary(10000)
+    print("source: {} characters".format(len(scad)))
+    print("{:>10} {:>10} {:>12} {:>10}".format("", "tokens", "memory [KB]", "time [s]"))
+    for name, function in [("re.split", split), ("tokenize", tokenize), ("blocks", tokenizeBlocks)]:
+        count, size, duration = measure(function, scad)
+        print("{:>10} {:>10} {:>12.0f} {:>10.4f}".format(name, count, size/1024, duration))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+###
+# Benchmark for Parser.insertStatement: loads a synthetic library with 20k
+# statements (modules, functions, variables, comments and top level calls) and
+# then re-executes a cell which redefines some of them.
+#
+# python -m benchmarks.benchStore
+#
+
+import os
+import time
+from iopenscad.parser import Parser
+
+def createLibrary(statementCount):
+    lines = []
+    for i in range(statementCount//5):
+        lines.append("// part "+str(i))
+        lines.append("module m"+str(i)+"(size=1) { cube(size); }")
+        lines.append("function f"+str(i)+"(x) = x * "+str(i)+";")
+        lines.append("v"+str(i)+" = "+str(i)+";")
+        lines.append("m"+str(i)+"(v"+str(i)+");")
+    return os.linesep.join(lines)+os.linesep
+
+def createStatements(scad):
+    # statements without the parser: we only want to measure the insert
+    parser = Parser()
+    result = []
+    parser.insertStatement = result.append
+    parser.parse(scad)
+    return result
+
+def main():
+    statements = createStatements(createLibrary(20000))
+    print("statements: {}".format(len(statements)))
+
+    parser = Parser()
+    start = time.perf_counter()
+    for statement in statements:
+        parser.insertStatement(statement)
+    duration = time.perf_counter()-start
+    print("load library: {:.4f} s".format(duration))
+
+    start = time.perf_counter()
+    for statement in statements[-500:]:
+        parser.insertStatement(statement)
+    duration = time.perf_counter()-start
+    print("re-insert 500 statements: {:.4f} s".format(duration))
+
+    start = time.perf_counter()
+    for _ in range(100):
+        parser.getStatementsOfType("module")
+        parser.getModuleNames()
+    duration = time.perf_counter()-start
+    print("100 x getStatementsOfType/getModuleNames: {:.4f} s".format(duration))
+
+if __name__ == "__main__":
+    main()
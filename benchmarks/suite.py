@@ -0,0 +1,210 @@
+###
+# Benchmark suite for the hot paths of the scanner, the parser and the kernel.
+# The results are saved as JSON, so that the runs of different commits can be
+# compared:
+#
+# python -m benchmarks.suite run -o before.json
+# python -m benchmarks.suite run -o after.json
+# python -m benchmarks.suite compare before.json after.json
+#
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import platform
+import statistics
+import subprocess
+from iopenscad.parser import Parser, IncludeLibrary, IncludeRef
+from iopenscad.scanner import Scanner
+from iopenscad.kernel import IOpenSCAD
+from benchmarks import workloads
+
+##
+# A benchmark: setup() prepares the state of a sample and returns the function
+# which is measured. The function is called number times per sample.
+##
+class Benchmark:
+    def __init__(self, name, setup, number=1):
+        self.name = name
+        self.setup = setup
+        self.number = number
+
+    ## Provides the times per call in seconds
+    def run(self, repeat):
+        times = []
+        for _ in range(repeat):
+            function = self.setup()
+            start = time.perf_counter()
+            for _ in range(self.number):
+                function()
+            times.append((time.perf_counter()-start)/self.number)
+        return {"min": min(times), "median": statistics.median(times), "max": max(times),
+            "repeat": repeat, "number": self.number}
+
+
+## Parser with the statements of the code
+def loadParser(scad):
+    parser = Parser()
+    parser.parse(scad)
+    return parser
+
+## Statements of the code without inserting them into a store
+def createStatements(scad):
+    parser = Parser()
+    result = []
+    parser.insertStatement = result.append
+    parser.parse(scad)
+    return result
+
+## Parser which executes a new version of the cell with each call
+def reexecute(scad, cellSize):
+    parser = loadParser(scad)
+    cells = [workloads.cell(index, cellSize) for index in range(2)]
+    count = [0]
+    def function():
+        count[0] += 1
+        parser.parse(cells[count[0] % 2])
+    return function
+
+## Changes a variable with each call and assembles the source code again
+def changeSourceCode(scad):
+    parser = loadParser(scad)
+    statements = createStatements("v0 = 1;"+os.linesep+"v0 = 2;"+os.linesep)
+    assignments = [statement for statement in statements if statement.statementType == "="]
+    count = [0]
+    def function():
+        count[0] += 1
+        parser.insertStatement(assignments[count[0] % 2])
+        parser.getSourceCode()
+    return function
+
+def insertStatements(parser, statements):
+    for statement in statements:
+        parser.insertStatement(statement)
+
+## Parser which already contains the statements: each call replaces them
+def replaceStatements(statements):
+    parser = Parser()
+    insertStatements(parser, statements)
+    return lambda: insertStatements(parser, statements)
+
+def parseCode(scad):
+    parser = Parser()
+    return lambda: parser.parse(scad)
+
+def includeLibrary(name, cached):
+    if not cached:
+        Parser.libraryStatements.clear()
+    parser = Parser()
+    return lambda: parser.parse("%include "+name)
+
+def completion(scad, code):
+    kernel = IOpenSCAD()
+    kernel.parser = loadParser(scad)
+    return lambda: kernel.do_complete(code, len(code))
+
+
+## The benchmarks: with quick the workloads are 10 times smaller
+def createBenchmarks(quick=False):
+    scale = 10 if quick else 1
+    sources = {
+        "modules": workloads.manyModules(2000//scale),
+        "nesting": workloads.deepNesting(200//scale, 20),
+        "comments": workloads.longComments(500//scale, 10),
+        "library": workloads.library(5000//scale),
+    }
+    lib = IncludeRef("benchmark.scad", "")
+    lib.content = sources["library"]
+    IncludeLibrary.dictionary[lib.name] = lib
+
+    scanner = Scanner()
+    result = []
+    for name, scad in sources.items():
+        result.append(Benchmark("scann/"+name, lambda scad=scad: lambda: scanner.scann(scad)))
+    for name, scad in sources.items():
+        result.append(Benchmark("parse/"+name, lambda scad=scad: parseCode(scad)))
+    result.append(Benchmark("parse/reexecute", lambda: reexecute(sources["modules"], 20), 20))
+    result.append(Benchmark("parse/include", lambda: includeLibrary(lib.name, False)))
+    result.append(Benchmark("parse/include-cached", lambda: includeLibrary(lib.name, True)))
+
+    statements = createStatements(sources["modules"]+sources["library"])
+    result.append(Benchmark("insertStatement/new", lambda: lambda: insertStatements(Parser(), statements)))
+    result.append(Benchmark("insertStatement/replace", lambda: replaceStatements(statements)))
+
+    result.append(Benchmark("getSourceCode/changed", lambda: changeSourceCode(sources["modules"]), 20))
+    result.append(Benchmark("getSourceCode/cached", lambda: loadParser(sources["modules"]).getSourceCode, 1000))
+
+    result.append(Benchmark("do_complete/prefix", lambda: completion(sources["library"], "x = lib_m12"), 1000))
+    result.append(Benchmark("do_complete/all", lambda: completion(sources["library"], "x = "), 20))
+    return result
+
+
+## Identifies the environment of the run
+def getMetadata(quick):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": time.time(), "commit": commit, "python": platform.python_version(),
+        "platform": platform.platform(), "quick": quick}
+
+def run(args):
+    results = {}
+    for benchmark in createBenchmarks(args.quick):
+        if args.filter and not fnmatch.fnmatch(benchmark.name, args.filter):
+            continue
+        results[benchmark.name] = benchmark.run(args.repeat)
+        print("{:<28} {:>12.3f} ms".format(benchmark.name, results[benchmark.name]["min"]*1000))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": getMetadata(args.quick), "results": results}, f, indent=2)
+    return 0
+
+## Compares the minimum times of two runs: returns 1 if a benchmark is slower
+## than the threshold
+def compare(args):
+    runs = []
+    for fileName in [args.base, args.new]:
+        with open(fileName) as f:
+            runs.append(json.load(f)["results"])
+    base, new = runs
+    regressions = 0
+    print("{:<28} {:>12} {:>12} {:>8}".format("benchmark", "base [ms]", "new [ms]", "change"))
+    for name in sorted(set(base) | set(new)):
+        if name not in base or name not in new:
+            values = ["{:.3f}".format(run[name]["min"]*1000) if name in run else "-" for run in runs]
+            print("{:<28} {:>12} {:>12}".format(name, *values))
+            continue
+        before = base[name]["min"]
+        after = new[name]["min"]
+        change = after/before-1 if before>0 else 0.0
+        status = ""
+        if change>args.threshold:
+            status = "slower"
+            regressions += 1
+        elif change<-args.threshold:
+            status = "faster"
+        print("{:<28} {:>12.3f} {:>12.3f} {:>+7.0%} {}".format(name, before*1000, after*1000, change, status))
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    runParser = commands.add_parser("run", help="executes the benchmarks")
+    runParser.add_argument("-o", "--output", help="JSON file for the results")
+    runParser.add_argument("-r", "--repeat", type=int, default=5, help="number of samples per benchmark")
+    runParser.add_argument("-k", "--filter", help="only the benchmarks which match the pattern: e.g. 'parse/*'")
+    runParser.add_argument("--quick", action="store_true", help="10 times smaller workloads")
+    compareParser = commands.add_parser("compare", help="compares the results of two runs")
+    compareParser.add_argument("base")
+    compareParser.add_argument("new")
+    compareParser.add_argument("-t", "--threshold", type=float, default=0.1, help="relative change which is reported (default: 0.1)")
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else compare(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+###
+# Synthetic OpenSCAD workloads for the benchmarks. The generated code only
+# depends on the arguments, so that the results of different runs can be
+# compared.
+#
+
+import os
+
+## Modules with parameters, nested blocks and a call of each module
+def manyModules(count):
+    lines = []
+    for i in range(count):
+        lines.append("// module number {0}".format(i))
+        lines.append("module part{0}(size = [10, 20, 30], r = 2.5, label = \"part {0}\") {{".format(i))
+        lines.append("    difference() {")
+        lines.append("        translate([0, 0, {0}]) cube(size, center = true);".format(i))
+        lines.append("        cylinder(h = size[2] + 1, r = r, $fn = 32);")
+        lines.append("    }")
+        lines.append("}")
+        lines.append("part{0}();".format(i))
+    return os.linesep.join(lines)+os.linesep
+
+## Modules with deeply nested blocks and expressions
+def deepNesting(count, depth):
+    lines = []
+    for i in range(count):
+        body = "cube({});".format(i)
+        for level in range(depth):
+            body = "translate([{0}, 0, 0]) {{ rotate([0, 0, {1}]) {{ {2} }} }}".format(level, level*10, body)
+        lines.append("module nested{0}() {{ {1} }}".format(i, body))
+        lines.append("x{0} = [{1}];".format(i, ", ".join(["[{0}, [{0}, {0}]]".format(level) for level in range(depth)])))
+    return os.linesep.join(lines)+os.linesep
+
+## Functions which are documented with long line and block comments
+def longComments(count, commentLines):
+    lines = []
+    for i in range(count):
+        lines.append("/**")
+        for line in range(commentLines):
+            lines.append(" * Line {0} of the documentation of f{1}: the function scales x by {1}.".format(line, i))
+        lines.append(" */")
+        for line in range(commentLines):
+            lines.append("// f{0}: remark {1} with some text which makes the line longer".format(i, line))
+        lines.append("function f{0}(x, y = 1) = x * {0} + y; // trailing comment".format(i))
+    return os.linesep.join(lines)+os.linesep
+
+## Library which is included with %include: modules, functions and variables
+def library(count):
+    lines = []
+    for i in range(count):
+        lines.append("lib_v{0} = {0};".format(i))
+        lines.append("function lib_f{0}(x) = x + lib_v{0};".format(i))
+        lines.append("module lib_m{0}(size = 1) {{ cube(lib_f{0}(size)); }}".format(i))
+    return os.linesep.join(lines)+os.linesep
+
+## Cell which redefines some modules and variables and displays a result: it is
+## executed repeatedly on top of a loaded workload
+def cell(index, count):
+    lines = []
+    for i in range(count):
+        lines.append("module part{0}(size = [1, 2, 3]) {{ cube(size * {1}); }}".format(i, index))
+        lines.append("v{0} = {1};".format(i, index))
+    lines.append("%display part0();")
+    return os.linesep.join(lines)+os.linesep
@@ -0,0 +1,154 @@
+##
+# Animations: the frames are rendered with -D $t=<time> and are assembled into
+# an animated png (APNG) or, if Pillow is installed, into a GIF.
+#
+import io
+import zlib
+import struct
+from iopenscad.sweep import Sweep
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class Animation(Sweep):
+    formats = {"apng": "image/png", "gif": "image/gif"}
+
+    def __init__(self, frames, fps=10, format="apng", jobs=None, maxFrames=360):
+        if frames<1 or frames>maxFrames:
+            raise Exception("Invalid number of frames: {} (1 - {})".format(frames, maxFrames))
+        if fps<=0:
+            raise Exception("Invalid fps: {:g}".format(fps))
+        if format not in self.formats:
+            raise Exception("Invalid format: "+format)
+        values = ["{:g}".format(i/frames) for i in range(frames)]
+        Sweep.__init__(self, [("$t", values)], None, jobs, maxFrames)
+        self.fps = fps
+        self.format = format
+
+    ## Creates the animation from the arguments of %animate: <frames> [fps=<n>] [format=apng|gif] [-j <jobs>]
+    @classmethod
+    def fromArguments(cls, args):
+        args = list(args)
+        if not args or not args[0].isdigit():
+            raise Exception("The number of frames is missing")
+        frames = int(args.pop(0))
+        settings = {}
+        while args:
+            arg = args.pop(0)
+            if arg == "-j" and args:
+                settings["jobs"] = int(args.pop(0))
+                continue
+            name, sep, value = arg.partition("=")
+            if name == "fps" and sep:
+                settings["fps"] = float(value)
+            elif name == "format" and sep:
+                settings["format"] = value.lower()
+            else:
+                raise Exception("Invalid argument: "+arg)
+        return cls(frames, **settings)
+
+    def getMime(self):
+        return self.formats[self.format]
+
+    def createWriter(self):
+        if self.format == "gif":
+            return GifWriter(self.fps)
+        return ApngWriter(self.count(), self.fps)
+
+
+## Splits png data into (type, data) chunks
+def readChunks(png):
+    if not png.startswith(PNG_SIGNATURE):
+        raise Exception("The frame is not a png file")
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos+8<=len(png):
+        length, chunkType = struct.unpack(">I4s", png[pos:pos+8])
+        chunks.append((chunkType, png[pos+8:pos+8+length]))
+        pos += 12+length
+        if chunkType == b"IEND":
+            break
+    return chunks
+
+
+def writeChunk(out, chunkType, data):
+    out.write(struct.pack(">I", len(data)))
+    out.write(chunkType)
+    out.write(data)
+    out.write(struct.pack(">I", zlib.crc32(chunkType+data) & 0xffffffff))
+
+
+##
+# Assembles png frames of the same size into an animated png. The frames are
+# added one by one, so only the result is kept in memory.
+##
+class ApngWriter:
+    def __init__(self, frameCount, fps):
+        self.frameCount = frameCount
+        # delay of a frame in ms: delayNumerator/delayDenominator seconds
+        self.delayNumerator = max(int(round(1000/fps)), 1)
+        self.delayDenominator = 1000
+        self.out = io.BytesIO()
+        self.header = None
+        self.sequence = 0
+        self.frames = 0
+
+    def addFrame(self, png):
+        chunks = readChunks(png)
+        header = chunks[0][1] if chunks and chunks[0][0] == b"IHDR" else None
+        if header is None:
+            raise Exception("The frame has no header")
+        if self.header is None:
+            self.header = header
+            self.out.write(PNG_SIGNATURE)
+            writeChunk(self.out, b"IHDR", header)
+            writeChunk(self.out, b"acTL", struct.pack(">II", self.frameCount, 0))
+            for chunkType, data in chunks[1:]:
+                if chunkType in [b"PLTE", b"tRNS", b"gAMA", b"sRGB", b"cHRM", b"iCCP"]:
+                    writeChunk(self.out, chunkType, data)
+        elif header != self.header:
+            raise Exception("The frames have different sizes or color types")
+
+        width, height = struct.unpack(">II", header[0:8])
+        writeChunk(self.out, b"fcTL", struct.pack(">IIIIIHHBB", self.sequence, width, height, 0, 0,
+            self.delayNumerator, self.delayDenominator, 0, 0))
+        self.sequence += 1
+        for chunkType, data in chunks:
+            if chunkType == b"IDAT":
+                if self.frames == 0:
+                    writeChunk(self.out, b"IDAT", data)
+                else:
+                    writeChunk(self.out, b"fdAT", struct.pack(">I", self.sequence)+data)
+                    self.sequence += 1
+        self.frames += 1
+
+    ## Provides the animated png
+    def close(self):
+        if self.frames != self.frameCount:
+            raise Exception("Expected {} frames but got {}".format(self.frameCount, self.frames))
+        writeChunk(self.out, b"IEND", b"")
+        return self.out.getvalue()
+
+
+##
+# Animated GIF which is created with Pillow (optional dependency). The frames are
+# converted to palette images to reduce the memory.
+##
+class GifWriter:
+    def __init__(self, fps):
+        try:
+            from PIL import Image
+        except ImportError:
+            raise Exception("The gif format needs Pillow: pip install Pillow")
+        self.Image = Image
+        self.duration = int(round(1000/fps))
+        self.images = []
+
+    def addFrame(self, png):
+        image = self.Image.open(io.BytesIO(png))
+        self.images.append(image.convert("RGB").convert("P", palette=self.Image.ADAPTIVE))
+
+    def close(self):
+        out = io.BytesIO()
+        self.images[0].save(out, format="GIF", save_all=True, append_images=self.images[1:], duration=self.duration, loop=0)
+        return out.getvalue()
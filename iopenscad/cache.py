@@ -0,0 +1,400 @@
+##
+# Size bounded file caches which are stored in a directory. The least recently
+# used entries are removed when the size limit is exceeded.
+#
+import os
+import re
+import shlex
+import hashlib
+import json
+import shutil
+import logging
+import weakref
+import tempfile
+import urllib.error
+import urllib.request
+
+
+## Default location for the caches: $XDG_CACHE_HOME/iopenscad/<name>
+def defaultCacheDir(name):
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "iopenscad", name)
+
+
+## Directory for the temporary files of the renders: we prefer a tmpfs (/dev/shm)
+def defaultSpoolDir():
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK | os.X_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+## Default location for the configuration: $XDG_CONFIG_HOME/iopenscad
+def defaultConfigDir():
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "iopenscad")
+
+
+## Interprets the value of an on/off setting
+def isOn(value, default=True):
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() not in ["off", "0", "false", "no"]
+
+
+##
+# Directory with files which are identified by a key and an extension. Each
+# access updates the modification time which is used for the LRU eviction.
+##
+class DiskCache:
+    def __init__(self, directory, maxBytes, maxFiles=None):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.maxFiles = maxFiles
+
+    def path(self, key, ext):
+        return os.path.join(self.directory, key+"."+ext)
+
+    ## Provides the path of the cached file or None
+    def get(self, key, ext):
+        path = self.path(key, ext)
+        try:
+            os.utime(path)
+            return path
+        except OSError:
+            return None
+
+    ## Stores the data (bytes) and returns the path of the cached file
+    def put(self, key, ext, data):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(prefix=".tmp-", dir=self.directory)
+        with open(fd, "wb") as f:
+            f.write(data)
+        path = self.path(key, ext)
+        os.replace(tmpPath, path)
+        self.evict()
+        return path
+
+    ## Stores the content of the file and returns the path of the cached file
+    def putFile(self, key, ext, fileName):
+        with open(fileName, "rb") as f:
+            return self.put(key, ext, f.read())
+
+    def read(self, key, ext):
+        path = self.get(key, ext)
+        if path:
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            except OSError:
+                pass
+        return None
+
+    def entries(self):
+        result = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.startswith(".tmp-"):
+                        stat = entry.stat()
+                        result.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            pass
+        return result
+
+    ## Removes the least recently used files until we are below the limits
+    def evict(self, maxBytes=None, maxFiles=None):
+        maxBytes = self.maxBytes if maxBytes is None else maxBytes
+        maxFiles = self.maxFiles if maxFiles is None else maxFiles
+        entries = self.entries()
+        size = sum([entry[1] for entry in entries])
+        count = len(entries)
+        if size<=maxBytes and (maxFiles is None or count<=maxFiles):
+            return
+        entries.sort()
+        for mtime, fileSize, path in entries:
+            if size<=maxBytes and (maxFiles is None or count<=maxFiles):
+                break
+            try:
+                os.remove(path)
+                size -= fileSize
+                count -= 1
+            except OSError as err:
+                logging.warning(err)
+
+    def clear(self):
+        for mtime, fileSize, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError as err:
+                logging.warning(err)
+
+    ## Provides the number of files and the used bytes
+    def usage(self):
+        entries = self.entries()
+        return len(entries), sum([entry[1] for entry in entries])
+
+
+##
+# Cache for rendered results. The key is a hash of the command, the mime type,
+# the source code and the fingerprints of the files the source code depends on.
+# The output of the render is stored together with the result.
+##
+class RenderCache(DiskCache):
+    def __init__(self, directory=None, maxBytes=None, active=True):
+        DiskCache.__init__(self, directory or defaultCacheDir("render"), maxBytes or 500*1024*1024)
+        self.active = active
+        self.hits = 0
+        self.misses = 0
+
+    ## Creates the cache with the settings from the environment
+    @classmethod
+    def fromEnvironment(cls):
+        size = os.environ.get("IOPENSCAD_CACHE_SIZE")
+        maxBytes = int(float(size)*1024*1024) if size else None
+        return cls(os.environ.get("IOPENSCAD_CACHE_DIR"), maxBytes, isOn(os.environ.get("IOPENSCAD_CACHE")))
+
+    def key(self, scadCommand, mime, scadCode, dependencies=[]):
+        h = hashlib.sha256()
+        for value in [scadCommand, mime, scadCode]+list(dependencies):
+            h.update(value.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def getMessages(self, key):
+        data = self.read(key, "log")
+        return data.decode("utf-8") if data is not None else ""
+
+    def putResult(self, key, ext, fileName, messages):
+        self.put(key, "log", messages.encode("utf-8"))
+        return self.putFile(key, ext, fileName)
+
+    def putResultData(self, key, ext, data, messages):
+        self.put(key, "log", messages.encode("utf-8"))
+        return self.put(key, ext, data)
+
+    def info(self):
+        files, size = self.usage()
+        return "Render cache: {}, {} files, {:.1f} of {:.0f} MB used in {}, {} hits, {} misses".format(
+            "on" if self.active else "off", files, size/1024/1024, self.maxBytes/1024/1024,
+            self.directory, self.hits, self.misses)
+
+
+##
+# Cache for the downloads of %include and %use. The content is stored with the
+# ETag and Last-Modified headers so that a new kernel only needs a conditional
+# request to check if the library has changed. If the server can not be reached
+# (or in offline mode) we use the stored content.
+##
+class IncludeCache(DiskCache):
+    def __init__(self, directory=None, maxBytes=None, timeout=30, offline=False):
+        DiskCache.__init__(self, directory or defaultCacheDir("include"), maxBytes or 100*1024*1024)
+        self.timeout = timeout
+        self.offline = offline
+
+    ## Creates the cache with the settings from the environment
+    @classmethod
+    def fromEnvironment(cls):
+        size = os.environ.get("IOPENSCAD_INCLUDE_CACHE_SIZE")
+        maxBytes = int(float(size)*1024*1024) if size else None
+        timeout = float(os.environ.get("IOPENSCAD_INCLUDE_TIMEOUT") or 30)
+        return cls(os.environ.get("IOPENSCAD_INCLUDE_CACHE_DIR"), maxBytes, timeout, isOn(os.environ.get("IOPENSCAD_OFFLINE"), False))
+
+    def key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def getHeaders(self, key):
+        data = self.read(key, "json")
+        try:
+            return json.loads(data.decode("utf-8")) if data is not None else {}
+        except ValueError:
+            return {}
+
+    ## Provides the content (bytes) of the url
+    def fetch(self, url):
+        if not url.lower().startswith(("http:", "https:")):
+            with urllib.request.urlopen(url, timeout=self.timeout) as f:
+                return f.read()
+
+        key = self.key(url)
+        content = self.read(key, "scad")
+        if self.offline:
+            if content is None:
+                raise Exception("Offline mode: "+url+" is not in the include cache")
+            return content
+
+        request = urllib.request.Request(url)
+        headers = self.getHeaders(key) if content is not None else {}
+        if headers.get("etag"):
+            request.add_header("If-None-Match", headers["etag"])
+        if headers.get("lastModified"):
+            request.add_header("If-Modified-Since", headers["lastModified"])
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as f:
+                data = f.read()
+                headers = {"url": url, "etag": f.headers.get("ETag"), "lastModified": f.headers.get("Last-Modified")}
+        except OSError as err:
+            if content is None:
+                raise
+            if isinstance(err, urllib.error.HTTPError) and err.code == 304:
+                return content
+            logging.warning("Using the cached content of "+url+": "+str(err))
+            return content
+
+        self.put(key, "json", json.dumps(headers).encode("utf-8"))
+        self.put(key, "scad", data)
+        return data
+
+    def info(self):
+        files, size = self.usage()
+        return "Include cache: {}{} files, {:.1f} of {:.0f} MB used in {}, timeout {:g} s".format(
+            "offline, " if self.offline else "", files, size/1024/1024, self.maxBytes/1024/1024,
+            self.directory, self.timeout)
+
+
+##
+# Directory of a kernel for the temporary files of the renders. The number of
+# files and their size is limited: before a new file is created the oldest files
+# are removed.
+##
+class Spool(DiskCache):
+    def __init__(self, parent=None, maxBytes=None, maxFiles=None):
+        DiskCache.__init__(self, None, maxBytes or 256*1024*1024, maxFiles or 50)
+        self.parent = parent or defaultSpoolDir()
+
+    ## Creates the spool with the settings from the environment
+    @classmethod
+    def fromEnvironment(cls):
+        size = os.environ.get("IOPENSCAD_SPOOL_SIZE")
+        maxBytes = int(float(size)*1024*1024) if size else None
+        files = os.environ.get("IOPENSCAD_SPOOL_FILES")
+        return cls(os.environ.get("IOPENSCAD_SPOOL_DIR"), maxBytes, int(files) if files else None)
+
+    ## The directory is created with the first file
+    def getDirectory(self):
+        if self.directory is None or not os.path.isdir(self.directory):
+            os.makedirs(self.parent, exist_ok=True)
+            self.directory = tempfile.mkdtemp(prefix="iopenscad-", dir=self.parent)
+            # the directory is also removed if the spool is not closed
+            weakref.finalize(self, shutil.rmtree, self.directory, True)
+        return self.directory
+
+    ## Creates an empty file and returns its path
+    def createFile(self, suffix):
+        directory = self.getDirectory()
+        self.evict(maxFiles=max(self.maxFiles-1, 1))
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+        os.close(fd)
+        return path
+
+    def contains(self, path):
+        return self.directory is not None and os.path.dirname(path) == self.directory
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as err:
+            logging.warning(err)
+
+    def entries(self):
+        # the directory has not been created yet
+        if self.directory is None:
+            return []
+        return DiskCache.entries(self)
+
+    ## Removes the directory with all files
+    def close(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def info(self):
+        files, size = self.usage()
+        return "Spool: {} of {} files, {:.1f} of {:.0f} MB used in {}".format(
+            files, self.maxFiles, size/1024/1024, self.maxBytes/1024/1024,
+            self.directory or self.parent)
+
+
+## include <file> and use <file> statements of a library
+LIBRARY_PATTERN = re.compile(r"\b(?:include|use)\s*<([^>]*)>")
+## Statements which read files which are not tracked by the render cache
+EXTERNAL_INPUT_PATTERN = re.compile(r"\b(?:import|surface)\s*\(")
+
+# (path, mtime, size) -> (nested libraries, uses external input)
+scannedLibraries = dict()
+# command -> paths of its programs
+commandPaths = dict()
+
+
+## Directories in which OpenSCAD searches the include and use files
+def libraryPath():
+    home = os.path.expanduser("~")
+    result = [directory for directory in os.environ.get("OPENSCADPATH", "").split(os.pathsep) if directory]
+    return result+[os.path.join(home, ".local", "share", "OpenSCAD", "libraries"),
+        os.path.join(home, "Documents", "OpenSCAD", "libraries"),
+        "/usr/local/share/openscad/libraries", "/usr/share/openscad/libraries"]
+
+## Determines the fingerprint of a file the scad code depends on: None if it
+## can not be found in the directory or the library path
+def fingerprint(fileName, directory=""):
+    for base in [directory]+libraryPath():
+        path = os.path.join(base, fileName)
+        try:
+            stat = os.stat(path)
+            return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+        except OSError:
+            pass
+    return None
+
+## Provides the nested libraries of a file and if it uses import or surface
+def scanLibrary(key):
+    result = scannedLibraries.get(key)
+    if result is None:
+        with open(key[0], encoding="utf-8", errors="replace") as f:
+            content = f.read()
+        result = (LIBRARY_PATTERN.findall(content), EXTERNAL_INPUT_PATTERN.search(content) is not None)
+        if len(scannedLibraries)>1000:
+            scannedLibraries.clear()
+        scannedLibraries[key] = result
+    return result
+
+## Determines the fingerprints of the used libraries and of the libraries which
+## they include. Returns None if the result can not be cached: a library is
+## missing or it reads files with import or surface.
+def fingerprints(fileNames):
+    result = []
+    pending = [(fileName, "") for fileName in fileNames]
+    done = set()
+    while pending:
+        fileName, directory = pending.pop()
+        key = fingerprint(fileName, directory)
+        if key is None:
+            return None
+        if key[0] in done:
+            continue
+        done.add(key[0])
+        try:
+            nested, external = scanLibrary(key)
+        except OSError:
+            return None
+        if external:
+            return None
+        result.append("{}:{}:{}".format(*key))
+        pending.extend([(name, os.path.dirname(key[0])) for name in nested])
+    return sorted(result)
+
+## Determines the fingerprints of the programs of a command: e.g. of xvfb-run
+## and openscad for "xvfb-run -a openscad"
+def commandFingerprint(command):
+    paths = commandPaths.get(command)
+    if paths is None:
+        words = shlex.split(command, posix=os.name != "nt")
+        paths = [shutil.which(word) for word in words if not word.startswith("-")]
+        paths = commandPaths[command] = [path for path in paths if path]
+    result = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            result.append("{}:{}:{}".format(path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            result.append(path+":missing")
+    return " ".join(result)
@@ -0,0 +1,138 @@
+##
+# Prefix index for the code completion: the entries are kept in a sorted array,
+# so that the matches of a prefix are found with a binary search.
+#
+import re
+import heapq
+from bisect import bisect_left, insort
+
+IDENTIFIER = re.compile(r"\$?[A-Za-z_]\w*\Z")
+## Maximum number of completions of a request: e.g. for an empty prefix
+MAX_COMPLETIONS = 1000
+## Text which is appended to the name of a symbol by statement type
+SYMBOL_SUFFIXES = {"module": "();", "function": "()", "=": ""}
+
+
+## Determines the identifier (or magic) which ends at the cursor position
+def getPrefix(code, cursorPos):
+    start = min(cursorPos, len(code))
+    while start>0 and (code[start-1].isalnum() or code[start-1] in "_$%"):
+        start -= 1
+    return code[start:cursorPos]
+
+
+##
+# Sorted (name, completion) entries. An entry can be added multiple times (e.g.
+# by a function which is defined twice): it is only removed with the last copy.
+##
+class CompletionIndex:
+    def __init__(self, completions=[]):
+        self.entries = []
+        self.counts = dict()
+        for completion in completions:
+            self.add(self.getName(completion), completion)
+
+    ## The name of a completion is the text up to the first separator: e.g. cube for "cube(size = 1);"
+    @staticmethod
+    def getName(completion):
+        return re.match(r"[\w$%]*", completion).group() or completion
+
+    def add(self, name, completion):
+        entry = (name, completion)
+        count = self.counts.get(entry, 0)
+        if count == 0:
+            insort(self.entries, entry)
+        self.counts[entry] = count+1
+
+    ## Adds many (name, completion) entries: the index is sorted once
+    def addAll(self, entries):
+        counts = self.counts
+        added = []
+        for entry in entries:
+            count = counts.get(entry, 0)
+            if count == 0:
+                added.append(entry)
+            counts[entry] = count+1
+        if added:
+            self.entries.extend(added)
+            self.entries.sort()
+
+    def remove(self, name, completion):
+        entry = (name, completion)
+        count = self.counts.get(entry, 0)
+        if count == 1:
+            del self.counts[entry]
+            del self.entries[bisect_left(self.entries, entry)]
+        elif count > 1:
+            self.counts[entry] = count-1
+
+    ## Provides the sorted (name, completion) entries for the names which start with the prefix
+    def find(self, prefix):
+        entries = self.entries
+        pos = bisect_left(entries, (prefix,))
+        # all names with the prefix are smaller than the prefix with the largest character
+        end = bisect_left(entries, (prefix+"\U0010ffff",), pos)
+        return entries[pos:end]
+
+    def complete(self, prefix):
+        return [completion for name, completion in self.find(prefix)]
+
+    def clear(self):
+        self.entries = []
+        self.counts = dict()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+##
+# Completions for the modules, functions and variables of a statement store. The
+# index is registered as listener of the store and is updated with each change.
+##
+class SymbolIndex(CompletionIndex):
+
+    ## Provides the (name, completion) of a statement or None if it does not define a symbol
+    @staticmethod
+    def getEntry(statement):
+        suffix = SYMBOL_SUFFIXES.get(statement.statementType)
+        name = statement.name
+        if suffix is not None and IDENTIFIER.match(name):
+            return (name, name+suffix)
+        return None
+
+    ## Listener of the StatementStore: oldStatement is None for a new statement
+    def statementChanged(self, oldStatement, newStatement):
+        if oldStatement is not None:
+            entry = self.getEntry(oldStatement)
+            if entry:
+                self.remove(*entry)
+        entry = self.getEntry(newStatement)
+        if entry:
+            self.add(*entry)
+
+    ## Listener of the StatementStore: all new entries are added before the old
+    ## ones are removed, so that a statement which is replaced twice keeps its count
+    def statementsChanged(self, changes):
+        getEntry = self.getEntry
+        self.addAll([entry for entry in [getEntry(newStatement) for oldStatement, newStatement in changes] if entry])
+        for oldStatement, newStatement in changes:
+            if oldStatement is not None:
+                entry = getEntry(oldStatement)
+                if entry:
+                    self.remove(*entry)
+
+    ## Listener of the StatementStore: all statements have been removed
+    def storeCleared(self):
+        self.clear()
+
+
+## Merges the results of multiple indexes: a completion is only listed once and
+## the result contains at most limit completions
+def findCompletions(indexes, prefix, limit=MAX_COMPLETIONS):
+    result = []
+    for name, completion in heapq.merge(*[index.find(prefix) for index in indexes]):
+        if not result or result[-1] != completion:
+            if len(result) >= limit:
+                break
+            result.append(completion)
+    return result
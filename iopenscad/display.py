@@ -0,0 +1,98 @@
+##
+# Virtual frame buffer (Xvfb) which is shared by all renders of a kernel. This
+# avoids that xvfb-run starts and stops a new X server for each render.
+#
+import os
+import shutil
+import select
+import logging
+import subprocess
+import threading
+
+## Prefix of the commands which need a virtual display
+XVFB_RUN = "xvfb-run --auto-servernum --server-num=99 "
+
+
+class VirtualDisplay:
+    def __init__(self, xvfbCommand="Xvfb", startTimeout=10):
+        self.xvfbCommand = xvfbCommand
+        self.startTimeout = startTimeout
+        self.process = None
+        self.display = None
+        self.failed = False
+        self.lock = threading.Lock()
+
+    ## Starts the X server: Xvfb selects a free display and reports it with -displayfd
+    def start(self):
+        if not shutil.which(self.xvfbCommand):
+            raise Exception("Command not found: "+self.xvfbCommand)
+        readFd, writeFd = os.pipe()
+        try:
+            self.process = subprocess.Popen([self.xvfbCommand, "-displayfd", str(writeFd),
+                "-screen", "0", "1024x768x24", "-nolisten", "tcp"], pass_fds=[writeFd],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                start_new_session=True)
+            os.close(writeFd)
+            writeFd = None
+            number = b""
+            while not number.endswith(b"\n"):
+                ready, _, _ = select.select([readFd], [], [], self.startTimeout)
+                data = os.read(readFd, 16) if ready else b""
+                if not data:
+                    raise Exception("Xvfb did not report a display")
+                number += data
+            self.display = ":"+number.decode("ascii").strip()
+            logging.info("Started Xvfb on display "+self.display)
+        except Exception:
+            self.stop()
+            raise
+        finally:
+            os.close(readFd)
+            if writeFd is not None:
+                os.close(writeFd)
+
+    def isRunning(self):
+        return self.process is not None and self.process.poll() is None
+
+    ## Provides the display: the server is started on the first call. If it can
+    ## not be started or if it has died we return None.
+    def getDisplay(self):
+        with self.lock:
+            if self.failed:
+                return None
+            if self.process is None:
+                try:
+                    self.start()
+                except Exception as err:
+                    logging.warning("Could not start Xvfb - using xvfb-run: "+str(err))
+                    self.failed = True
+                    return None
+            elif not self.isRunning():
+                logging.warning("Xvfb has stopped - using xvfb-run")
+                self.failed = True
+                self.stop()
+                return None
+            return self.display
+
+    ## Replaces the xvfb-run prefix of the command with the environment for the
+    ## shared display: returns the command and the environment
+    def prepare(self, command):
+        if command.startswith(XVFB_RUN):
+            display = self.getDisplay()
+            if display:
+                env = dict(os.environ)
+                env["DISPLAY"] = display
+                return command[len(XVFB_RUN):], env
+        return command, None
+
+    def stop(self):
+        process = self.process
+        self.process = None
+        self.display = None
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
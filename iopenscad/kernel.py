@@ -2,8 +2,18 @@
 ## Jupyter Kernel for OpenSCAD
 ##
 import os
+import uuid
+import hashlib
 import base64
+import logging
+import signal
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from iopenscad.parser import Parser
+from iopenscad.sweep import toGallery
+from iopenscad.completion import CompletionIndex, getPrefix, findCompletions
+from iopenscad.signatures import getInspectName
 from ipykernel.kernelbase import Kernel
 
 class IOpenSCAD(Kernel):
@@ -24,42 +34,83 @@ class IOpenSCAD(Kernel):
         "include <file>","use <file>",
         "module name() { ... }","function name() = ... ;"
     ]
+    # prefix index of the built-in completions
+    completions = CompletionIndex(complete)
     parser = None
     isSetup = False
+    # renders are executed in a separate thread, so that the event loop of the
+    # kernel stays responsive
+    renderExecutor = ThreadPoolExecutor(1, thread_name_prefix="render")
+    # full renders which replace a preview (progressive display)
+    fullRenderExecutor = ThreadPoolExecutor(1, thread_name_prefix="full-render")
+    # requests which are answered while a cell is rendering
+    concurrentRequests = ["complete_request", "inspect_request"]
+    isRendering = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # running full renders by cell id
+        self.fullRenders = dict()
+        # the toolchain detection runs while we wait for the first cell
+        self.setupParser()
+
+    def setupParser(self):
+        self.parser = Parser()
+        self.parser.setupInBackground()
+        self.parser.converter.outputListener = self.displayOutput
 
     ##
     # Executes the source code which is defined in a cell
     ##
-    def do_execute(self, code, silent,
+    async def do_execute(self, code, silent,
                    store_history=True,
                    user_expressions=None,
                    allow_stdin=False):
 
         # Setup parser
         if not self.parser:
-            self.parser = Parser()
-            self.parser.setup()
+            self.setupParser()
+
+        profiler = self.parser.profiler
+        profiler.start(self.execution_count)
+        try:
+            return await self.executeCode(code, silent)
+        finally:
+            profiler.finish()
 
+    async def executeCode(self, code, silent):
         resultObj = None
+        cellId = self.getCellId(code)
+        self.cancelFullRender(cellId)
         self.parser.parse(code)
         
         if not silent:
             # We send the standard output to the client.
+            if self.parser.sweep:
+                return await self.executeSweep()
+            if self.parser.animation:
+                return await self.executeAnimation()
             if self.parser.displayRendered:
                 self.displayMessages(self.parser)
                 self.parser.clearMessages()
-                resultFile = self.parser.renderMime()
-                if resultFile:
-                    resultObj = open(resultFile,'rb').read()
-                    if self.parser.mime=='text/plain':
-                        resultObj = resultObj.decode('utf-8')
-                    else:
-                        resultObj = base64.standard_b64encode(resultObj).decode('utf-8')
+                progressive = self.parser.progressive and not self.parser.renderPreview and self.parser.mime != 'text/plain'
+                if progressive:
+                    self.parser.renderPreview = True
+                resultObj = await self.render(self.renderResult)
 
                 if self.parser.getMessages().strip():
                     self.displayMessages(self.parser)
+                if self.parser.isAborted:
+                    return {'status': 'aborted',
+                            'execution_count': self.execution_count,
+                           }
                 if resultObj:
-                    self.displayImage(resultObj, self.parser.mime)
+                    displayId = None
+                    if progressive and not self.parser.isError:
+                        displayId = uuid.uuid4().hex
+                    self.displayImage(resultObj, self.parser.mime, displayId)
+                    if displayId:
+                        self.startFullRender(cellId, displayId)
                 else:
                     if self.parser.getSourceCode().strip():
                         self.displayError(os.linesep+self.parser.getSourceCode())
@@ -73,21 +124,173 @@ class IOpenSCAD(Kernel):
                 'user_expressions': {},
                }
 
+    ##
+    # Renders all combinations of the parameter sweep: png files are displayed
+    # as gallery, other results as list
+    ##
+    async def executeSweep(self):
+        self.displayMessages(self.parser)
+        self.parser.clearMessages()
+        results = await self.render(self.parser.renderSweep)
+        if self.parser.mime == 'image/png' and results:
+            self.sendResponse('display_data', {'data': {'text/html': toGallery(results)}, 'metadata': {}})
+        lines = [result.label+": "+result.fileName for result in results if result.fileName]
+        if lines:
+            self.parser.addMessages(os.linesep.join(lines))
+        self.displayMessages(self.parser)
+        status = 'aborted' if self.parser.isAborted else 'ok'
+        return {'status': status,
+                'execution_count': self.execution_count,
+                'payload': [],
+                'user_expressions': {},
+               }
+
+    ##
+    # Renders the frames of the animation and displays the animated image
+    ##
+    async def executeAnimation(self):
+        self.displayMessages(self.parser)
+        self.parser.clearMessages()
+        result = await self.render(self.parser.renderAnimation)
+        self.displayMessages(self.parser)
+        if result:
+            self.displayImage(self.encodeResult(result, self.parser.animation.getMime()), self.parser.animation.getMime())
+        status = 'aborted' if self.parser.isAborted else 'ok'
+        return {'status': status,
+                'execution_count': self.execution_count,
+                'payload': [],
+                'user_expressions': {},
+               }
+
+    ##
+    # Renders the current code and provides the result as string
+    ##
+    def renderResult(self):
+        resultObj = self.parser.renderMimeData()
+        if resultObj:
+            resultObj = self.encodeResult(resultObj, self.parser.mime)
+        return resultObj
+
+    ##
+    # Encodes the result of a render for the frontend: the time is added to the
+    # indicated profiler or to the profile of the current cell
+    ##
+    def encodeResult(self, data, mime, profiler=None):
+        with (profiler or self.parser.profiler).phase("encode"):
+            if mime=='text/plain':
+                return data.decode('utf-8')
+            return base64.standard_b64encode(data).decode('utf-8')
+
+    ##
+    # The id of the executed cell: if the frontend does not provide it we use
+    # a hash of the code, so that only the execution of the same code cancels
+    # the full render
+    ##
+    def getCellId(self, code):
+        try:
+            cellId = self.get_parent().get("metadata", {}).get("cellId")
+        except Exception:
+            cellId = None
+        return cellId or "code:"+hashlib.sha1(code.encode("utf-8")).hexdigest()
+
+    ##
+    # Starts the full render of the current display code in the background: the
+    # result replaces the preview with the indicated display id
+    ##
+    def startFullRender(self, cellId, displayId):
+        converter = self.parser.createConverter(background=True)
+        scadCommand, code = self.parser.getRenderInput(False)
+        mime = self.parser.mime
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.fullRenderExecutor, converter.convertData,
+            scadCommand, code, mime, self.parser.getDependencies())
+        fullRender = FullRender(converter, future, displayId, mime)
+        fullRender.task = asyncio.ensure_future(self.finishFullRender(cellId, fullRender))
+        self.fullRenders[cellId] = fullRender
+
+    async def finishFullRender(self, cellId, fullRender):
+        try:
+            data = await fullRender.future
+        except asyncio.CancelledError:
+            return
+        except Exception as err:
+            logging.warning("Full render failed: "+str(err))
+            return
+        finally:
+            if self.fullRenders.get(cellId) is fullRender:
+                del self.fullRenders[cellId]
+        converter = fullRender.converter
+        # the render has finished: its spool is no longer needed
+        converter.close()
+        if fullRender.isCancelled or converter.isAborted:
+            return
+        if converter.isError or not data:
+            logging.warning("Full render failed: "+converter.getMessages())
+            return
+        self.updateDisplay(self.encodeResult(data, fullRender.mime, converter.profiler), fullRender.mime, fullRender.displayId)
+
+    ##
+    # Stops the full render of a previous execution of the cell
+    ##
+    def cancelFullRender(self, cellId):
+        fullRender = self.fullRenders.pop(cellId, None)
+        if fullRender:
+            fullRender.cancel()
+
+    ##
+    # Executes the function in the render thread. An interrupt (SIGINT) cancels
+    # the running render instead of raising a KeyboardInterrupt.
+    ##
+    async def render(self, function, *args):
+        loop = asyncio.get_running_loop()
+        # the handler is installed before the render starts, so that no interrupt is lost
+        isMainThread = threading.current_thread() is threading.main_thread()
+        if isMainThread:
+            savedHandler = signal.signal(signal.SIGINT, self.onInterrupt)
+        self.isRendering = True
+        try:
+            return await loop.run_in_executor(self.renderExecutor, function, *args)
+        finally:
+            self.isRendering = False
+            if isMainThread:
+                signal.signal(signal.SIGINT, savedHandler)
+            self.parser.resetCancel()
+
+    def onInterrupt(self, signalNumber, frame):
+        self.parser.cancelRender()
+
+    ##
+    # ipykernel handles the requests of a shell one after the other: while a cell
+    # is rendering we answer completion and inspection requests right away. The
+    # output of the render still belongs to the cell.
+    ##
+    async def shell_main(self, subshell_id, msg):
+        if self.isRendering and self.getMessageType(msg) in self.concurrentRequests:
+            parent = self.get_parent("shell")
+            ident = self._get_shell_context_var(self._shell_parent_ident)
+            try:
+                await self.dispatch_shell(msg, subshell_id=subshell_id, concurrent=True)
+            finally:
+                self.set_parent(ident, parent, channel="shell")
+            return
+        await super().shell_main(subshell_id, msg)
+
+    ## Provides the msg_type of a serialized shell message or None
+    def getMessageType(self, msg):
+        try:
+            idents, frames = self.session.feed_identities(msg, copy=False)
+            return self.session.deserialize(frames, content=False, copy=False)["header"]["msg_type"]
+        except Exception:
+            return None
+
     ##
     # Determine completion result
     ##
     def do_complete(self, code, cursor_pos):
-        char = code[cursor_pos]
-        result = self.complete + self.parser.getModuleNames() + self.parser.lsCommands
-        result.sort()
-
-        # filter the result if necessary
-        if char.strip():
-            subset = []
-            for cmd in result:
-                if cmd.startswith(char):
-                    subset.append(cmd)
-            result = subset
+        # the identifier (or magic) before the cursor is replaced by the match
+        prefix = getPrefix(code, cursor_pos)
+        parser = self.parser
+        result = findCompletions([self.completions, parser.magicCompletions, parser.symbolCompletions], prefix)
 
         content = {
             # The list of all matches to the completion request, such as
@@ -96,7 +299,7 @@ class IOpenSCAD(Kernel):
 
             # The range of text that should be replaced by the above matches when a completion is accepted.
             # typically cursor_end is the same as cursor_pos in the request.
-            'cursor_start' : cursor_pos,
+            'cursor_start' : cursor_pos-len(prefix),
             'cursor_end' : cursor_pos,
 
             # status should be 'ok' unless an exception was raised during the request,
@@ -106,19 +309,43 @@ class IOpenSCAD(Kernel):
         }
         return content
 
+    ##
+    # Provides the signature and the leading comment of the module or function
+    # at the cursor: with detail_level>0 we also show the source code
+    ##
+    def do_inspect(self, code, cursor_pos, detail_level=0, omit_sections=()):
+        name = getInspectName(code, cursor_pos)
+        signature = self.parser.signatures.get(name) if name else None
+        data = {'text/plain': signature.str(detail_level>0)} if signature else {}
+        return {'status': 'ok',
+                'found': signature is not None,
+                'data': data,
+                'metadata': {}
+               }
+
     ##
     # Cleanup
     ##
     def do_shutdown(self, restart):
-        self.parser.close()
+        for cellId in list(self.fullRenders):
+            self.cancelFullRender(cellId)
+        if self.parser:
+            self.parser.shutdown()
 
     def displayInfo(self, info):
         stream_content = {'name': 'stdout', 'text': info}
-        self.send_response(self.iopub_socket, 'stream', stream_content)
+        self.sendResponse('stream', stream_content)
+
+    ##
+    # Output of the render process which is sent while rendering: OpenSCAD
+    # reports progress and echo() on stderr, so we display everything as info
+    ##
+    def displayOutput(self, name, text):
+        self.displayInfo(text)
 
     def displayError(self, error):
         stream_content = {'name': 'stderr', 'text': error}
-        self.send_response(self.iopub_socket, 'stream', stream_content)
+        self.sendResponse('stream', stream_content)
 
     def displayMessages(self, parser):
         if self.parser.isError:
@@ -127,31 +354,66 @@ class IOpenSCAD(Kernel):
             self.displayInfo(parser.getMessagesExt())
 
     
-    def displayImage(self, resultObj, mime):
+    def displayImage(self, resultObj, mime, displayId=None):
         if resultObj:
-            # We prepare the response with our rich
-            # data (the plot).
-            content = {
-                'source': 'kernel',
-
-                # This dictionary may contain
-                # different MIME representations of
-                # the output.
-                'data': {
-                    mime: resultObj
-                },
-
-                # We can specify the image size
-                # in the metadata field.
-                'metadata' : {
-                    mime : {
-                        'width': 600,
-                        'height': 400
-                    }
+            # We send the display_data message with
+            # the contents.
+            self.sendResponse('display_data', self.getDisplayContent(resultObj, mime, displayId))
+
+    ##
+    # Replaces the display with the indicated id: this is done by the full render
+    # in the background, which is not part of the profile of a cell
+    ##
+    def updateDisplay(self, resultObj, mime, displayId):
+        self.send_response(self.iopub_socket, 'update_display_data', self.getDisplayContent(resultObj, mime, displayId))
+
+    ## Sends the message on the iopub channel
+    def sendResponse(self, msgType, content):
+        with self.parser.profiler.phase("send"):
+            self.send_response(self.iopub_socket, msgType, content)
+
+    def getDisplayContent(self, resultObj, mime, displayId=None):
+        # We prepare the response with our rich
+        # data (the plot).
+        content = {
+            'source': 'kernel',
+
+            # This dictionary may contain
+            # different MIME representations of
+            # the output.
+            'data': {
+                mime: resultObj
+            },
+
+            # We can specify the image size
+            # in the metadata field.
+            'metadata' : {
+                mime : {
+                    'width': 600,
+                    'height': 400
                 }
             }
+        }
+        if displayId:
+            # the display can be replaced with update_display_data
+            content['transient'] = {'display_id': displayId}
+        return content
 
-            # We send the display_data message with
-            # the contents.
-            self.send_response(self.iopub_socket, 'display_data', content)
 
+##
+# Full render in the background which replaces the preview of a cell
+##
+class FullRender:
+    def __init__(self, converter, future, displayId, mime):
+        self.converter = converter
+        self.future = future
+        self.displayId = displayId
+        self.mime = mime
+        self.task = None
+        self.isCancelled = False
+
+    ## The render ends quickly, also if it has not been started yet: the task
+    ## closes the converter when it has finished
+    def cancel(self):
+        self.isCancelled = True
+        self.converter.stop()
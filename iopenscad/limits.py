@@ -0,0 +1,190 @@
+##
+# Resource limits for the render processes and the statistics of the executed
+# renders.
+#
+import os
+import sys
+import time
+import shutil
+import signal
+from collections import deque
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+## Messages of a render which failed to allocate memory
+MEMORY_ERRORS = ["std::bad_alloc", "ENOMEM", "Cannot allocate memory", "Out of memory"]
+
+
+##
+# Wall clock time (seconds), CPU time (seconds) and address space (MB) limits
+# for a render. A value of 0 means that there is no limit.
+##
+class RenderLimits:
+    names = ["time", "cpu", "memory"]
+
+    def __init__(self, time=0, cpu=0, memory=0):
+        self.time = time
+        self.cpu = cpu
+        self.memory = memory
+
+    ## Creates the limits with the settings from the environment
+    @classmethod
+    def fromEnvironment(cls):
+        limits = cls()
+        for name in cls.names:
+            value = os.environ.get("IOPENSCAD_"+name.upper()+"_LIMIT")
+            if value:
+                limits.set(name, value)
+        return limits
+
+    def set(self, name, value):
+        if name not in self.names:
+            raise Exception("Invalid limit: "+name)
+        number = float(value)
+        if number<0:
+            raise Exception("Invalid value for "+name+": "+value)
+        setattr(self, name, number)
+
+    ## Updates the limits from arguments in the format name=value
+    def update(self, args):
+        for arg in args:
+            name, sep, value = arg.partition("=")
+            if not sep:
+                raise Exception("Invalid argument: "+arg)
+            self.set(name.strip(), value.strip())
+
+    ## The CPU and memory limits are only supported with the resource limits of Unix
+    def hasProcessLimits(self):
+        return resource is not None and (self.cpu>0 or self.memory>0)
+
+    ## Arguments which execute the command with the CPU and memory limits, so that
+    ## they are already set when the command starts: prlimit(1) or, if it is not
+    ## installed, our launcher. The processes of the command inherit the limits.
+    def getArguments(self, args):
+        seconds = int(max(1, self.cpu)) if self.cpu>0 else 0
+        size = int(self.memory*1024*1024) if self.memory>0 else 0
+        prlimit = shutil.which("prlimit")
+        if prlimit:
+            options = []
+            if seconds:
+                options.append("--cpu={}:{}".format(seconds, seconds+5))
+            if size:
+                options.append("--as={}:{}".format(size, size))
+            return [prlimit]+options+["--"]+args
+        return [sys.executable, "-m", "iopenscad.limits", str(seconds), str(size)]+args
+
+    ## The CPU limit stops the process with SIGXCPU and with SIGKILL at the hard
+    ## limit: a SIGKILL only counts if the CPU time has reached the limit
+    def isCpuExceeded(self, stats):
+        if self.cpu<=0:
+            return False
+        xcpu = getattr(signal, "SIGXCPU", None)
+        kill = getattr(signal, "SIGKILL", None)
+        if xcpu is not None and stats.returnCode in [-xcpu, 128+xcpu]:
+            return True
+        return (kill is not None and stats.returnCode in [-kill, 128+kill]
+            and stats.cpuTime is not None and stats.cpuTime>=self.cpu)
+
+    ## A failed render has exceeded the memory limit if the peak memory is near the
+    ## limit or if the output reports a failed allocation
+    def isMemoryExceeded(self, stats, output):
+        if self.memory<=0:
+            return False
+        if stats.peakMemory is not None and stats.peakMemory>=0.9*self.memory:
+            return True
+        return any([error in output for error in MEMORY_ERRORS])
+
+    def info(self):
+        def fmt(value, unit):
+            return "{:g} {}".format(value, unit) if value>0 else "unlimited"
+        return "Render limits: time={}, cpu={}, memory={}".format(
+            fmt(self.time, "s"), fmt(self.cpu, "s"), fmt(self.memory, "MB"))
+
+
+##
+# Resource usage of a single render
+##
+class RenderStats:
+    def __init__(self, command, resultType, wallTime, cpuTime=None, peakMemory=None, returnCode=0):
+        self.timestamp = time.time()
+        self.command = command
+        # extension of the result file
+        self.resultType = resultType
+        self.wallTime = wallTime
+        self.cpuTime = cpuTime
+        # peak resident set size in MB
+        self.peakMemory = peakMemory
+        self.returnCode = returnCode
+
+    ## Determines the statistics from the result of os.wait4
+    @classmethod
+    def fromUsage(cls, command, resultType, wallTime, usage, returnCode):
+        cpuTime = None
+        peakMemory = None
+        if usage is not None:
+            cpuTime = usage.ru_utime+usage.ru_stime
+            # ru_maxrss is in KB on Linux and in bytes on macOS
+            factor = 1024*1024 if sys.platform == "darwin" else 1024
+            peakMemory = usage.ru_maxrss/factor
+        return cls(command, resultType, wallTime, cpuTime, peakMemory, returnCode)
+
+    def toDict(self):
+        return dict(self.__dict__)
+
+    def str(self):
+        result = "Render: {:.2f} s wall".format(self.wallTime)
+        if self.cpuTime is not None:
+            result += ", {:.2f} s CPU".format(self.cpuTime)
+        if self.peakMemory is not None:
+            result += ", {:.1f} MB peak RSS".format(self.peakMemory)
+        return result
+
+
+##
+# History of the renders of a session with a limited number of entries
+##
+class RenderHistory:
+    def __init__(self, maxEntries=1000):
+        self.entries = deque(maxlen=maxEntries)
+
+    def add(self, stats):
+        self.entries.append(stats)
+
+    ## Provides the last n entries
+    def last(self, n=None):
+        result = list(self.entries)
+        return result[-n:] if n else result
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def info(self, n=10):
+        lines = ["{:>4} {:>10} {:>10} {:>10} {:>6}  {}".format("#", "wall [s]", "cpu [s]", "rss [MB]", "rc", "type")]
+        entries = self.last(n)
+        start = len(self.entries)-len(entries)
+        for i, stats in enumerate(entries):
+            cpu = "{:.2f}".format(stats.cpuTime) if stats.cpuTime is not None else "-"
+            rss = "{:.1f}".format(stats.peakMemory) if stats.peakMemory is not None else "-"
+            lines.append("{:>4} {:>10.2f} {:>10} {:>10} {:>6}  {}".format(start+i+1, stats.wallTime, cpu, rss, stats.returnCode, stats.resultType))
+        return os.linesep.join(lines)
+
+
+## Launcher which sets the limits and executes the command:
+## python -m iopenscad.limits <cpu seconds> <address space bytes> <command> [args]
+def main(args):
+    seconds, size = int(args[0]), int(args[1])
+    if seconds>0:
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds+5))
+    if size>0:
+        resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    os.execvp(args[2], args[2:])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
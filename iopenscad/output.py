@@ -0,0 +1,57 @@
+##
+# Collects the output lines of a render process with a bounded memory: we keep
+# the first and the last lines and drop the lines in the middle.
+#
+import os
+from collections import deque
+
+
+class MessageBuffer:
+    def __init__(self, headLines=200, tailLines=200, maxLineLength=10000):
+        self.headLines = headLines
+        self.tailLines = tailLines
+        self.maxLineLength = maxLineLength
+        self.clear()
+
+    def clear(self):
+        self.head = []
+        self.tail = deque(maxlen=self.tailLines)
+        self.dropped = 0
+
+    def append(self, line):
+        if len(line)>self.maxLineLength:
+            line = line[0:self.maxLineLength]+" ..."+os.linesep
+        if len(self.head)<self.headLines:
+            self.head.append(line)
+        else:
+            if len(self.tail)==self.tail.maxlen:
+                self.dropped += 1
+            self.tail.append(line)
+
+    def __len__(self):
+        return len(self.head)+len(self.tail)+self.dropped
+
+    def getText(self):
+        result = "".join(self.head)
+        if self.dropped:
+            result += "... {} lines omitted ...".format(self.dropped)+os.linesep
+        result += "".join(self.tail)
+        return result
+
+
+##
+# Splits the data of a stream into lines: the last incomplete line is kept until
+# more data is available or the stream is closed.
+##
+class LineSplitter:
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.rest = ""
+
+    def feed(self, data):
+        text = self.rest+self.decoder.decode(data, final=not data)
+        lines = text.splitlines(keepends=True)
+        self.rest = ""
+        if data and lines and not lines[-1].endswith(("\n", "\r")):
+            self.rest = lines.pop()
+        return lines
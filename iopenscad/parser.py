@@ -5,13 +5,35 @@
 import urllib
 import os.path
 import subprocess
-import tempfile
 import os
 import re
+import time
+import codecs
+import signal
+import selectors
 import logging
+import threading
+import json
+import shutil
+import hashlib
+import shlex
 import urllib
 import urllib.request
-from iopenscad.scanner import Scanner
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from iopenscad.cache import RenderCache, IncludeCache, Spool, fingerprints, isOn, defaultConfigDir, EXTERNAL_INPUT_PATTERN
+from iopenscad.display import VirtualDisplay, XVFB_RUN
+from iopenscad.limits import RenderLimits, RenderStats, RenderHistory
+from iopenscad.output import MessageBuffer, LineSplitter
+from iopenscad.prune import Pruner
+from iopenscad.preview import PreviewSettings
+from iopenscad.profiler import Profiler
+from iopenscad.renderer import ProcessRenderer, FakeRenderer, rendererFromEnvironment
+from iopenscad.sweep import Sweep, SweepResult
+from iopenscad.animation import Animation
+from iopenscad.completion import CompletionIndex, SymbolIndex
+from iopenscad.signatures import SignatureIndex
+from iopenscad.scanner import Scanner, tokenType, WHITESPACE, NEWLINE, COMMENT
  
 
 ##
@@ -21,6 +43,16 @@ from iopenscad.scanner import Scanner
 ##     
 class IncludeLibrary:
     dictionary = dict()
+    cache = None
+    executor = ThreadPoolExecutor(4, thread_name_prefix="include")
+
+    ## The download cache is created with the first download, so that it uses the
+    ## environment of the running kernel
+    @classmethod
+    def getCache(self):
+        if self.cache is None:
+            self.cache = IncludeCache.fromEnvironment()
+        return self.cache
     
     ## Adds a library by name   
     @classmethod
@@ -50,9 +82,7 @@ class IncludeRef:
 
     def getContent(self):
         if not self.content:
-            f = urllib.request.urlopen(self.url)
-            self.content = f.read().decode(encoding='UTF-8') 
-            f.close()   
+            self.content = IncludeLibrary.getCache().fetch(self.url).decode(encoding='UTF-8')
         return self.content    
 
     def str(self):
@@ -79,8 +109,7 @@ class IncludeFile:
         if not os.path.isfile(name):
             self.createPath(name)
             self.url = url
-            f = urllib.request.urlopen(url)
-            self.content = f.read().decode(encoding='UTF-8')    
+            self.content = IncludeLibrary.getCache().fetch(url).decode(encoding='UTF-8')
             text_file = open(name, "wt")
             text_file.write(self.content)
             text_file.close()
@@ -118,36 +147,179 @@ class IncludeFile:
 # openjscad.
 ## 
 class MimeConverter:
-    def __init__(self):
+    def __init__(self, display=None):
         self.messages = ""
-        self.tmpFiles = []
+        # temporary files of the renders
+        self.spool = Spool.fromEnvironment()
         self.resultFile = None
         self.isError = False
+        self.cache = RenderCache.fromEnvironment()
+        self.display = display
+        self.process = None
+        self.isAborted = False
+        # a stopped converter aborts all renders
+        self.isStopped = False
+        # a cancel which arrives before the render has started: it is kept until resetCancel()
+        self.isCancelled = False
+        self.isTimeout = False
+        # seconds between SIGTERM and SIGKILL when a render is cancelled
+        self.killTimeout = 3
+        self.limits = RenderLimits.fromEnvironment()
+        self.history = RenderHistory()
+        self.stats = None
+        self.lock = threading.Lock()
+        # bounded buffer for the output of the render process
+        self.output = MessageBuffer()
+        # optional function(name, text) which receives the output while rendering
+        self.outputListener = None
+        # part of the messages which has already been sent to the outputListener
+        self.streamedOutput = ""
+        # output of the last render: it is stored in the render cache
+        self.renderOutput = ""
+        # seconds between two calls of the outputListener
+        self.outputInterval = 0.1
+        # the code is sent on stdin and the result is read from stdout
+        self.pipe = False
+        self.resultData = None
+        # phase times of the cells
+        self.profiler = Profiler.fromEnvironment()
+        # executes the renders: the scad command or a fake for benchmarks
+        self.renderer = rendererFromEnvironment()
+        # version of the detected toolchain: it is part of the cache key
+        self.version = None
 
     def clear(self):
         self.messages = ""
+        self.streamedOutput = ""
+        self.renderOutput = ""
         self.isError = False
+        self.isAborted = self.isStopped or self.isCancelled
 
-    def convert(self, scadCommand, scadCode, mime):
+    ## Converts the scad code: dependencies are the fingerprints of the used files
+    def convert(self, scadCommand, scadCode, mime, dependencies=[]):
         self.clear()
         if scadCode.strip():
             logging.info(scadCode)  
             resultExt = self.mimeToExtension(mime)
 
-            fd, self.resultFile = tempfile.mkstemp(suffix="."+resultExt, prefix=None, dir=None, text=True)
-            self.tmpFiles.append(self.resultFile)
-            
             if resultExt == 'txt':
-                with open(fd, 'w') as f:
+                self.resultFile = self.spool.createFile("."+resultExt)
+                with open(self.resultFile, 'w') as f:
                     f.write(scadCode)
-            else:
-                self.execute(scadCommand, scadCode)
+                return self.resultFile
+
+            with self.profiler.phase("cache"):
+                key = self.getCacheKey(scadCommand, mime, scadCode, dependencies)
+                cachedFile = self.getCachedFile(key, resultExt)
+            if cachedFile:
+                self.resultFile = cachedFile
+                return self.resultFile
+
+            self.resultFile = self.spool.createFile("."+resultExt)
+            self.execute(scadCommand, scadCode)
+            if key:
+                with self.profiler.phase("cache"):
+                    self.storeInCache(key, resultExt)
+                self.addCacheMessage("miss")
+            elif self.cache.active:
+                self.addCacheMessage("not cacheable")
             return self.resultFile
         else:
             logging.warning('Empty SCAD Code!')  
 
         return None
 
+    ## Converts the scad code and provides the result as bytes. If the toolchain
+    ## supports it, the code is sent on stdin and the result is read from stdout.
+    ## Otherwise we convert into a file in the spool directory.
+    def convertData(self, scadCommand, scadCode, mime, dependencies=[]):
+        resultExt = self.mimeToExtension(mime)
+        if resultExt == 'txt':
+            self.clear()
+            return scadCode.encode("utf-8") if scadCode.strip() else None
+        if not self.pipe:
+            return self.readResult(self.convert(scadCommand, scadCode, mime, dependencies))
+
+        self.clear()
+        self.resultFile = None
+        if not scadCode.strip():
+            logging.warning('Empty SCAD Code!')
+            return None
+        logging.info(scadCode)
+        with self.profiler.phase("cache"):
+            key = self.getCacheKey(scadCommand, mime, scadCode, dependencies)
+            cachedFile = self.getCachedFile(key, resultExt)
+        if cachedFile:
+            return self.readResult(cachedFile)
+
+        self.executePipe(scadCommand, scadCode, resultExt)
+        if key:
+            try:
+                if not self.isError and self.resultData:
+                    with self.profiler.phase("cache"):
+                        self.cache.putResultData(key, resultExt, self.resultData, self.renderOutput)
+            except Exception as err:
+                logging.warning("Could not store result in render cache: "+str(err))
+            self.addCacheMessage("miss")
+        elif self.cache.active:
+            self.addCacheMessage("not cacheable")
+        return self.resultData
+
+    ## Reads the result file: files in the spool are removed
+    def readResult(self, resultFile):
+        if not resultFile:
+            return None
+        with self.profiler.phase("read"):
+            with open(resultFile, "rb") as f:
+                self.resultData = f.read()
+            if self.spool.contains(resultFile):
+                self.spool.remove(resultFile)
+        return self.resultData
+
+    ## Provides None if the result is not cached: also if it depends on files
+    ## which can not be tracked (missing libraries, import or surface)
+    def getCacheKey(self, scadCommand, mime, scadCode, dependencies):
+        if not self.cache.active or dependencies is None or EXTERNAL_INPUT_PATTERN.search(scadCode):
+            return None
+        command = self.renderer.getCacheCommand(scadCommand)
+        if self.version:
+            command += " version="+self.version
+        return self.cache.key(command, mime, scadCode, dependencies)
+
+    ## Provides the file from the render cache and restores the messages of the render
+    def getCachedFile(self, key, resultExt):
+        if key is None:
+            return None
+        cachedFile = self.cache.get(key, resultExt)
+        if cachedFile:
+            self.cache.hits += 1
+            self.messages = self.cache.getMessages(key)
+            self.replayOutput(self.messages)
+            self.addCacheMessage("hit")
+            return cachedFile
+        self.cache.misses += 1
+        return None
+
+    ## Sends the stored output of a cached render to the outputListener
+    def replayOutput(self, output):
+        if self.outputListener is not None and output:
+            self.sendOutput([("stdout", output)])
+            self.streamedOutput += output
+
+    def addCacheMessage(self, status):
+        if self.messages and not self.messages.endswith(os.linesep):
+            self.messages += os.linesep
+        self.messages += "Render cache: "+status+os.linesep
+
+    ## Only successful results are stored in the render cache: the output of the
+    ## render is kept with the result
+    def storeInCache(self, key, resultExt):
+        try:
+            if not self.isError and os.path.getsize(self.resultFile)>0:
+                self.cache.putResult(key, resultExt, self.resultFile, self.renderOutput)
+        except Exception as err:
+            logging.warning("Could not store result in render cache: "+str(err))
+
     def saveAs(self, scadCommand, scadCode, fileName):
         self.resultFile = fileName
         self.execute(scadCommand, scadCode)
@@ -155,20 +327,230 @@ class MimeConverter:
     
     def execute(self, openSCADConvertCommand, scadCode):
         # Open the file for writing.
-        fd, inPath  = tempfile.mkstemp(suffix=".scad", prefix=None, dir=None, text=True)
-        with open(fd, 'w') as f:
+        inPath = self.spool.createFile(".scad")
+        with open(inPath, 'w') as f:
             f.write(scadCode)
+        try:
+            # openjscad example001.jscad -o test.stl
+            return self.run(openSCADConvertCommand, [inPath, "-o", self.resultFile],
+                os.path.splitext(self.resultFile)[1][1:])
+        finally:
+            self.spool.remove(inPath)
+
+    ## Sends the code on stdin and collects the result from stdout in resultData
+    def executePipe(self, openSCADConvertCommand, scadCode, resultExt):
+        # openscad --export-format png -o - -
+        return self.run(openSCADConvertCommand, ["--export-format", resultExt, "-o", "-", "-"],
+            resultExt, scadCode.encode("utf-8"))
 
-        command = openSCADConvertCommand+" "+inPath+" -o "+self.resultFile
-        # openjscad example001.jscad -o test.stl
-        p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        for line in p.stdout.readlines():
-            self.messages+=line.decode("utf-8") 
+    ## Splits the command into the arguments of the process
+    def getArguments(self, command, args):
+        env = None
+        if self.display:
+            # use the shared virtual display instead of xvfb-run
+            command, env = self.display.prepare(command)
+        return shlex.split(command, posix=os.name != "nt")+args, env
 
-        retval = p.wait()
+    ## Executes the command: with input data the output on stdout is the result
+    def run(self, openSCADConvertCommand, args, resultExt, inputData=None):
+        with self.profiler.phase("render"):
+            return self.renderer.run(self, openSCADConvertCommand, args, resultExt, inputData)
+
+    def runProcess(self, openSCADConvertCommand, args, resultExt, inputData=None):
+        args, env = self.getArguments(openSCADConvertCommand, args)
+        self.resultData = None
+        limits = self.limits
+        if limits.hasProcessLimits():
+            args = limits.getArguments(args)
+        self.isTimeout = False
+        start = time.perf_counter()
+        # the process gets its own process group, so that a cancel also stops
+        # the processes which are started by the command
+        # on Windows we can not select on pipes: so we just read a combined output
+        stderr = subprocess.STDOUT if os.name == "nt" else subprocess.PIPE
+        stdin = subprocess.PIPE if inputData is not None else subprocess.DEVNULL
+        try:
+            p = subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr, env=env, start_new_session=True)
+        except OSError as err:
+            self.messages += "Could not execute "+args[0]+": "+str(err)+os.linesep
+            self.isError = True
+            return 127
+        self.process = p
+        timer = None
+        if limits.time>0:
+            timer = threading.Timer(limits.time, self.stopOnTimeout, [p])
+            timer.daemon = True
+            timer.start()
+        if self.isAborted:
+            # cancelled before the process was started
+            self.cancel()
+        try:
+            self.readOutput(p, inputData)
+            retval, usage = self.wait(p)
+        finally:
+            if timer:
+                timer.cancel()
+            self.process = None
+            for stream in [p.stdin, p.stdout, p.stderr]:
+                if stream:
+                    stream.close()
+        # the output is kept for the render cache and the display of errors
+        output = self.output.getText()
+        self.renderOutput = output
+        self.messages += output
+        if self.outputListener is not None:
+            self.streamedOutput += output
         self.isError = retval != 0
-        os.remove(inPath)
+        self.addStats(RenderStats.fromUsage(openSCADConvertCommand, resultExt,
+            time.perf_counter()-start, usage, retval))
         return retval
+
+    ## Reads stdout and stderr of the process line by line until both are closed.
+    ## With input data we write it to stdin and stdout is collected in resultData.
+    def readOutput(self, p, inputData=None):
+        self.output.clear()
+        if p.stderr is None:
+            for data in iter(p.stdout.readline, b""):
+                line = data.decode("utf-8", "replace")
+                self.output.append(line)
+                self.sendOutput([("stdout", line)])
+            return
+        result = None
+        if inputData is None:
+            streams = {p.stdout.fileno(): ("stdout", LineSplitter(codecs.getincrementaldecoder("utf-8")("replace")))}
+        else:
+            result = []
+            streams = {p.stdout.fileno(): ("result", None)}
+        if p.stderr:
+            streams[p.stderr.fileno()] = ("stderr", LineSplitter(codecs.getincrementaldecoder("utf-8")("replace")))
+        pending = []
+        lastSent = time.monotonic()
+        with selectors.DefaultSelector() as selector:
+            for fd in streams:
+                selector.register(fd, selectors.EVENT_READ)
+            inputFd = None
+            if inputData is not None:
+                inputFd = p.stdin.fileno()
+                inputData = memoryview(inputData)
+                os.set_blocking(inputFd, False)
+                selector.register(inputFd, selectors.EVENT_WRITE)
+            while streams:
+                for key, events in selector.select(self.outputInterval):
+                    if key.fd == inputFd:
+                        inputData = self.writeInput(p, inputData)
+                        if not inputData:
+                            selector.unregister(inputFd)
+                            p.stdin.close()
+                            inputFd = None
+                        continue
+                    data = os.read(key.fd, 65536)
+                    name, splitter = streams[key.fd]
+                    if splitter is None:
+                        result.append(data)
+                    else:
+                        for line in splitter.feed(data):
+                            self.output.append(line)
+                            pending.append((name, line))
+                    if not data:
+                        selector.unregister(key.fd)
+                        del streams[key.fd]
+                if pending and (not streams or time.monotonic()-lastSent>=self.outputInterval):
+                    self.sendOutput(pending)
+                    pending = []
+                    lastSent = time.monotonic()
+        if result is not None:
+            self.resultData = b"".join(result)
+
+    ## Writes the next part of the input data: returns the remaining data
+    def writeInput(self, p, inputData):
+        try:
+            return inputData[os.write(p.stdin.fileno(), inputData):]
+        except BlockingIOError:
+            return inputData
+        except OSError:
+            # the process does not read its input any more
+            return None
+
+    ## Forwards the collected lines to the outputListener: one call per stream name
+    def sendOutput(self, lines):
+        if self.outputListener is None:
+            return
+        text = {}
+        for name, line in lines:
+            text.setdefault(name, []).append(line)
+        for name in text:
+            try:
+                self.outputListener(name, "".join(text[name]))
+            except Exception as err:
+                logging.warning("Could not send output: "+str(err))
+
+    ## Waits for the end of the process and determines the resource usage
+    def wait(self, p):
+        if not hasattr(os, "wait4"):
+            return p.wait(), None
+        if hasattr(os, "waitid"):
+            # wait without reaping, so that signals are never sent to a reused pid
+            os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+            with self.lock:
+                pid, status, usage = os.wait4(p.pid, 0)
+                p.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            pid, status, usage = os.wait4(p.pid, 0)
+            with self.lock:
+                p.returncode = os.waitstatus_to_exitcode(status)
+        return p.returncode, usage
+
+    ## Records the statistics and reports them together with exceeded limits
+    def addStats(self, stats):
+        self.stats = stats
+        self.history.add(stats)
+        limits = self.limits
+        if self.isTimeout:
+            self.messages += "Rendering stopped: the time limit of {:g} s has been exceeded".format(limits.time)+os.linesep
+        elif self.isError and not self.isAborted and limits.isCpuExceeded(stats):
+            self.messages += "Rendering stopped: the CPU limit of {:g} s has been exceeded".format(limits.cpu)+os.linesep
+        elif self.isError and not self.isAborted and limits.isMemoryExceeded(stats, self.renderOutput):
+            self.messages += "Rendering failed with a memory limit of {:g} MB".format(limits.memory)+os.linesep
+        self.messages += stats.str()+os.linesep
+
+    ## Stops the running render: this can be called from any thread
+    def cancel(self):
+        self.isCancelled = True
+        self.isAborted = True
+        self.terminate(self.process)
+
+    ## The following renders are no longer aborted by a previous cancel
+    def resetCancel(self):
+        self.isCancelled = False
+
+    ## Cancels the running render and all following renders
+    def stop(self):
+        self.isStopped = True
+        self.cancel()
+
+    def stopOnTimeout(self, p):
+        self.isTimeout = True
+        self.terminate(p)
+
+    ## Sends SIGTERM to the process group and SIGKILL if it is still running after the killTimeout
+    def terminate(self, p):
+        if p is not None and p.returncode is None:
+            self.sendSignal(p, signal.SIGTERM)
+            timer = threading.Timer(self.killTimeout, self.sendSignal, [p, getattr(signal, "SIGKILL", signal.SIGTERM)])
+            timer.daemon = True
+            timer.start()
+
+    def sendSignal(self, process, signalNumber):
+        with self.lock:
+            if process.returncode is not None:
+                return
+            try:
+                if hasattr(os, "killpg"):
+                    os.killpg(process.pid, signalNumber)
+                else:
+                    process.terminate()
+            except OSError as err:
+                logging.warning(err)
     
     def mimeToExtension(self, mime):
         list = mime.split("/")
@@ -183,39 +565,142 @@ class MimeConverter:
     
     def getMessages(self):
         return self.messages
+
+    ## Messages without the output which has been streamed to the outputListener:
+    ## with an error the complete output is reported
+    def getUnsentMessages(self):
+        if self.isError or not self.streamedOutput:
+            return self.messages
+        return self.messages.replace(self.streamedOutput, "", 1)
     
     def close(self):
-        for file in self.tmpFiles:
-            try:
-                os.remove(file)
-            except Exception as err:
-                logging.error(err)  
-
-        self.tmpFiles = []
+        self.spool.close()
           
 
 class Setup:
+    commands = ["openscad", "openjscad"]
+    executor = ThreadPoolExecutor(1, thread_name_prefix="setup")
+    # version of the content of the config file
+    format = 2
+
+    def __init__(self, configFile=None):
+        self.configFile = configFile or os.path.join(defaultConfigDir(), "toolchain.json")
+
     def setup(self, scadCommand):
         # if the scadCommand is defined there is nothing to do
         if scadCommand:
             return scadCommand
-        
-        mc = MimeConverter()
-        testSCAD = "cube([1,1,1]);"
+        return self.getCommand(self.getToolchain())
 
-        # check for openscad
-        scadCommand = "openscad"
-        if mc.convert(scadCommand,testSCAD,"image/png")!=None:
-            return self.openSCADLinux(scadCommand)
-        
-        # check for openjscad
-        scadCommand = "openjscad"
-        if mc.convert(scadCommand, testSCAD,"image/png")!=None:
-            return scadCommand
+    ## Checks if the code can be sent on stdin and the result read from stdout
+    def usePipe(self, toolchain):
+        return os.name != "nt" and toolchain.get("capabilities", {}).get("pipe", False) and isOn(os.environ.get("IOPENSCAD_PIPE"))
+
+    ## Starts the detection in a background thread: returns a Future with the toolchain
+    def setupInBackground(self):
+        return self.executor.submit(self.getToolchain)
+
+    ## Provides the command which is used to render with the toolchain
+    def getCommand(self, toolchain):
+        name = toolchain["name"]
+        if name == "openscad" and toolchain.get("binary"):
+            return self.openSCADLinux(name)
+        return name
+
+    ## Provides the toolchain from the config file or detects it
+    def getToolchain(self):
+        fingerprint = self.getFingerprint()
+        toolchain = self.loadToolchain()
+        if toolchain is None or toolchain.get("fingerprint") != fingerprint or toolchain.get("format") != self.format:
+            toolchain = self.detect()
+            toolchain["fingerprint"] = fingerprint
+            toolchain["format"] = self.format
+            self.saveToolchain(toolchain)
+        return toolchain
+
+    ## The path and the modification time of the installed commands
+    def getFingerprint(self):
+        result = []
+        for name in self.commands:
+            path = shutil.which(name)
+            if path:
+                try:
+                    result.append([name, path, os.stat(path).st_mtime_ns])
+                except OSError:
+                    pass
+        return result
+
+    def loadToolchain(self):
+        try:
+            with open(self.configFile) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def saveToolchain(self, toolchain):
+        try:
+            os.makedirs(os.path.dirname(self.configFile), exist_ok=True)
+            tmpFile = self.configFile+".tmp"
+            with open(tmpFile, "w") as f:
+                json.dump(toolchain, f, indent=2)
+            os.replace(tmpFile, self.configFile)
+        except OSError as err:
+            logging.warning("Could not save the toolchain: "+str(err))
+
+    ## Determines the first command which can render a png. If none of them is
+    ## working we use the first installed command.
+    def detect(self):
+        result = None
+        for name in self.commands:
+            path = shutil.which(name)
+            if path:
+                toolchain = {"name": name, "binary": path, "version": self.getVersion(path)}
+                toolchain["capabilities"] = {"png": self.probe(self.getCommand(toolchain))}
+                if toolchain["capabilities"]["png"]:
+                    if name == "openscad":
+                        toolchain["capabilities"]["pipe"] = self.probePipe(self.getCommand(toolchain))
+                    return toolchain
+                if result is None:
+                    result = toolchain
 
         # Default command if nothing is supported
-        scadCommand = "openscad"
-        return scadCommand
+        if result is None:
+            result = {"name": "openscad", "binary": None, "version": None, "capabilities": {}}
+        return result
+
+    def getVersion(self, path):
+        try:
+            p = subprocess.run([path, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, timeout=30)
+            match = re.search(r"\d+(\.\d+)+", p.stdout.decode("utf-8", "replace"))
+            return match.group() if match else None
+        except (OSError, subprocess.SubprocessError) as err:
+            logging.warning(err)
+            return None
+
+    ## Test render of a cube: the temporary files are removed
+    def probe(self, scadCommand):
+        mc = MimeConverter()
+        mc.cache.active = False
+        try:
+            result = mc.convert(scadCommand, "cube([1,1,1]);", "image/png")
+            return result is not None and not mc.isError and os.path.getsize(result)>0
+        except Exception as err:
+            logging.warning(err)
+            return False
+        finally:
+            mc.close()
+
+    ## Test render of a cube from stdin to stdout (supported since OpenSCAD 2021.01)
+    def probePipe(self, scadCommand):
+        mc = MimeConverter()
+        mc.cache.active = False
+        mc.pipe = True
+        try:
+            result = mc.convertData(scadCommand, "cube([1,1,1]);", "image/png")
+            return bool(result) and not mc.isError and result.startswith(b"\x89PNG")
+        except Exception as err:
+            logging.warning(err)
+            return False
 
     def openSCADLinux(self, scadCommand):
         from sys import platform
@@ -224,7 +709,7 @@ class Setup:
                 os.environ['DISPLAY']
                 return scadCommand
             except KeyError:
-                return "xvfb-run --auto-servernum --server-num=99 openscad"
+                return XVFB_RUN+"openscad"
         return scadCommand
 
 
@@ -262,6 +747,105 @@ class Statement:
     def str(self):
         return self.sourceCode
 
+
+
+##
+# Ordered list of statements. Modules, assignments, comments and top level
+# statements are indexed by (statementType, name), so that a new definition
+# replaces the existing one at the same position without searching the list.
+##
+class StatementStore:
+    replaceableTypes = ["module","=","comment","-"]
+
+    def __init__(self):
+        self.version = 0
+        # objects with statementChanged(oldStatement, newStatement),
+        # statementsChanged(changes) and storeCleared()
+        self.listeners = []
+        self.clear()
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    def clear(self):
+        self.statements = []
+        # (statementType, name) -> position in statements
+        self.index = dict()
+        # statementType -> list of statements of this type
+        self.typeIndex = dict()
+        # (statementType, name) -> position in the list of the typeIndex
+        self.typePositions = dict()
+        self.moduleNames = []
+        # the assembled source code is created on demand and the line count
+        # is updated with each change
+        self.sourceCode = ""
+        self.lineCount = 0
+        self.version += 1
+        for listener in self.listeners:
+            listener.storeCleared()
+
+    def insert(self, newStatement):
+        oldStatement = self.add(newStatement)
+        for listener in self.listeners:
+            listener.statementChanged(oldStatement, newStatement)
+
+    ## Inserts many statements (e.g. of a library): each listener gets the list of
+    ## (oldStatement, newStatement) changes with a single call
+    def insertAll(self, statements):
+        changes = [(self.add(statement), statement) for statement in statements]
+        for listener in self.listeners:
+            listener.statementsChanged(changes)
+
+    ## Adds or replaces the statement without informing the listeners: returns
+    ## the replaced statement or None
+    def add(self, newStatement):
+        statementType = newStatement.statementType
+        key = (statementType, newStatement.name)
+        statementsOfType = self.typeIndex.setdefault(statementType, [])
+        self.sourceCode = None
+        self.lineCount += newStatement.sourceCode.count('\n')
+        self.version += 1
+        if statementType in self.replaceableTypes:
+            pos = self.index.get(key)
+            if pos is not None:
+                oldStatement = self.statements[pos]
+                self.lineCount -= oldStatement.sourceCode.count('\n')
+                self.statements[pos] = newStatement
+                statementsOfType[self.typePositions[key]] = newStatement
+                return oldStatement
+            self.index[key] = len(self.statements)
+            self.typePositions[key] = len(statementsOfType)
+
+        self.statements.append(newStatement)
+        statementsOfType.append(newStatement)
+        if statementType == "module":
+            self.moduleNames.append(newStatement.name+"();")
+        return None
+
+    ## Provides the source code of all statements (with normalized spaces)
+    def getSourceCode(self):
+        if self.sourceCode is None:
+            result = "".join([elem.sourceCode for elem in self.statements])
+            self.sourceCode = result.replace(u'\xa0', u' ')
+        return self.sourceCode
+
+    def getLineCount(self):
+        return self.lineCount
+
+    ## Provides the (unmodifiable) list of statements of the indicated type
+    def getStatementsOfType(self, statementType):
+        return self.typeIndex.get(statementType, [])
+
+    ## Provides the (unmodifiable) list of module calls
+    def getModuleNames(self):
+        return self.moduleNames
+
+    def getStatements(self):
+        return self.statements
+
+    def __len__(self):
+        return len(self.statements)
+
     
 ## 
 # The kernal can submit the same code multiple times. The major goal of this parser 
@@ -269,41 +853,100 @@ class Statement:
 ##
 
 class Parser:
-    lsCommands = ["%clear", "%display", "%displayCode","%%display","%%displayCode", "%mime", "%command", "%lsmagic", "%include", "%use", "%saveAs"]
+    lsCommands = ["%clear", "%display", "%displayCode","%%display","%%displayCode", "%mime", "%command", "%lsmagic", "%include", "%use", "%saveAs", "%cache", "%limits", "%renderStats", "%spool", "%prune", "%preview", "%displayPreview", "%%displayPreview", "%displayFull", "%progressive", "%sweep", "%animate", "%profile", "%renderer"]
+    # parsed statements of the included libraries by the hash of their content
+    libraryStatements = OrderedDict()
+    maxLibraries = 50
+    libraryLock = threading.Lock()
         
-    def __init__(self):
-        self.statements = []
+    def __init__(self, converter=None):
+        self.store = StatementStore()
+        # completions for the magics and the defined symbols
+        self.magicCompletions = CompletionIndex(self.lsCommands)
+        self.symbolCompletions = SymbolIndex()
+        self.store.addListener(self.symbolCompletions)
+        # signatures and comments of the modules and functions for inspect requests
+        self.signatures = SignatureIndex()
+        self.store.addListener(self.signatures)
         self.tempStatement = Statement("-",[])
+        self.sourceCode = None
+        self.sourceVersion = None
         self.messages = ""
         self.mime = "image/png"
-        self.converter = MimeConverter()
+        self.converter = converter or MimeConverter(VirtualDisplay())
+        self.display = self.converter.display
+        self.profiler = self.converter.profiler
         self.scadCommand = ""
+        self.toolchain = None
+        self.setupFuture = None
         self.isError = False
+        self.isAborted = False
         self.displayRendered = False
         self.scanner = Scanner()
+        # downloads of the includes of the current cell by url
+        self.includeFutures = dict()
+        # render only the statements which are needed by the display code
+        self.prune = False
+        self.pruner = Pruner()
+        # preview renders for the session (preview) or the current cell (renderPreview)
+        self.preview = False
+        self.renderPreview = False
+        self.previewSettings = PreviewSettings()
+        # display code of the last preview render
+        self.lastPreview = None
+        # the kernel displays a preview first which is replaced by the full render
+        self.progressive = False
+        # parameter sweep of the current cell
+        self.sweep = None
+        self.animation = None
+        # the display code of the current cell is not rendered (e.g. invalid %sweep)
+        self.skipRender = False
+        self.sweepConverters = []
+        self.lock = threading.Lock()
 
 
     def getStatements(self):
-        return self.statements
+        return self.store.getStatements()
 
     def getStatementsOfType(self, statementType):
-        result = []
-        for s in self.statements:
-            if s.statementType == statementType:
-                result.append(s)
-        return result
+        return self.store.getStatementsOfType(statementType)
 
     def getSourceCode(self):
-        ## persistend code
-        result = "".join([elem.sourceCode for elem in self.getStatements()]) 
-        result += os.linesep
-        ## temporary display code
-        result += self.tempStatement.sourceCode
-        result = result.replace(u'\xa0', u' ')
+        if self.sourceCode is None or self.sourceVersion != self.store.version:
+            ## persistend code
+            result = self.store.getSourceCode()
+            result += os.linesep
+            ## temporary display code
+            result += self.tempStatement.sourceCode.replace(u'\xa0', u' ')
+            self.sourceCode = result
+            self.sourceVersion = self.store.version
+        return self.sourceCode
+
+    ## Provides the code which is rendered: in the prune mode we leave out the
+    ## statements which are not needed by the display code
+    def getRenderCode(self):
+        sourceCode = self.getSourceCode()
+        if not self.prune:
+            return sourceCode
+        statements = self.store.getStatements()
+        lines = []
+        for statement in self.pruner.prune(statements, self.tempStatement):
+            code = statement.sourceCode
+            lines.append(code if code.endswith(("\n", "\r")) else code+os.linesep)
+        result = "".join(lines).replace(u'\xa0', u' ')
+        result += os.linesep + self.tempStatement.sourceCode.replace(u'\xa0', u' ')
+        self.addMessages("Pruned {} of {} statements ({} of {} bytes)".format(
+            len(statements)-len(lines), len(statements),
+            max(len(sourceCode.encode("utf-8"))-len(result.encode("utf-8")), 0), len(sourceCode.encode("utf-8"))))
         return result
-    
+
     def lineCount(self):
-        return self.getSourceCode().count('\n') 
+        return self.store.getLineCount() + os.linesep.count('\n') + self.tempStatement.sourceCode.count('\n')
+
+    ## Defines the temporary (display) code which is not stored
+    def setTempStatement(self, statement):
+        self.tempStatement = statement
+        self.sourceCode = None
 
     def addMessages(self, newMessage):
         if self.messages.strip():
@@ -324,97 +967,166 @@ class Parser:
     def clearMessages(self):
         self.messages = ""
         self.isError = False
+        self.isAborted = False
    
     def parse(self, scad):
+        with self.profiler.phase("parse"):
+            self.parseCode(scad)
+
+    def parseCode(self, scad):
         self.displayRendered = False
+        self.renderPreview = self.preview
+        self.sweep = None
+        self.animation = None
+        self.skipRender = False
         self.clearMessages()
-        self.tempStatement = Statement("-",[])
-        words = self.scanner.scann(scad)
-        end = 1
-        while len(words)>0 and end>0:
-            if not words[0].strip():
+        self.setTempStatement(Statement("-",[]))
+        with self.profiler.phase("scan"):
+            tokens = self.scanner.tokenize(scad, blocks=True)
+        words = tokens.words
+        scanner = self.scanner
+        self.prefetchIncludes(words)
+        pos = 0
+        while pos<len(words):
+            word = words[pos]
+            wordType = tokenType(word)
+            if wordType in [WHITESPACE, NEWLINE]:
                 ## collect white space
-                end = self.scanner.findEndWhiteSpace(words)
-                if "".join(words[0:end])!="":
-                    statement = Statement("whitespace",words[0:end])
-                    self.insertStatement(statement)
-            elif "/*" == "".join(words[0:3]):
-                end = self.scanner.findEndString(words,"*/", 3)
-                end = self.scanner.findEndWithNewLine(words,end)
-                statement = Statement("comment", words[0:end])
+                end = scanner.findEndWhiteSpace(words, pos)
+                statement = Statement("whitespace",words[pos:end])
                 self.insertStatement(statement)
-            elif "//" == "".join(words[0:3]):
-                end = self.scanner.findEnd1(words,os.linesep)
-                statement = Statement("comment", words[0:end])
+            elif wordType == COMMENT:
+                ## a comment is a single token
+                if word.startswith("/*"):
+                    end = scanner.findEndWithNewLine(words,pos+1)
+                else:
+                    end = scanner.findEndOfLine(words, pos)
+                statement = Statement("comment", words[pos:end])
                 self.insertStatement(statement)
-            elif "%include" == "".join(words[0:2]):
-                end = self.processInclude(words)
-            elif "%use" == "".join(words[0:2]):
-                end = self.processUse(words)
-            elif words[0] in ["include", "use"]:
-                end = self.statements.index(";")
-                end = self.scanner.findEndWithNewLine(words,end)
-                statement = Statement(words[0], words[0:end])
+            elif word == "%include":
+                end = self.processInclude(words, pos)
+            elif word == "%use":
+                end = self.processUse(words, pos)
+            elif word in ["include", "use"]:
+                end = scanner.findEndOfInclude(words, pos)
+                end = scanner.findEndWithNewLine(words,end)
+                statement = Statement(word, words[pos:end])
                 self.insertStatement(statement)
-            elif words[0] == "module":
-                end = self.scanner.findEnd2(words,"{","}")
-                end = self.scanner.findEndWithNewLine(words,end)
-                statement = Statement("module",words[0:end])
+            elif word == "module":
+                end = scanner.findEndOfStatement(words, pos)
+                end = scanner.findEndWithNewLine(words,end)
+                statement = Statement("module",words[pos:end])
                 self.insertStatement(statement)
-            elif "%clear" == "".join(words[0:2]):
-                end = 2                
+            elif word == "%clear":
+                end = pos+1
                 self.close()
                 self.addMessages( "SCAD code buffer has been cleared")
-            elif "%%displayCode" == "".join(words[0:4]):
+            elif word == "%%displayCode":
                 self.displayRendered = True
                 end = len(words)
-                self.tempStatement = Statement(None,words[4:end])
+                self.setTempStatement(Statement(None,words[pos+1:end]))
                 self.addMessages( self.getSourceCode())
-            elif "%displayCode" == "".join(words[0:2]):
-                end = self.scanner.findEnd1(words,os.linesep)
-                tmpCode = "".join(words[2:end])
+            elif word == "%displayCode":
+                end = scanner.findEndOfLine(words, pos)
+                tmpCode = "".join(words[pos+1:end])
                 self.addMessages( self.getSourceCode()+tmpCode)
-            elif "%display" == "".join(words[0:2]):
+            elif word == "%display":
+                self.displayRendered = True
+                end = scanner.findEndOfLine(words, pos)
+                self.setTempStatement(Statement(None,words[pos+1:end]))
+            elif word == "%%display":
                 self.displayRendered = True
-                end = self.scanner.findEnd1(words,os.linesep)
-                self.tempStatement = Statement(None,words[2:end])
-            elif "%%display" == "".join(words[0:4]):
+                end = len(words)
+                self.setTempStatement(Statement(None,words[pos+1:end]))
+            elif word == "%displayPreview":
+                self.displayRendered = True
+                self.renderPreview = True
+                end = scanner.findEndOfLine(words, pos)
+                self.setTempStatement(Statement(None,words[pos+1:end]))
+            elif word == "%%displayPreview":
                 self.displayRendered = True
+                self.renderPreview = True
                 end = len(words)
-                self.tempStatement = Statement(None,words[4:end])
-            elif "%saveAs" == "".join(words[0:2]):
-                end = self.processSaveAs(words)
-            elif "%mime" == "".join(words[0:2]):
-                end = self.scanner.findEnd1(words,os.linesep)
-                mime = "".join(words[2:end]).strip()
+                self.setTempStatement(Statement(None,words[pos+1:end]))
+            elif word == "%displayFull":
+                end = self.processDisplayFull(words, pos)
+            elif word == "%preview":
+                end = self.processPreview(words, pos)
+            elif word == "%sweep":
+                end = self.processSweep(words, pos)
+            elif word == "%animate":
+                end = self.processAnimate(words, pos)
+            elif word == "%profile":
+                end = self.processProfile(words, pos)
+            elif word == "%renderer":
+                end = self.processRenderer(words, pos)
+            elif word == "%progressive":
+                end = scanner.findEndOfLine(words, pos)
+                value = "".join(words[pos+1:end]).strip()
+                if value:
+                    self.progressive = isOn(value)
+                self.addMessages("Progressive display: "+("on" if self.progressive else "off"))
+            elif word == "%saveAs":
+                end = self.processSaveAs(words, pos)
+            elif word == "%mime":
+                end = scanner.findEndOfLine(words, pos)
+                mime = "".join(words[pos+1:end]).strip()
                 if mime:
                     self.mime = mime
                 self.addMessages( "The display mime type is '"+self.mime+"'")
-            elif "%command" == "".join(words[0:2]):
-                end = self.scanner.findEnd1(words,os.linesep)
-                command =  "".join(words[2:end]).strip()
+            elif word == "%command":
+                end = scanner.findEndOfLine(words, pos)
+                command =  "".join(words[pos+1:end]).strip()
                 if command:
                     self.setScadCommand(command)
                 self.addMessages("The display command is '"+self.getScadCommand()+"'")
-            elif "%lsmagic" == "".join(words[0:2]):
-                end = 2
+            elif word == "%cache":
+                end = self.processCache(words, pos)
+            elif word == "%spool":
+                end = self.processSpool(words, pos)
+            elif word == "%prune":
+                end = self.processPrune(words, pos)
+            elif word == "%limits":
+                end = self.processLimits(words, pos)
+            elif word == "%renderStats":
+                end = scanner.findEndOfLine(words, pos)
+                count = "".join(words[pos+1:end]).strip()
+                self.addMessages(self.converter.history.info(int(count) if count.isdigit() else 10))
+            elif word == "%lsmagic":
+                end = pos+1
                 commandsTxt = " ".join(self.lsCommands)
                 self.addMessages("Available Commands: "+ commandsTxt )
             else: 
-                end = self.processDefault(words)
+                end = self.processDefault(words, pos)
 
-            ## use unprocessed tail for next iteration    
-            words = words[end:]
+            ## continue with the unprocessed tail: stop if there is no progress
+            if end<=pos:
+                break
+            pos = end
 
+        if self.skipRender:
+            self.displayRendered = False
+
+    ## Renders the code into a file: returns the file name
     def renderMime(self):
+        return self.renderWith(self.converter.convert)
+
+    ## Renders the code and returns the result as bytes
+    def renderMimeData(self):
+        return self.renderWith(self.converter.convertData)
+
+    def renderWith(self, convert):
         result = None
         try:
-            code = self.getSourceCode().strip()
-
+            scadCommand, code = self.getRenderInput(self.renderPreview)
             if code:
-                result = self.converter.convert(self.scadCommand, code, self.mime)
-                self.addMessages(self.converter.getMessages())
+                result = convert(scadCommand, code, self.mime, self.getDependencies())
+                self.addMessages(self.converter.getUnsentMessages())
                 self.isError = self.converter.isError
+                self.isAborted = self.converter.isAborted
+                if self.isAborted:
+                    self.addMessages("Rendering has been aborted")
+                    result = None
 
         except Exception as err:
             self.isError = True
@@ -422,103 +1134,488 @@ class Parser:
                
         return result
 
+    ## Provides the command and the code for a render of the current display code
+    def getRenderInput(self, preview):
+        code = self.getRenderCode().strip()
+        scadCommand = self.getScadCommand()
+        if code and preview:
+            code = self.previewSettings.rewrite(code)
+            scadCommand = self.previewSettings.getCommand(scadCommand, self.mime)
+            self.lastPreview = self.tempStatement
+            self.addMessages(self.previewSettings.info())
+        return scadCommand, code
+
+    ## Converter for renders which run in parallel to the renders of this parser. A
+    ## background render (e.g. the full render of the progressive display) has its
+    ## own profiler, so that it is not timed in the profile of the current cell.
+    def createConverter(self, background=False):
+        converter = MimeConverter(self.display)
+        for name in ["cache", "limits", "history", "pipe", "profiler", "renderer", "version"]:
+            setattr(converter, name, getattr(self.converter, name))
+        if background:
+            converter.profiler = Profiler()
+        # the eviction of a shared spool would remove the files of the other renders
+        spool = self.converter.spool
+        converter.spool = Spool(spool.parent, spool.maxBytes, spool.maxFiles)
+        return converter
+
+    ## Renders all combinations of the sweep in parallel: returns the SweepResults.
+    ## The results are also written to the output directory of the sweep.
+    def renderSweep(self):
+        sweep = self.sweep
+        self.converter.clear()
+        self.isError = False
+        self.isAborted = False
+        start = time.perf_counter()
+        results = []
+        try:
+            scadCommand, code = self.getRenderInput(self.renderPreview)
+            if not code:
+                raise Exception("There is no code to render")
+            dependencies = self.getDependencies()
+            if sweep.outputDir:
+                os.makedirs(sweep.outputDir, exist_ok=True)
+            with ThreadPoolExecutor(sweep.jobs, thread_name_prefix="sweep") as executor:
+                futures = [executor.submit(self.renderSweepCombination, sweep, combination, scadCommand, self.mime, code, dependencies)
+                    for combination in sweep.combinations()]
+                results = [future.result() for future in futures]
+        except Exception as err:
+            self.isError = True
+            self.addMessages("Could not render the sweep: "+str(err))
+            return results
+
+        self.isAborted = self.converter.isAborted
+        errors = [result for result in results if result.isError]
+        self.isError = len(errors)>0 and not self.isAborted
+        for result in errors:
+            self.addMessages(result.label+": "+result.messages.strip())
+        if self.isAborted:
+            self.addMessages("Rendering has been aborted")
+        self.addMessages("Sweep: {} renders, {} from the render cache, {} errors in {:.2f} s".format(
+            len(results), len([r for r in results if r.isCached]), len(errors), time.perf_counter()-start))
+        return results
+
+    ## Renders the frames of the animation in parallel and provides the animated
+    ## image. At most 2 frames per job are rendered ahead of the assembled frames.
+    def renderAnimation(self):
+        animation = self.animation
+        self.converter.clear()
+        self.isError = False
+        self.isAborted = False
+        start = time.perf_counter()
+        frames = []
+        result = None
+        try:
+            scadCommand, code = self.getRenderInput(self.renderPreview)
+            if not code:
+                raise Exception("There is no code to render")
+            dependencies = self.getDependencies()
+            combinations = animation.combinations()
+            writer = animation.createWriter()
+            window = 2*animation.jobs
+            futures = dict()
+            with ThreadPoolExecutor(animation.jobs, thread_name_prefix="animation") as executor:
+                for frame in range(len(combinations)):
+                    # at most window frames are rendered or waiting to be added
+                    for ahead in range(frame, min(frame+window, len(combinations))):
+                        if ahead not in futures:
+                            futures[ahead] = executor.submit(self.renderSweepCombination, animation, combinations[ahead],
+                                scadCommand, "image/png", code, dependencies)
+                    frameResult = futures.pop(frame).result()
+                    frames.append(frameResult)
+                    if frameResult.isError:
+                        for future in futures.values():
+                            future.cancel()
+                        break
+                    writer.addFrame(frameResult.data)
+                    frameResult.data = None
+            self.isAborted = self.converter.isAborted
+            errors = [frameResult for frameResult in frames if frameResult.isError]
+            if self.isAborted:
+                self.addMessages("Rendering has been aborted")
+            elif errors:
+                self.isError = True
+                self.addMessages(errors[0].label+": "+errors[0].messages.strip())
+            else:
+                result = writer.close()
+        except Exception as err:
+            self.isError = True
+            self.addMessages("Could not render the animation: "+str(err))
+
+        lines = ["{:>6} {:>10}".format("frame", "wall [s]")]
+        for i, frameResult in enumerate(frames):
+            stats = frameResult.stats
+            lines.append("{:>6} {:>10}".format(i+1, "{:.2f}".format(stats.wallTime) if stats else "cached"))
+        self.addMessages(os.linesep.join(lines))
+        self.addMessages("Animation: {} frames in {:.2f} s".format(len(frames), time.perf_counter()-start))
+        return result
+
+    def renderSweepCombination(self, sweep, combination, scadCommand, mime, code, dependencies):
+        result = SweepResult(combination, sweep.getLabel(combination))
+        converter = self.createConverter()
+        with self.lock:
+            # the sweep has been cancelled before the render started
+            isAborted = self.converter.isAborted
+            if not isAborted:
+                self.sweepConverters.append(converter)
+        if isAborted:
+            result.isError = True
+            result.messages = "aborted"
+            return result
+        try:
+            result.data = converter.convertData(sweep.getCommand(scadCommand, combination), code, mime, dependencies)
+            result.isError = converter.isError or converter.isAborted or not result.data
+            result.isCached = converter.stats is None and not result.isError
+            result.messages = converter.getMessages()
+            result.stats = converter.stats
+            if sweep.outputDir and not result.isError:
+                result.fileName = sweep.getFileName(combination, converter.mimeToExtension(mime))
+                with open(result.fileName, "wb") as f:
+                    f.write(result.data)
+        except Exception as err:
+            # an error only fails this combination
+            result.isError = True
+            result.data = None
+            result.fileName = None
+            result.messages = converter.getMessages()+str(err)
+        finally:
+            with self.lock:
+                self.sweepConverters.remove(converter)
+            converter.close()
+        return result
+
+    ## Stops a running render (e.g. on a kernel interrupt)
+    def cancelRender(self):
+        with self.lock:
+            self.converter.cancel()
+            for converter in self.sweepConverters:
+                converter.cancel()
+
+    ## Called when the render has finished: a cancel only applies to the running render
+    def resetCancel(self):
+        with self.lock:
+            self.converter.resetCancel()
+
     def saveAs(self, fileName):
         code = self.getSourceCode().strip()
-        self.converter.saveAs(self.scadCommand, code, fileName)
+        self.converter.saveAs(self.getScadCommand(), code, fileName)
+
+    ## Determines the fingerprints of the files which are used by include and use:
+    ## None if they can not be tracked
+    def getDependencies(self):
+        names = []
+        for statementType in ["include", "use"]:
+            names += [statement.name for statement in self.getStatementsOfType(statementType)]
+        return fingerprints(names)
 
     def insertStatement(self, newStatement):
-        if  newStatement.statementType in ["module","=","comment","-"]:
-            for i in range(len(self.statements)):
-                current = self.statements[i]
-                if current.name == newStatement.name and current.statementType == newStatement.statementType:
-                    self.statements[i] = newStatement
-                    return            
-        self.statements.append(newStatement)
+        self.store.insert(newStatement)
 
     ## Determines the currently defined module names
     def getModuleNames(self):
-        result = []
-        for s in self.statements:
-            if (s.statementType=='module'):
-                result.append(s.name+"();")   
-        return result
+        return self.store.getModuleNames()
  
     ## Determines the installed scad programs
     def setup(self):
         self.scadCommand = Setup().setup(self.scadCommand)
         return self.scadCommand
-    
+
+    ## Starts the detection of the installed scad programs in the background:
+    ## we only wait for the result when the command is needed
+    def setupInBackground(self):
+        if not self.scadCommand and not self.setupFuture:
+            self.setupFuture = Setup().setupInBackground()
+
     def setScadCommand(self, cmd):
         self.scadCommand = cmd
+        self.setupFuture = None
+        # we do not know if the command supports stdin and stdout
+        self.converter.pipe = False
         
     def getScadCommand(self):
+        if self.setupFuture:
+            setup = Setup()
+            try:
+                self.toolchain = self.setupFuture.result()
+                self.scadCommand = setup.getCommand(self.toolchain)
+                self.converter.pipe = setup.usePipe(self.toolchain)
+                self.converter.version = self.toolchain.get("version")
+            except Exception as err:
+                logging.warning("Could not detect the toolchain: "+str(err))
+                self.scadCommand = "openscad"
+            self.setupFuture = None
         return self.scadCommand
 
-    def getIncludeString(self, words, end):
-        url = "".join(words[2:end]).strip()
+    def getIncludeUrl(self, words, pos, end):
+        return "".join(words[pos+1:end]).strip()
+
+    def getIncludeString(self, words, pos, end):
+        url = self.getIncludeUrl(words, pos, end)
+        future = self.includeFutures.pop(url, None)
+        if future:
+            return future.result().strip()
         lib = IncludeLibrary.get(url)
         if not lib:
             lib = IncludeLibrary.addRef(url,url)
         includeString = lib.getContent().strip()
         return includeString
 
-    def processInclude(self, words):
-        end = self.scanner.findEnd1(words,os.linesep)
+    ## Starts the download of all libraries of the %include and %use commands in
+    ## parallel. The statements are inserted in the order of the source code.
+    def prefetchIncludes(self, words):
+        self.includeFutures = dict()
+        if "%include" not in words and "%use" not in words:
+            return
+        for pos, word in enumerate(words):
+            if word in ["%include", "%use"]:
+                url = self.getIncludeUrl(words, pos, self.scanner.findEndOfLine(words, pos))
+                lib = IncludeLibrary.get(url)
+                if not lib:
+                    lib = IncludeLibrary.addRef(url,url)
+                if url and not lib.content and url not in self.includeFutures:
+                    self.includeFutures[url] = IncludeLibrary.executor.submit(lib.getContent)
+
+    ## Provides the statements of a library: the result is kept so that the same
+    ## content is only parsed once
+    def parseLibrary(self, scadCode):
+        key = hashlib.sha256(scadCode.encode("utf-8")).hexdigest()
+        with Parser.libraryLock:
+            statements = Parser.libraryStatements.get(key)
+            if statements is not None:
+                Parser.libraryStatements.move_to_end(key)
+                return statements
+
+        libraryParser = Parser(self.converter)
+        libraryParser.parse(scadCode)
+        statements = tuple(libraryParser.getStatements())
+        with Parser.libraryLock:
+            Parser.libraryStatements[key] = statements
+            while len(Parser.libraryStatements)>Parser.maxLibraries:
+                Parser.libraryStatements.popitem(last=False)
+        return statements
+
+    def processInclude(self, words, pos):
+        with self.profiler.phase("include"):
+            return self.includeLibrary(words, pos)
+
+    def processUse(self, words, pos):
+        with self.profiler.phase("include"):
+            return self.useLibrary(words, pos)
+
+    def includeLibrary(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
         try:
-            scadCode = self.getIncludeString(words, end)
-            useParser = Parser()
-            useParser.parse(scadCode)
-            count = 0
-            for statement in useParser.statements:
-                self.insertStatement(statement)
-                count += 1
-            self.addMessages("Included number of statements: "+str(count)) 
+            scadCode = self.getIncludeString(words, pos, end)
+            statements = self.parseLibrary(scadCode)
+            self.store.insertAll(statements)
+            self.addMessages("Included number of statements: "+str(len(statements))) 
         except Exception as err:
             self.isError = True
             self.addMessages("Could not include file: "+str(err))  
         return end
 
-    def processUse(self, words):
-        end = self.scanner.findEnd1(words,os.linesep)
+    def useLibrary(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
         try:
-            scadCode = self.getIncludeString(words, end)
-            useParser = Parser()
-            useParser.parse(scadCode)
-            count = 0
-            for statement in useParser.statements:
-                if (statement.statementType in ["include","use","module","function","=","whitespace","comment"]):
-                    self.insertStatement(statement)
-                    count += 1
-            self.addMessages("Included number of statements: "+str(count)) 
+            scadCode = self.getIncludeString(words, pos, end)
+            statements = [statement for statement in self.parseLibrary(scadCode)
+                if statement.statementType in ["include","use","module","function","=","whitespace","comment"]]
+            self.store.insertAll(statements)
+            self.addMessages("Included number of statements: "+str(len(statements))) 
         except Exception as err:
             self.isError = True
             self.addMessages("Could not include file: "+str(err))  
         return end
 
-    def processSaveAs(self, words):
-        end = self.scanner.findEnd1(words,os.linesep)
+    def processSaveAs(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
         try:
-            fileName = "".join(words[2:end]).strip()
+            fileName = "".join(words[pos+1:end]).strip()
             self.saveAs(fileName)
             self.addMessages("File '" +fileName+ "' created")
         except Exception as err:
             self.addMessages("Could not save file: "+str(err))  
         return end
 
-    def processDefault(self, words):
-        if words[0:1]=="%":
-            end = self.scanner.findEnd1(words,os.linesep)
-            self.addMessages("Unsupported Command: "+"".join(words[0:end]))  
+    ## %cache [on|off|clear|size <MB>|dir <directory>]
+    def processCache(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        cache = self.converter.cache
+        args = "".join(words[pos+1:end]).split()
+        try:
+            if args and args[0] in ["on","off"]:
+                cache.active = isOn(args[0])
+            elif args and args[0] == "clear":
+                cache.clear()
+            elif len(args)==2 and args[0] == "size":
+                cache.maxBytes = int(float(args[1])*1024*1024)
+                cache.evict()
+            elif len(args)==2 and args[0] == "dir":
+                cache.directory = args[1]
+            elif args:
+                raise Exception("Invalid arguments: "+" ".join(args))
+            self.addMessages(cache.info())
+        except Exception as err:
+            self.isError = True
+            self.addMessages("Could not change the render cache: "+str(err))
+        return end
+
+    ## %spool [clear|size <MB>|files <n>]
+    def processSpool(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        spool = self.converter.spool
+        args = "".join(words[pos+1:end]).split()
+        try:
+            if args and args[0] == "clear":
+                spool.clear()
+            elif len(args)==2 and args[0] == "size":
+                spool.maxBytes = int(float(args[1])*1024*1024)
+                spool.evict()
+            elif len(args)==2 and args[0] == "files":
+                spool.maxFiles = max(int(args[1]), 1)
+                spool.evict()
+            elif args:
+                raise Exception("Invalid arguments: "+" ".join(args))
+            self.addMessages(spool.info())
+        except Exception as err:
+            self.isError = True
+            self.addMessages("Could not change the spool: "+str(err))
+        return end
+
+    ## %displayFull [code]: without code the last preview is rendered again
+    def processDisplayFull(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        self.renderPreview = False
+        if "".join(words[pos+1:end]).strip():
+            self.displayRendered = True
+            self.setTempStatement(Statement(None,words[pos+1:end]))
+        elif self.lastPreview is not None:
+            self.displayRendered = True
+            self.setTempStatement(self.lastPreview)
         else:
-            end = self.scanner.findEnd1(words,";")
+            self.addMessages("There is no preview to render")
+        return end
+
+    ## %preview [on|off] [fn=<n>] [fa=<degrees>] [fs=<mm>]
+    def processPreview(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        args = "".join(words[pos+1:end]).split()
+        try:
+            if args and args[0] in ["on","off"]:
+                self.preview = isOn(args[0])
+                self.renderPreview = self.preview
+                args = args[1:]
+            self.previewSettings.update(args)
+            self.addMessages(self.previewSettings.info()+" ("+("on" if self.preview else "off")+")")
+        except Exception as err:
+            self.isError = True
+            self.addMessages("Could not change the preview: "+str(err))
+        return end
+
+    ## %sweep name=v1,v2,.. name=start:step:end [-o <directory>] [-j <jobs>]
+    def processSweep(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        try:
+            self.sweep = Sweep.fromArguments(shlex.split("".join(words[pos+1:end])))
+        except Exception as err:
+            self.isError = True
+            self.skipRender = True
+            self.addMessages("Invalid sweep: "+str(err))
+        return end
+
+    ## %animate <frames> [fps=<n>] [format=apng|gif] [-j <jobs>]
+    def processAnimate(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        try:
+            self.animation = Animation.fromArguments("".join(words[pos+1:end]).split())
+        except Exception as err:
+            self.isError = True
+            self.skipRender = True
+            self.addMessages("Invalid animation: "+str(err))
+        return end
+
+    ## %profile [n|clear]: phase times of the last n cells
+    def processProfile(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        args = "".join(words[pos+1:end]).split()
+        if args == ["clear"]:
+            self.profiler.clear()
+            self.addMessages("The profiles have been cleared")
+        elif len(args)>1 or (args and not args[0].isdigit()):
+            self.isError = True
+            self.addMessages("Invalid arguments: "+" ".join(args))
+        else:
+            self.addMessages(self.profiler.info(int(args[0]) if args else 10))
+        return end
+
+    ## %renderer [openscad|fake] [latency=<s>] [size=<bytes>]
+    def processRenderer(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        args = "".join(words[pos+1:end]).split()
+        try:
+            renderer = self.converter.renderer
+            if args and args[0] == ProcessRenderer.name:
+                if len(args)>1:
+                    raise Exception("Invalid arguments: "+" ".join(args))
+                renderer = ProcessRenderer()
+            elif args and args[0] == FakeRenderer.name:
+                if not isinstance(renderer, FakeRenderer):
+                    renderer = FakeRenderer()
+                renderer.update(args[1:])
+            elif args:
+                raise Exception("Invalid arguments: "+" ".join(args))
+            self.converter.renderer = renderer
+            self.addMessages(renderer.info())
+        except Exception as err:
+            self.isError = True
+            self.addMessages("Could not change the renderer: "+str(err))
+        return end
+
+    ## %prune [on|off]
+    def processPrune(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        args = "".join(words[pos+1:end]).split()
+        if len(args)>1 or (args and args[0] not in ["on","off"]):
+            self.isError = True
+            self.addMessages("Invalid arguments: "+" ".join(args))
+        else:
+            if args:
+                self.prune = isOn(args[0])
+            self.addMessages("Prune unused statements: "+("on" if self.prune else "off"))
+        return end
+
+    ## %limits [time=<seconds>] [cpu=<seconds>] [memory=<MB>]
+    def processLimits(self, words, pos):
+        end = self.scanner.findEndOfLine(words, pos)
+        try:
+            self.converter.limits.update("".join(words[pos+1:end]).split())
+            self.addMessages(self.converter.limits.info())
+        except Exception as err:
+            self.isError = True
+            self.addMessages("Could not change the render limits: "+str(err))
+        return end
+
+    ## Provides the statistics (RenderStats) of the renders of this session
+    def getRenderHistory(self):
+        return self.converter.history.last()
+
+    def processDefault(self, words, pos):
+        if words[pos:pos+1]=="%":
+            end = self.scanner.findEndOfLine(words, pos)
+            self.addMessages("Unsupported Command: "+"".join(words[pos:end]))  
+        else:
+            end = self.scanner.findEndOfStatement(words, pos)
             end = self.scanner.findEndWithNewLine(words,end)
 
-            newStatementWords = words[0:end]
+            newStatementWords = words[pos:end]
             cmd = "".join(newStatementWords)
-            if (not cmd or cmd.strip().endswith(";")):
+            if (not cmd or cmd.strip().endswith((";", "}"))):
                 statementType = "-"
                 if "function" in newStatementWords: 
                     statementType = "function"
+                    # a function literal which is assigned to a variable: f = function(x) x*2;
+                    if "=" in newStatementWords and newStatementWords.index("=")<newStatementWords.index("function"):
+                        statementType = "="
                 elif "=" in newStatementWords: 
                     statementType = "="     
                 elif not cmd and os.linesep in  newStatementWords :
@@ -532,8 +1629,13 @@ class Parser:
 
     def close(self):
         self.clearMessages()
-        self.statements = []
+        self.store.clear()
         self.converter.close()
-        self.tempStatement = Statement("-",[])
+        self.setTempStatement(Statement("-",[]))
+
+    ## Releases all resources when the kernel is shut down
+    def shutdown(self):
+        self.close()
+        self.display.stop()
 
         
\ No newline at end of file
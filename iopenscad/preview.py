@@ -0,0 +1,101 @@
+##
+# Preview renders: png files are rendered with the (fast) preview of OpenSCAD
+# and the resolution of curved surfaces is reduced by limiting $fn and by
+# raising $fa and $fs.
+#
+import shlex
+from iopenscad.display import XVFB_RUN
+from iopenscad.scanner import Scanner, tokenType, NUMBER, WHITESPACE, NEWLINE, COMMENT
+
+SKIPPED_TYPES = [WHITESPACE, NEWLINE, COMMENT]
+
+
+class PreviewSettings:
+    names = ["fn", "fa", "fs"]
+
+    def __init__(self, fn=16, fa=12, fs=2):
+        # maximum number of fragments
+        self.fn = fn
+        # minimum angle (degrees) and minimum size (mm) of a fragment
+        self.fa = fa
+        self.fs = fs
+        self.scanner = Scanner()
+
+    def set(self, name, value):
+        if name not in self.names:
+            raise Exception("Invalid preview setting: "+name)
+        number = float(value)
+        if number<=0:
+            raise Exception("Invalid value for "+name+": "+value)
+        setattr(self, name, number)
+
+    ## Updates the settings from arguments in the format name=value
+    def update(self, args):
+        for arg in args:
+            name, sep, value = arg.partition("=")
+            if not sep:
+                raise Exception("Invalid argument: "+arg)
+            self.set(name.strip(), value.strip())
+
+    ## Adds --preview for png files if the command is openscad
+    def getCommand(self, scadCommand, mime):
+        command = scadCommand[len(XVFB_RUN):] if scadCommand.startswith(XVFB_RUN) else scadCommand
+        args = shlex.split(command)
+        if mime == "image/png" and args and args[0].split("/")[-1].startswith("openscad") and "--preview" not in args:
+            return scadCommand+" --preview"
+        return scadCommand
+
+    ## Limits the values which are assigned to $fn, $fa and $fs
+    def rewrite(self, code):
+        words = self.scanner.scann(code)
+        result = []
+        pos = 0
+        while pos<len(words):
+            word = words[pos]
+            result.append(word)
+            pos += 1
+            if word in ["$fn", "$fa", "$fs"]:
+                equals = self.skip(words, pos)
+                if equals<len(words) and words[equals] == "=" and words[equals+1:equals+2] != ["="]:
+                    start = self.skip(words, equals+1)
+                    end = self.findEndOfExpression(words, start)
+                    if start<end:
+                        result.extend(words[pos:start])
+                        result.append(self.limit(word, words[start:end]))
+                        pos = end
+        return "".join(result)
+
+    def skip(self, words, pos):
+        while pos<len(words) and tokenType(words[pos]) in SKIPPED_TYPES:
+            pos += 1
+        return pos
+
+    ## The expression ends with , ; or a closing bracket: trailing white space is not included
+    def findEndOfExpression(self, words, pos):
+        depth = 0
+        end = pos
+        while pos<len(words):
+            word = words[pos]
+            if word in ["(", "[", "{"]:
+                depth += 1
+            elif word in [")", "]", "}"]:
+                if depth == 0:
+                    break
+                depth -= 1
+            elif word in [",", ";"] and depth == 0:
+                break
+            pos += 1
+            if tokenType(word) not in SKIPPED_TYPES:
+                end = pos
+        return end
+
+    def limit(self, name, expression):
+        function, value = ("min", self.fn) if name == "$fn" else ("max", getattr(self, name[1:]))
+        values = [word for word in expression if tokenType(word) not in SKIPPED_TYPES]
+        if len(values) == 1 and tokenType(values[0]) == NUMBER:
+            number = float(values[0])
+            return "{:g}".format(min(number, value) if function == "min" else max(number, value))
+        return "{}({:g}, {})".format(function, value, "".join(expression))
+
+    def info(self):
+        return "Preview: $fn<={:g}, $fa>={:g}, $fs>={:g}".format(self.fn, self.fa, self.fs)
@@ -0,0 +1,125 @@
+##
+# Timing of the phases of a cell execution (scanning, parsing, includes, render,
+# encoding, ...). The times of nested phases are not counted in the enclosing
+# phase, so that the phases of a cell add up to its total time.
+#
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+## Display order of the phases
+PHASES = ["scan", "parse", "include", "cache", "render", "read", "encode", "send"]
+
+
+##
+# Phase times (seconds) of a single cell
+##
+class Profile:
+    def __init__(self, cell):
+        self.timestamp = time.time()
+        self.cell = cell
+        self.start = time.perf_counter()
+        self.total = None
+        self.phases = dict()
+        self.lock = threading.Lock()
+
+    def add(self, name, duration):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0)+duration
+
+    def finish(self):
+        self.total = time.perf_counter()-self.start
+
+    ## Time which is not covered by a phase: e.g. waiting for the render thread
+    def getOther(self):
+        return max(self.total-sum(self.phases.values()), 0.0) if self.total is not None else 0.0
+
+    def toDict(self):
+        return {"timestamp": self.timestamp, "cell": self.cell, "total": self.total,
+            "phases": dict(self.phases), "other": self.getOther()}
+
+
+##
+# Collects the profiles of the last cells. With a log file each profile is also
+# appended as a line of JSON.
+##
+class Profiler:
+    def __init__(self, maxEntries=100, logFile=None):
+        self.entries = deque(maxlen=maxEntries)
+        self.logFile = logFile
+        self.current = None
+        # time of the nested phases for the running phases of a thread
+        self.local = threading.local()
+
+    ## Creates the profiler with the settings from the environment
+    @classmethod
+    def fromEnvironment(cls):
+        return cls(logFile=os.environ.get("IOPENSCAD_PROFILE_LOG") or None)
+
+    ## Starts the profile of a new cell
+    def start(self, cell=None):
+        self.current = Profile(cell)
+        return self.current
+
+    def finish(self):
+        profile = self.current
+        self.current = None
+        if profile is None:
+            return None
+        profile.finish()
+        self.entries.append(profile)
+        if self.logFile:
+            self.writeLog(profile)
+        return profile
+
+    def writeLog(self, profile):
+        try:
+            with open(self.logFile, "a") as f:
+                f.write(json.dumps(profile.toDict())+os.linesep)
+        except OSError as err:
+            logging.warning("Could not write the profile log: "+str(err))
+
+    ## Measures the time of a phase of the current cell
+    @contextmanager
+    def phase(self, name):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        profile = self.current
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter()-start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += duration
+            if profile is not None:
+                profile.add(name, duration-nested)
+
+    ## Provides the last n profiles
+    def last(self, n=None):
+        result = list(self.entries)
+        return result[-n:] if n else result
+
+    def clear(self):
+        self.entries.clear()
+
+    def info(self, n=10):
+        profiles = self.last(n)
+        names = list(PHASES)
+        for profile in profiles:
+            names += [name for name in profile.phases if name not in names]
+        columns = ["cell", "total"]+names+["other"]
+        lines = ["Profile [ms]", " ".join(["{:>8}".format(column) for column in columns])]
+        for profile in profiles:
+            values = [profile.total]+[profile.phases.get(name) for name in names]+[profile.getOther()]
+            cells = ["{:>8}".format(str(profile.cell) if profile.cell is not None else "-")]
+            cells += ["{:>8}".format("{:.1f}".format(value*1000) if value is not None else "-") for value in values]
+            lines.append(" ".join(cells))
+        return os.linesep.join(lines)
@@ -0,0 +1,71 @@
+##
+# Selects the statements which are needed to render the display code: the
+# modules, functions and variables which are referenced (also indirectly), the
+# include and use statements and the special variables like $fn. An included
+# file can use all variables, so with an include all of them are kept. Other top
+# level geometry, comments and unused definitions are left out.
+#
+import re
+import weakref
+from iopenscad.scanner import Scanner, IDENTIFIER, MAGIC
+
+## Name of a variable assignment: other statements with a = are geometry
+ASSIGNMENT_NAME = re.compile(r"\$?[A-Za-z_]\w*$")
+
+
+class Pruner:
+    def __init__(self):
+        self.scanner = Scanner()
+        # statement -> identifiers which are used in the statement
+        self.references = weakref.WeakKeyDictionary()
+
+    def getReferences(self, statement):
+        result = self.references.get(statement)
+        if result is None:
+            tokens = self.scanner.tokenize(statement.sourceCode)
+            names = [word for word, wordType in zip(tokens.words, tokens.types) if wordType == IDENTIFIER]
+            # the statements do not contain magics: a %name at the start of a line is
+            # the background modifier of a module call (e.g. %display %part();)
+            names += [word.lstrip("%") for word, wordType in zip(tokens.words, tokens.types) if wordType == MAGIC]
+            result = frozenset(names)
+            self.references[statement] = result
+        return result
+
+    def isDefinition(self, statement):
+        if statement.statementType == "=":
+            return ASSIGNMENT_NAME.match(statement.name) is not None
+        return statement.statementType in ["module", "function"]
+
+    ## Statements which are always needed: an included file can use all variables
+    ## of the main file
+    def isRequired(self, statement, hasInclude=False):
+        if statement.statementType in ["include", "use"]:
+            return True
+        if statement.statementType != "=" or not self.isDefinition(statement):
+            return False
+        return hasInclude or statement.name.startswith("$")
+
+    ## Provides the statements (in their original order) which are needed by the code statement
+    def prune(self, statements, codeStatement):
+        definitions = dict()
+        needed = set()
+        pending = list(self.getReferences(codeStatement))
+        hasInclude = any([statement.statementType == "include" for statement in statements])
+        for statement in statements:
+            if self.isRequired(statement, hasInclude):
+                needed.add(statement)
+                pending.extend(self.getReferences(statement))
+            elif self.isDefinition(statement):
+                definitions.setdefault(statement.name, []).append(statement)
+
+        names = set()
+        while pending:
+            name = pending.pop()
+            if name in names:
+                continue
+            names.add(name)
+            for statement in definitions.get(name, []):
+                if statement not in needed:
+                    needed.add(statement)
+                    pending.extend(self.getReferences(statement))
+        return [statement for statement in statements if statement in needed]
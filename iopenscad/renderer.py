@@ -0,0 +1,153 @@
+##
+# Renderers which are used by the MimeConverter to execute a render. The
+# ProcessRenderer starts the scad command. The FakeRenderer creates a result of
+# a fixed size after a fixed latency without OpenSCAD, so that the overhead of
+# the kernel can be measured.
+#
+import os
+import time
+import zlib
+import struct
+import signal
+import logging
+from iopenscad.limits import RenderStats
+from iopenscad.cache import commandFingerprint
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+##
+# Executes the scad command in a separate process
+##
+class ProcessRenderer:
+    name = "openscad"
+
+    ## Executes the render: args are the arguments after the command. With input
+    ## data the result is expected in converter.resultData, otherwise in the
+    ## file after -o. Returns the exit code.
+    def run(self, converter, command, args, resultExt, inputData=None):
+        return converter.runProcess(command, args, resultExt, inputData)
+
+    ## Command which identifies the results in the render cache: together with
+    ## the fingerprints of its programs
+    def getCacheCommand(self, command):
+        return command+" "+commandFingerprint(command)
+
+    def info(self):
+        return "Renderer: openscad"
+
+
+##
+# Deterministic stand-in for OpenSCAD: waits for the latency (in seconds) and
+# provides a result with the indicated size in bytes. The png results are valid
+# images, the stl results valid ascii stl files.
+##
+class FakeRenderer:
+    name = "fake"
+
+    def __init__(self, latency=0.0, size=10*1024):
+        self.latency = latency
+        self.size = size
+        # generated result by extension
+        self.results = dict()
+
+    ## Creates the renderer with the settings from the environment
+    @classmethod
+    def fromEnvironment(cls):
+        renderer = cls()
+        renderer.update(["latency="+os.environ.get("IOPENSCAD_FAKE_LATENCY", ""), "size="+os.environ.get("IOPENSCAD_FAKE_SIZE", "")])
+        return renderer
+
+    ## Updates the settings from arguments in the format name=value
+    def update(self, args):
+        for arg in args:
+            name, sep, value = arg.partition("=")
+            if not sep or name not in ["latency", "size"]:
+                raise Exception("Invalid argument: "+arg)
+            if not value:
+                continue
+            number = float(value)
+            if number<0:
+                raise Exception("Invalid value for "+name+": "+value)
+            if name == "latency":
+                self.latency = number
+            else:
+                self.size = int(number)
+                self.results.clear()
+
+    def getResult(self, resultExt):
+        result = self.results.get(resultExt)
+        if result is None:
+            if resultExt == "png":
+                result = createPng(self.size)
+            elif resultExt == "stl":
+                result = createStl(self.size)
+            else:
+                result = (b"fake render"+os.linesep.encode())*(self.size//12+1)
+                result = result[0:self.size]
+            self.results[resultExt] = result
+        return result
+
+    def run(self, converter, command, args, resultExt, inputData=None):
+        start = time.perf_counter()
+        converter.resultData = None
+        # a cancel of the converter stops the wait
+        end = start+self.latency
+        while not converter.isAborted and time.perf_counter()<end:
+            time.sleep(min(end-time.perf_counter(), 0.05))
+        retval = -signal.SIGTERM if converter.isAborted else 0
+        if retval == 0:
+            result = self.getResult(resultExt)
+            if inputData is not None:
+                converter.resultData = result
+            else:
+                with open(args[args.index("-o")+1], "wb") as f:
+                    f.write(result)
+        converter.isError = retval != 0
+        converter.addStats(RenderStats(command, resultExt, time.perf_counter()-start, returnCode=retval))
+        return retval
+
+    def getCacheCommand(self, command):
+        return "fake(latency={:g}, size={}) {}".format(self.latency, self.size, command)
+
+    def info(self):
+        return "Renderer: fake, latency={:g} s, size={} bytes".format(self.latency, self.size)
+
+
+## Provides the renderer which is selected with IOPENSCAD_RENDERER (openscad or fake)
+def rendererFromEnvironment():
+    name = os.environ.get("IOPENSCAD_RENDERER", "").strip().lower()
+    if name == FakeRenderer.name:
+        try:
+            return FakeRenderer.fromEnvironment()
+        except Exception as err:
+            logging.warning("Invalid settings of the fake renderer: "+str(err))
+            return FakeRenderer()
+    if name and name != ProcessRenderer.name:
+        logging.warning("Unknown renderer: "+name)
+    return ProcessRenderer()
+
+
+def writeChunk(chunks, chunkType, data):
+    chunks.append(struct.pack(">I", len(data))+chunkType+data+struct.pack(">I", zlib.crc32(chunkType+data) & 0xffffffff))
+
+## Grey 16x16 png which is filled up to the size with a private ancillary chunk
+def createPng(size):
+    chunks = [PNG_SIGNATURE]
+    writeChunk(chunks, b"IHDR", struct.pack(">IIBBBBB", 16, 16, 8, 0, 0, 0, 0))
+    writeChunk(chunks, b"IDAT", zlib.compress((b"\x00"+b"\x80"*16)*16))
+    length = sum(map(len, chunks))+12
+    padding = size-length-12
+    if padding>0:
+        writeChunk(chunks, b"fkPd", b"\x00"*padding)
+    writeChunk(chunks, b"IEND", b"")
+    return b"".join(chunks)
+
+## Ascii stl with a facet which is repeated up to the size
+def createStl(size):
+    facet = ("facet normal 0 0 1"+os.linesep+"  outer loop"+os.linesep+"    vertex 0 0 0"+os.linesep
+        +"    vertex 1 0 0"+os.linesep+"    vertex 0 1 0"+os.linesep+"  endloop"+os.linesep+"endfacet"+os.linesep)
+    start = "solid fake"+os.linesep
+    end = "endsolid fake"+os.linesep
+    count = max((size-len(start)-len(end))//len(facet), 1)
+    return (start+facet*count+end).encode("ascii")
@@ -1,79 +1,231 @@
-import re, os
+import re
+from array import array
+from itertools import accumulate
 ###
-# Scanner which splits a string into individual tokens (words)
+# Scanner which splits a string into individual tokens (words). The find methods
+# work on a position in the token list and return the (absolute) end position, so
+# that the parser can move a cursor through a single token array.
 #
 
+## Token types
+IDENTIFIER = "identifier"
+NUMBER = "number"
+STRING = "string"
+COMMENT = "comment"
+PUNCTUATION = "punctuation"
+NEWLINE = "newline"
+WHITESPACE = "whitespace"
+MAGIC = "magic"
+# a { } block with all its content (see Scanner.tokenize)
+BLOCK = "block"
+
+NEWLINES = ("\n", "\r\n", "\r")
+
+## Single pass tokenizer: newline, white space, comment, string, magic, number,
+## identifier and (single character) punctuation
+TOKEN_PATTERN = re.compile(r'''
+     \r\n|\n|\r
+    |[^\S\r\n]+
+    |//[^\r\n]*|/\*.*?(?:\*/|\Z)
+    |"(?:[^"\\]|\\.)*(?:"|\Z)
+    |%%?[A-Za-z_]\w*
+    |(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?
+    |\$?\w+
+    |.
+''', re.VERBOSE | re.DOTALL)
+
+
+## Braces, strings and comments: the content of a block is only scanned for its braces
+BLOCK_PATTERN = re.compile(r'''[{}]|"(?:[^"\\]|\\.)*(?:"|\Z)|//[^\r\n]*|/\*.*?(?:\*/|\Z)''', re.DOTALL)
+
+
+## A % with a name which is not at the start of a line (it may be a magic inside a string
+## or comment): this is the modulo operator or the background modifier
+INLINE_MAGIC_PATTERN = re.compile(r'[^\s%][^\S\r\n]*%%?[A-Za-z_]')
+
+
+## Determines the type of a token which was created by the tokenizer
+def tokenType(word):
+    first = word[0]
+    if first in "\r\n":
+        return NEWLINE
+    if first.isspace():
+        return WHITESPACE
+    if first == '"':
+        return STRING
+    if len(word)>1:
+        if first == "{":
+            return BLOCK
+        if first == "/":
+            return COMMENT
+        if first == "%":
+            return MAGIC
+        if first == ".":
+            return NUMBER
+    if first.isdigit():
+        return NUMBER
+    if len(word)>1 or first == "_" or first.isalpha():
+        return IDENTIFIER
+    return PUNCTUATION
+
+
+##
+# Result of the tokenizer: the words, their types and their start offsets in the
+# source are stored in parallel arrays. The types and offsets are only determined
+# when they are needed.
+##
+class Tokens:
+    def __init__(self, source, words):
+        self.source = source
+        self.words = words
+        self._types = None
+        self._offsets = None
+
+    def __len__(self):
+        return len(self.words)
+
+    @property
+    def types(self):
+        if self._types is None:
+            self._types = list(map(tokenType, self.words))
+        return self._types
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            self._offsets = array('q', accumulate(map(len, self.words), initial=0))
+        return self._offsets
+
+    def start(self, pos):
+        return self.offsets[pos]
+
+    def end(self, pos):
+        return self.offsets[pos+1]
+
+    ## Provides the token at the indicated position as (type, word, start, end)
+    def token(self, pos):
+        return (self.types[pos], self.words[pos], self.start(pos), self.end(pos))
+
+
 class Scanner:
     def scann(self, scad):
-        words = re.split('(\W)', scad)
+        return self.tokenize(scad).words
+
+    # splits the scad code into typed tokens: with blocks each { } block at the top
+    # level is a single token, so that the parser skips e.g. the body of a module
+    # in one step
+    def tokenize(self, scad, blocks=False):
+        if blocks and "{" in scad:
+            words = self.findBlockWords(scad)
+        else:
+            words = TOKEN_PATTERN.findall(scad)
+        if "%" in scad and INLINE_MAGIC_PATTERN.search(scad):
+            words = self.splitInlineMagics(words)
+        return Tokens(scad, words)
+
+    # the text between the blocks is split into tokens: a block which is not closed
+    # ends with the code
+    def findBlockWords(self, scad):
+        words = []
+        depth = 0
+        start = 0
+        for match in BLOCK_PATTERN.finditer(scad):
+            char = match.group()
+            if char == "{":
+                if depth == 0:
+                    words.extend(TOKEN_PATTERN.findall(scad, start, match.start()))
+                    start = match.start()
+                depth += 1
+            elif char == "}" and depth>0:
+                depth -= 1
+                if depth == 0:
+                    words.append(scad[start:match.end()])
+                    start = match.end()
+        if depth>0:
+            words.append(scad[start:])
+        else:
+            words.extend(TOKEN_PATTERN.findall(scad, start))
         return words
 
-     # for a start tag we try to find the matching end tag: e.g for { }
-    def findEnd2(self, words, start, end):
-        index = 0
-        wordPos = 0
-        started = False
-        while wordPos<len(words):
-            word = words[wordPos]
-            if word == start:
-                index +=1
-                started = True
-                           
-            if word == end:
-                index -=1                
-            if started and index==0:
-                return wordPos+1            
-            wordPos +=1
-        return wordPos
-    
-    # find specified end charactror
-    def findEnd1(self, words, end):
-        wordPos = 0
+    # magics are only recognized at the start of a line: otherwise the % is
+    # punctuation followed by an identifier
+    def splitInlineMagics(self, words):
+        result = []
+        lineStart = True
+        for word in words:
+            if word[0] == "%" and len(word)>1 and not lineStart:
+                name = word.lstrip("%")
+                result.extend(["%"]*(len(word)-len(name)))
+                result.append(name)
+            else:
+                result.append(word)
+            if word in NEWLINES:
+                lineStart = True
+            elif word.strip():
+                lineStart = False
+        return result
+
+    # find the end of a statement: it ends with a ; or with a block (see tokenize),
+    # which can be followed by an else or by a ;
+    def findEndOfStatement(self, words, pos=0):
+        wordPos = pos
         while wordPos<len(words):
             word = words[wordPos]
-            if word==end:
-                return wordPos+1
             wordPos+=1
-            
+            if word==";":
+                return wordPos
+            if word[0]=="{":
+                next = self.findEndWhiteSpace(words, wordPos)
+                if next<len(words) and words[next]==";":
+                    return next+1
+                if next>=len(words) or words[next]!="else":
+                    return wordPos
         return len(words)
 
-    # find the indicated end string by looking at the next num entries 
-    def findEndString(self, words, end, num):
-        wordPos = 0
+    # find the end of an include or use statement: the file name ends with > and
+    # the ; is optional
+    def findEndOfInclude(self, words, pos=0):
+        wordPos = pos
+        while wordPos<len(words) and words[wordPos]!=">":
+            if words[wordPos]==";":
+                return wordPos+1
+            if words[wordPos] in NEWLINES:
+                return wordPos
+            wordPos+=1
+        if wordPos>=len(words):
+            return len(words)
+        end = wordPos+1
+        wordPos = self.findEndWhiteSpace(words, end)
+        if wordPos<len(words) and words[wordPos]==";":
+            return wordPos+1
+        return end
+
+    # find the end of the current line (including the new line)
+    def findEndOfLine(self, words, pos=0):
+        wordPos = pos
         while wordPos<len(words):
-            word = "".join(words[wordPos:wordPos+num])
-            if word==end:
-                return wordPos+num
+            if words[wordPos] in NEWLINES:
+                return wordPos+1
             wordPos+=1
         return len(words)
 
-
-    # find the next white space 
-    def findEndWhiteSpace(self, words):
-        wordPos = 0
-        word = words[wordPos]
-        while not word.strip() and wordPos<len(words)-1:
+    # find the next white space
+    def findEndWhiteSpace(self, words, pos=0):
+        wordPos = pos
+        while wordPos<len(words) and not words[wordPos].strip():
             wordPos+=1
-            word = words[wordPos]            
         return wordPos
-    
+
     # if the statement ends with a new line we add it to the statement
     def findEndWithNewLine(self, words, end):
         wordPos = end
         hasLF = False
         while wordPos<len(words):
-            word = words[wordPos]
-            if word==os.linesep:
+            if words[wordPos] in NEWLINES:
                 hasLF = True
-                wordPos+=1              
-            elif word=="":
-                wordPos+=1              
-            elif words[wordPos]:
-                if hasLF: 
-                    return wordPos 
-                else: 
-                    return end
+                wordPos+=1
+            elif hasLF:
+                return wordPos
             else:
-                wordPos+=1              
-        return len(words)       
-
+                return end
+        return len(words)
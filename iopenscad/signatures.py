@@ -0,0 +1,170 @@
+##
+# Signatures and documentation of the modules and functions: the documentation is
+# collected when the statements are inserted, the parameters are only parsed when
+# a signature is requested.
+#
+import os
+from iopenscad.scanner import TOKEN_PATTERN, tokenType, COMMENT
+
+
+##
+# Parameters (name, default value or None) and leading comment of a module or
+# function
+##
+class Signature:
+    def __init__(self, statement, doc=""):
+        self.kind = statement.statementType
+        self.name = statement.name
+        self.statement = statement
+        self.doc = doc
+        self.parameters = None
+
+    ## The parameters are parsed with the first request
+    def getParameters(self):
+        if self.parameters is None:
+            self.parameters = self.parseParameters(self.statement.sourceCode)
+        return self.parameters
+
+    ## Splits the parameter list after the name into (name, default) pairs
+    @staticmethod
+    def parseParameters(sourceCode):
+        words = [word for word in TOKEN_PATTERN.findall(sourceCode) if tokenType(word) != COMMENT]
+        try:
+            pos = words.index("(")+1
+        except ValueError:
+            return []
+        result = []
+        depth = 0
+        current = []
+        for word in words[pos:]:
+            if word in ("(", "[", "{"):
+                depth += 1
+            elif word in (")", "]", "}"):
+                if depth == 0:
+                    break
+                depth -= 1
+            elif word == "," and depth == 0:
+                result.append(current)
+                current = []
+                continue
+            current.append(word)
+        result.append(current)
+
+        parameters = []
+        for parameter in result:
+            text = " ".join("".join(parameter).split())
+            if text:
+                name, sep, default = text.partition("=")
+                parameters.append((name.strip(), default.strip() if sep else None))
+        return parameters
+
+    def getSignature(self):
+        parameters = [name if default is None else name+" = "+default for name, default in self.getParameters()]
+        return "{} {}({})".format(self.kind, self.name, ", ".join(parameters))
+
+    def str(self, detail=False):
+        result = self.getSignature()
+        if self.doc:
+            result += os.linesep+os.linesep+self.doc
+        if detail:
+            result += os.linesep+os.linesep+self.statement.sourceCode.strip()
+        return result
+
+
+## Removes the comment markers of a // or /* */ comment
+def getCommentText(comment):
+    comment = comment.strip()
+    if comment.startswith("//"):
+        return comment[2:].strip()
+    lines = comment[2:-2 if comment.endswith("*/") else len(comment)].splitlines()
+    return os.linesep.join([line.strip().lstrip("*").strip() for line in lines]).strip()
+
+
+##
+# Signatures by name. The index is a listener of the StatementStore: the comment
+# statements directly before a definition are kept as its documentation. The
+# Signature is only created when it is requested.
+##
+class SignatureIndex:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # name -> (statement, doc)
+        self.definitions = dict()
+        self.comments = []
+        # line breaks after the last comment
+        self.lineBreaks = 0
+
+    def statementChanged(self, oldStatement, newStatement):
+        statementType = newStatement.statementType
+        if statementType == "comment":
+            sourceCode = newStatement.sourceCode
+            self.comments.append(getCommentText(sourceCode))
+            self.lineBreaks = sourceCode[len(sourceCode.rstrip()):].count("\n")
+        elif statementType == "whitespace":
+            self.lineBreaks += newStatement.sourceCode.count("\n")
+        else:
+            if (statementType == "module" or statementType == "function") and newStatement.name:
+                doc = os.linesep.join([comment for comment in self.comments if comment]) if self.comments else ""
+                self.definitions[newStatement.name] = (newStatement, doc)
+            self.lineBreaks = 0
+            if self.comments:
+                self.comments = []
+            return
+        # an empty line separates the comments from the definition
+        if self.lineBreaks>1:
+            self.comments = []
+
+    def storeCleared(self):
+        self.clear()
+
+    def statementsChanged(self, changes):
+        for oldStatement, newStatement in changes:
+            self.statementChanged(oldStatement, newStatement)
+
+    ## Provides the Signature of the module or function or None
+    def get(self, name):
+        definition = self.definitions.get(name)
+        return Signature(*definition) if definition else None
+
+    def __len__(self):
+        return len(self.definitions)
+
+
+## Determines the identifier at the cursor position or, if there is none, the
+## name of the call whose arguments contain the cursor
+def getInspectName(code, cursorPos):
+    def isNameChar(char):
+        return char.isalnum() or char in "_$"
+    start = end = min(cursorPos, len(code))
+    while start>0 and isNameChar(code[start-1]):
+        start -= 1
+    while end<len(code) and isNameChar(code[end]):
+        end += 1
+    # numbers are not names
+    if start<end and not code[start].isdigit():
+        return code[start:end]
+
+    depth = 0
+    pos = start-1
+    while pos>=0:
+        char = code[pos]
+        if char in ")]}":
+            depth += 1
+        elif char in "([{":
+            if depth == 0:
+                if char != "(":
+                    return None
+                end = pos
+                while end>0 and code[end-1].isspace():
+                    end -= 1
+                start = end
+                while start>0 and isNameChar(code[start-1]):
+                    start -= 1
+                return code[start:end] or None
+            depth -= 1
+        elif char == ";":
+            return None
+        pos -= 1
+    return None
@@ -0,0 +1,147 @@
+##
+# Parameter sweeps: the model is rendered for all combinations of the values of
+# a parameter grid. The values are passed to OpenSCAD with -D name=value, so the
+# source code stays the same.
+#
+import os
+import html
+import base64
+import shlex
+import itertools
+
+
+class Sweep:
+    def __init__(self, parameters, outputDir=None, jobs=None, maxRenders=256):
+        # list of (name, [values])
+        self.parameters = parameters
+        self.outputDir = outputDir
+        self.jobs = jobs or os.cpu_count() or 1
+        self.maxRenders = maxRenders
+
+    ## Creates the sweep from the arguments of %sweep: name=v1,v2 name=start:step:end [-o dir] [-j n]
+    @classmethod
+    def fromArguments(cls, args):
+        parameters = []
+        outputDir = None
+        jobs = None
+        args = list(args)
+        while args:
+            arg = args.pop(0)
+            if arg in ["-o", "-j"]:
+                if not args:
+                    raise Exception("Missing value for "+arg)
+                if arg == "-o":
+                    outputDir = args.pop(0)
+                else:
+                    jobs = int(args.pop(0))
+                    if jobs<1:
+                        raise Exception("Invalid number of jobs: "+str(jobs))
+                continue
+            name, sep, values = arg.partition("=")
+            if not sep or not name.strip() or not values.strip():
+                raise Exception("Invalid parameter: "+arg)
+            parameters.append((name.strip(), cls.parseValues(values)))
+        if not parameters:
+            raise Exception("No parameters defined")
+        sweep = cls(parameters, outputDir, jobs)
+        if sweep.count()>sweep.maxRenders:
+            raise Exception("Too many combinations: {} (max {})".format(sweep.count(), sweep.maxRenders))
+        return sweep
+
+    ## Splits the values at the commas which are not in brackets or strings. A
+    ## value start:step:end (or start:end) defines a range of numbers.
+    @classmethod
+    def parseValues(cls, text):
+        values = []
+        depth = 0
+        inString = False
+        current = ""
+        for pos, char in enumerate(text):
+            if inString:
+                if char == '"' and text[pos-1] != "\\":
+                    inString = False
+            elif char == '"':
+                inString = True
+            elif char in "([{":
+                depth += 1
+            elif char in ")]}":
+                depth -= 1
+            elif char == "," and depth == 0:
+                values.append(current.strip())
+                current = ""
+                continue
+            current += char
+        values.append(current.strip())
+
+        result = []
+        for value in values:
+            if not value:
+                raise Exception("Empty value in: "+text)
+            result.extend(cls.parseRange(value))
+        return result
+
+    @classmethod
+    def parseRange(cls, value):
+        parts = value.split(":")
+        if len(parts) not in [2, 3] or any([c in value for c in '"[]()']):
+            return [value]
+        numbers = [float(part) for part in parts]
+        start, step, end = (numbers[0], 1.0, numbers[1]) if len(numbers) == 2 else numbers
+        if step<=0 or end<start:
+            raise Exception("Invalid range: "+value)
+        result = []
+        count = int(round((end-start)/step, 9))+1
+        for i in range(count):
+            result.append("{:g}".format(start+i*step))
+        return result
+
+    def count(self):
+        result = 1
+        for name, values in self.parameters:
+            result *= len(values)
+        return result
+
+    ## Provides all combinations as list of (name, value) lists
+    def combinations(self):
+        names = [name for name, values in self.parameters]
+        return [list(zip(names, values)) for values in itertools.product(*[values for name, values in self.parameters])]
+
+    ## Adds the -D overrides of the combination to the command
+    def getCommand(self, scadCommand, combination):
+        return scadCommand+"".join([" -D "+shlex.quote(name+"="+value) for name, value in combination])
+
+    def getLabel(self, combination):
+        return ", ".join([name+"="+value for name, value in combination])
+
+    def getFileName(self, combination, ext):
+        name = "_".join([name+"="+value for name, value in combination])
+        name = "".join([c if c.isalnum() or c in "=._-" else "_" for c in name])
+        return os.path.join(self.outputDir, name+"."+ext)
+
+
+##
+# Result of a single render of a sweep
+##
+class SweepResult:
+    def __init__(self, combination, label):
+        self.combination = combination
+        self.label = label
+        self.data = None
+        self.fileName = None
+        self.isError = False
+        self.isCached = False
+        self.messages = ""
+        # RenderStats of the render: None if the result is from the render cache
+        self.stats = None
+
+
+## Creates a html gallery of the png results
+def toGallery(results):
+    items = []
+    for result in results:
+        if result.data:
+            image = '<img src="data:image/png;base64,{}" width="200"/>'.format(base64.standard_b64encode(result.data).decode("ascii"))
+        else:
+            image = '<div style="width:200px">render failed</div>'
+        items.append('<figure style="margin:4px">{}<figcaption>{}</figcaption></figure>'.format(image, html.escape(result.label)))
+    return '<div style="display:flex;flex-wrap:wrap">'+"".join(items)+"</div>"
@@ -0,0 +1,26 @@
+###
+# Test mixin which keeps the tests out of the configuration and the caches of
+# the user: they are written to a temp directory
+#
+
+import os
+import tempfile
+import shutil
+from unittest import mock
+from iopenscad.parser import Setup, IncludeLibrary
+
+class IsolatedHome:
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        # the toolchain config and the caches are written to the temp directory
+        self.env = mock.patch.dict(os.environ, {"XDG_CONFIG_HOME": os.path.join(self.home, "config"),
+            "XDG_CACHE_HOME": os.path.join(self.home, "cache")})
+        self.env.start()
+
+    def tearDown(self):
+        # wait for the toolchain detection in the background
+        Setup.executor.submit(lambda: None).result()
+        # the next test creates the include cache in its own directory
+        IncludeLibrary.cache = None
+        self.env.stop()
+        shutil.rmtree(self.home)
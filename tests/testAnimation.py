@@ -0,0 +1,93 @@
+###
+# Unit Tests for the animations
+#
+
+import unittest
+import os
+import zlib
+import struct
+import tempfile
+import shutil
+from iopenscad.animation import Animation, ApngWriter, readChunks, writeChunk, PNG_SIGNATURE
+from iopenscad.parser import Parser
+from iopenscad.cache import RenderCache
+
+
+## Creates a png with a single pixel
+def createPng(red, green, blue):
+    import io
+    out = io.BytesIO()
+    out.write(PNG_SIGNATURE)
+    writeChunk(out, b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+    writeChunk(out, b"IDAT", zlib.compress(bytes([0, red, green, blue])))
+    writeChunk(out, b"IEND", b"")
+    return out.getvalue()
+
+
+class MyTestAnimation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.frameFile = os.path.join(self.directory, "frame.png")
+        with open(self.frameFile, "wb") as f:
+            f.write(createPng(255, 0, 0))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def createParser(self, cell):
+        parser = Parser()
+        parser.converter.cache = RenderCache(os.path.join(self.directory, "cache"))
+        # copies the frame into the result file (the last argument)
+        parser.setScadCommand("sh -c 'for a; do out=$a; done; cp \"$0\" \"$out\"' "+self.frameFile)
+        parser.parse(cell)
+        return parser
+
+    def testArguments(self):
+        animation = Animation.fromArguments(["4", "fps=5", "-j", "2"])
+        self.assertEqual(animation.count(), 4)
+        self.assertEqual(animation.jobs, 2)
+        self.assertEqual(animation.getMime(), "image/png")
+        self.assertEqual(animation.getCommand("openscad", animation.combinations()[1]), "openscad -D '$t=0.25'")
+        self.assertEqual(Animation.fromArguments(["2", "format=gif"]).getMime(), "image/gif")
+        self.assertRaises(Exception, Animation.fromArguments, [])
+        self.assertRaises(Exception, Animation.fromArguments, ["0"])
+        self.assertRaises(Exception, Animation.fromArguments, ["10", "fps=0"])
+        self.assertRaises(Exception, Animation.fromArguments, ["10", "format=mp4"])
+
+    def testApngWriter(self):
+        writer = ApngWriter(3, 10)
+        for color in [(255, 0, 0), (0, 255, 0), (0, 0, 255)]:
+            writer.addFrame(createPng(*color))
+        chunks = [chunkType for chunkType, data in readChunks(writer.close())]
+        self.assertEqual(chunks, [b"IHDR", b"acTL", b"fcTL", b"IDAT", b"fcTL", b"fdAT", b"fcTL", b"fdAT", b"IEND"])
+
+        writer = ApngWriter(2, 10)
+        writer.addFrame(createPng(0, 0, 0))
+        self.assertRaises(Exception, writer.close)
+        self.assertRaises(Exception, writer.addFrame, b"no png")
+
+    def testRenderAnimation(self):
+        parser = self.createParser("%animate 4 -j 2"+os.linesep+"%display rotate($t*360) cube(1);")
+        result = parser.renderAnimation()
+        self.assertFalse(parser.isError)
+        chunks = readChunks(result)
+        self.assertEqual(struct.unpack(">II", chunks[1][1]), (4, 0))
+        self.assertEqual(len([chunk for chunk in chunks if chunk[0] == b"fcTL"]), 4)
+        messages = parser.getMessages()
+        self.assertTrue("Animation: 4 frames" in messages)
+        self.assertEqual(len([line for line in messages.splitlines() if line.strip().startswith(("1 ", "2 ", "3 ", "4 "))]), 4)
+
+    def testErrors(self):
+        parser = self.createParser("%animate x")
+        self.assertTrue(parser.isError)
+        parser = self.createParser("%animate x"+os.linesep+"%display cube($t);")
+        self.assertFalse(parser.displayRendered)
+        self.assertIsNone(parser.animation)
+        parser = self.createParser("%animate 3"+os.linesep+"%display cube($t);")
+        parser.setScadCommand("false")
+        self.assertIsNone(parser.renderAnimation())
+        self.assertTrue(parser.isError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+###
+# Unit Tests for the render cache
+#
+
+import unittest
+import os
+import time
+import tempfile
+import shutil
+import threading
+from unittest import mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from iopenscad.cache import DiskCache, RenderCache, IncludeCache, Spool, fingerprint, fingerprints
+from iopenscad.parser import Parser, IncludeLibrary
+
+# copies the scad file to the result file: <command> in.scad -o out.png
+COPY_COMMAND = "sh -c 'cp \"$0\" \"$2\"'"
+
+class MyTestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testPutGet(self):
+        cache = DiskCache(self.directory, 1000)
+        self.assertEqual(cache.get("a", "png"), None)
+        path = cache.put("a", "png", b"123")
+        self.assertEqual(cache.get("a", "png"), path)
+        self.assertEqual(cache.read("a", "png"), b"123")
+        self.assertEqual(cache.usage(), (1, 3))
+        cache.clear()
+        self.assertEqual(cache.usage(), (0, 0))
+
+    def testEvictLeastRecentlyUsed(self):
+        cache = DiskCache(self.directory, 250)
+        cache.put("a", "stl", b"a"*100)
+        cache.put("b", "stl", b"b"*100)
+        past = time.time()-100
+        os.utime(cache.path("a", "stl"), (past, past))
+        os.utime(cache.path("b", "stl"), (past-10, past-10))
+        cache.get("b", "stl")
+        cache.put("c", "stl", b"c"*100)
+        self.assertEqual(cache.get("a", "stl"), None)
+        self.assertNotEqual(cache.get("b", "stl"), None)
+        self.assertNotEqual(cache.get("c", "stl"), None)
+
+    def testKey(self):
+        cache = RenderCache(self.directory)
+        key = cache.key("openscad", "image/png", "cube(1);")
+        self.assertEqual(key, cache.key("openscad", "image/png", "cube(1);"))
+        self.assertNotEqual(key, cache.key("openscad", "model/stl", "cube(1);"))
+        self.assertNotEqual(key, cache.key("openjscad", "image/png", "cube(1);"))
+        self.assertNotEqual(key, cache.key("openscad", "image/png", "cube(1);", ["lib.scad:1:2"]))
+
+    def write(self, fileName, content):
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        with open(fileName, "w") as f:
+            f.write(content)
+
+    def testFingerprint(self):
+        fileName = os.path.join(self.directory, "lib.scad")
+        self.assertIsNone(fingerprint(fileName))
+        self.assertIsNone(fingerprints([fileName]))
+        self.write(fileName, "module lib(){}")
+        self.assertEqual(fingerprint(fileName)[2], 14)
+
+    def testNestedFingerprints(self):
+        fileName = os.path.join(self.directory, "lib.scad")
+        part = os.path.join(self.directory, "nested", "part.scad")
+        self.write(fileName, "include <nested/part.scad>"+os.linesep)
+        # the nested file is missing
+        self.assertIsNone(fingerprints([fileName]))
+        self.write(part, "module part(){}")
+        result = fingerprints([fileName])
+        self.assertEqual(len(result), 2)
+        self.write(part, "module part(){ cube(1); }")
+        self.assertNotEqual(fingerprints([fileName]), result)
+        # the imported file is not tracked
+        self.write(part, "module part(){ import(\"part.stl\"); }")
+        self.assertIsNone(fingerprints([fileName]))
+
+    def testLibraryPath(self):
+        self.write(os.path.join(self.directory, ".local", "share", "OpenSCAD", "libraries", "BOSL2", "std.scad"), "")
+        with mock.patch.dict(os.environ, {"HOME": self.directory}):
+            self.assertEqual(len(fingerprints(["BOSL2/std.scad"])), 1)
+            self.assertIsNone(fingerprints(["BOSL2/missing.scad"]))
+
+    def testNotCacheable(self):
+        parser = Parser()
+        parser.converter.cache = RenderCache(self.directory)
+        parser.setScadCommand(COPY_COMMAND)
+        parser.parse("%display import(\"part.stl\");")
+        parser.renderMime()
+        self.assertTrue("Render cache: not cacheable" in parser.getMessages())
+        parser.parse("use <iopenscad-missing.scad>;"+os.linesep+"%display cube(1);")
+        parser.renderMime()
+        self.assertTrue("Render cache: not cacheable" in parser.getMessages())
+        self.assertEqual(parser.converter.cache.usage(), (0, 0))
+
+    def testToolchainKey(self):
+        converter = Parser().converter
+        converter.cache = RenderCache(self.directory)
+        key = converter.getCacheKey("openscad", "image/png", "cube(1);", [])
+        converter.version = "2021.01"
+        self.assertNotEqual(converter.getCacheKey("openscad", "image/png", "cube(1);", []), key)
+        # the command is fingerprinted with its program
+        self.assertTrue(shutil.which("sh") in converter.renderer.getCacheCommand("sh -c true"))
+
+    def testRenderHitAndMiss(self):
+        parser = Parser()
+        parser.converter.cache = RenderCache(self.directory)
+        parser.setScadCommand(COPY_COMMAND)
+        parser.parse("%display cube(1);")
+        result = parser.renderMime()
+        self.assertTrue("Render cache: miss" in parser.getMessages())
+        self.assertEqual(open(result).read().strip(), "cube(1);")
+
+        def execute(command, code):
+            raise Exception("no process should be started")
+        parser.clearMessages()
+        parser.converter.execute = execute
+        cached = parser.renderMime()
+        self.assertTrue("Render cache: hit" in parser.getMessages())
+        # the status and the stats of the first render are not repeated
+        self.assertFalse("Render cache: miss" in parser.getMessages())
+        self.assertFalse("Render: " in parser.getMessages())
+        self.assertFalse(parser.isError)
+        self.assertEqual(open(cached).read().strip(), "cube(1);")
+
+    def testErrorsAreNotCached(self):
+        parser = Parser()
+        parser.converter.cache = RenderCache(self.directory)
+        parser.setScadCommand("false")
+        parser.parse("%display cube(1);")
+        parser.renderMime()
+        self.assertTrue(parser.isError)
+        self.assertEqual(parser.converter.cache.usage(), (0, 0))
+
+    def testCacheMagic(self):
+        parser = Parser()
+        parser.converter.cache = RenderCache(self.directory)
+        parser.parse("%cache off")
+        self.assertFalse(parser.converter.cache.active)
+        self.assertTrue(parser.getMessages().startswith("Render cache: off"))
+        parser.parse("%cache size 10")
+        self.assertEqual(parser.converter.cache.maxBytes, 10*1024*1024)
+        parser.parse("%cache invalid")
+        self.assertTrue(parser.isError)
+
+
+class MyTestSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testMaxFiles(self):
+        spool = Spool(self.directory, maxFiles=3)
+        files = [spool.createFile(".stl") for i in range(3)]
+        for i, path in enumerate(files):
+            os.utime(path, (1000+i, 1000+i))
+        spool.createFile(".stl")
+        self.assertEqual(spool.usage()[0], 3)
+        self.assertFalse(os.path.exists(files[0]))
+        self.assertTrue(os.path.exists(files[1]))
+
+    def testMaxBytes(self):
+        spool = Spool(self.directory, maxBytes=250)
+        for i in range(3):
+            with open(spool.createFile(".stl"), "wb") as f:
+                f.write(b"x"*100)
+        self.assertEqual(spool.usage(), (3, 300))
+        spool.createFile(".stl")
+        self.assertEqual(spool.usage(), (3, 200))
+
+    def testClose(self):
+        spool = Spool(self.directory)
+        self.assertEqual(spool.usage(), (0, 0))
+        spool.clear()
+        path = spool.createFile(".png")
+        self.assertTrue(spool.contains(path))
+        spool.close()
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+        self.assertNotEqual(os.path.dirname(spool.createFile(".png")), os.path.dirname(path))
+
+    def testRenderResultIsRemoved(self):
+        parser = Parser()
+        parser.converter.cache.active = False
+        parser.converter.spool = Spool(self.directory)
+        parser.setScadCommand(COPY_COMMAND)
+        parser.parse("%display cube(1);")
+        self.assertEqual(parser.renderMimeData(), b"cube(1);")
+        self.assertEqual(parser.converter.spool.usage(), (0, 0))
+        result = parser.renderMime()
+        self.assertTrue(parser.converter.spool.contains(result))
+        parser.parse("%spool files 10")
+        self.assertTrue(parser.getMessages().startswith("Spool: 1 of 10 files"))
+        parser.parse("%spool clear")
+        self.assertFalse(os.path.exists(result))
+        parser.parse("%spool invalid")
+        self.assertTrue(parser.isError)
+
+
+# local stand-in for a library server which supports ETags
+class LibraryHandler(BaseHTTPRequestHandler):
+    content = b"module lib(){ cube(1); }"
+    etag = '"1"'
+    delay = 0
+    requests = []
+    # content for other paths than /lib.scad
+    libraries = dict()
+
+    def do_GET(self):
+        LibraryHandler.requests.append(self.headers.get("If-None-Match"))
+        time.sleep(self.delay)
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        content = self.libraries.get(self.path, self.content)
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MyTestIncludeCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        LibraryHandler.requests = []
+        LibraryHandler.delay = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), LibraryHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/lib.scad".format(self.server.server_address[1])
+
+    def tearDown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def testRevalidate(self):
+        self.assertEqual(IncludeCache(self.directory).fetch(self.url), LibraryHandler.content)
+        # a new kernel only sends a conditional request
+        self.assertEqual(IncludeCache(self.directory).fetch(self.url), LibraryHandler.content)
+        self.assertEqual(LibraryHandler.requests, [None, '"1"'])
+
+    def testChangedContent(self):
+        IncludeCache(self.directory).fetch(self.url)
+        with mock.patch.object(LibraryHandler, "etag", '"2"'), mock.patch.object(LibraryHandler, "content", b"module lib2(){}"):
+            self.assertEqual(IncludeCache(self.directory).fetch(self.url), b"module lib2(){}")
+        self.assertEqual(LibraryHandler.requests, [None, '"1"'])
+
+    def testOffline(self):
+        cache = IncludeCache(self.directory, offline=True)
+        self.assertRaises(Exception, cache.fetch, self.url)
+        IncludeCache(self.directory).fetch(self.url)
+        self.assertEqual(cache.fetch(self.url), LibraryHandler.content)
+        self.assertEqual(len(LibraryHandler.requests), 1)
+
+    def testServerNotAvailable(self):
+        IncludeCache(self.directory).fetch(self.url)
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        self.assertEqual(IncludeCache(self.directory, timeout=1).fetch(self.url), LibraryHandler.content)
+
+    def testTimeout(self):
+        LibraryHandler.delay = 2
+        start = time.time()
+        self.assertRaises(OSError, IncludeCache(self.directory, timeout=0.5).fetch, self.url)
+        self.assertLess(time.time()-start, 1.5)
+
+    def testInclude(self):
+        url = self.url+"?include"
+        with mock.patch.object(IncludeLibrary, "cache", IncludeCache(self.directory)):
+            parser = Parser()
+            parser.parse("%include "+url)
+            IncludeLibrary.dictionary.pop(url)
+        self.assertFalse(parser.isError)
+        self.assertEqual(len(parser.getStatementsOfType("module")), 1)
+
+    def testPrefetch(self):
+        base = self.url[:-len("lib.scad")]
+        names = ["p1", "p2", "p3", "p4"]
+        LibraryHandler.libraries = dict([("/"+name+".scad", ("module "+name+"(){}").encode()) for name in names])
+        LibraryHandler.delay = 0.5
+        cell = os.linesep.join(["%include "+base+name+".scad" for name in names])
+        start = time.time()
+        with mock.patch.object(IncludeLibrary, "cache", IncludeCache(self.directory)):
+            parser = Parser()
+            parser.parse(cell)
+        for name in names:
+            IncludeLibrary.dictionary.pop(base+name+".scad")
+        LibraryHandler.libraries = dict()
+        self.assertLess(time.time()-start, 1.5)
+        self.assertEqual([s.name for s in parser.getStatementsOfType("module")], names)
+
+
+if __name__ == '__main__': 
+    unittest.main() 
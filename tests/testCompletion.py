@@ -0,0 +1,85 @@
+###
+# Unit Tests for the code completion
+#
+
+import unittest
+import os
+import time
+from iopenscad.completion import CompletionIndex, getPrefix, findCompletions
+from iopenscad.kernel import IOpenSCAD
+from iopenscad.parser import Parser
+from isolatedHome import IsolatedHome
+
+class MyTestCompletion(IsolatedHome, unittest.TestCase):
+    def testPrefix(self):
+        self.assertEqual(getPrefix("cube(1);", 8), "")
+        self.assertEqual(getPrefix("translate([1,0,0]) cyl", 22), "cyl")
+        self.assertEqual(getPrefix("x = $f", 6), "$f")
+        self.assertEqual(getPrefix("%%disp", 6), "%%disp")
+        self.assertEqual(getPrefix("cube", 2), "cu")
+        self.assertEqual(getPrefix("", 0), "")
+
+    def testIndex(self):
+        index = CompletionIndex(["cube(size = 1);", "cylinder(h = 1);", "%clear"])
+        self.assertEqual(index.complete("c"), ["cube(size = 1);", "cylinder(h = 1);"])
+        self.assertEqual(index.complete("%"), ["%clear"])
+        self.assertEqual(index.complete("x"), [])
+        index.add("cube", "cube()")
+        index.add("cube", "cube()")
+        index.remove("cube", "cube()")
+        self.assertEqual(index.complete("cub"), ["cube()", "cube(size = 1);"])
+        index.remove("cube", "cube()")
+        self.assertEqual(index.complete("cub"), ["cube(size = 1);"])
+        index.addAll([("cylinder", "cylinder()"), ("cube", "cube()"), ("cube", "cube()")])
+        self.assertEqual(index.complete("c"), ["cube()", "cube(size = 1);", "cylinder()", "cylinder(h = 1);"])
+        index.remove("cube", "cube()")
+        self.assertEqual(index.complete("cube"), ["cube()", "cube(size = 1);"])
+        self.assertEqual(findCompletions([index], "c", limit=2), ["cube()", "cube(size = 1);"])
+
+    def testSymbols(self):
+        parser = Parser()
+        parser.parse("module box(size) { cube(size); }"+os.linesep+"function double(x) = 2*x;"+os.linesep+"base = 10;"+os.linesep+"$fn = 20;")
+        self.assertEqual(parser.symbolCompletions.complete("b"), ["base", "box();"])
+        self.assertEqual(parser.symbolCompletions.complete("d"), ["double()"])
+        self.assertEqual(parser.symbolCompletions.complete("$"), ["$fn"])
+        # redefinitions do not create new entries
+        parser.parse("base = 20;"+os.linesep+"module box(size) { sphere(size); }")
+        self.assertEqual(parser.symbolCompletions.complete("b"), ["base", "box();"])
+        parser.parse("%clear")
+        self.assertEqual(len(parser.symbolCompletions), 0)
+        # a library is added with a single update of the index
+        parser.store.insertAll(parser.parseLibrary("base = 1; base = 2; module lid() {}"))
+        self.assertEqual(parser.symbolCompletions.complete("b"), ["base"])
+        self.assertEqual(parser.symbolCompletions.complete("l"), ["lid();"])
+        self.assertEqual(len(parser.symbolCompletions), 2)
+        self.assertEqual(findCompletions([parser.magicCompletions, CompletionIndex(["%clear"])], "%cl"), ["%clear"])
+
+    def testComplete(self):
+        kernel = IOpenSCAD()
+        kernel.parser = Parser()
+        kernel.parser.parse("module cubeBox(size) { cube(size); }")
+        code = "translate([1,0,0]) cub"
+        result = kernel.do_complete(code, len(code))
+        self.assertEqual(result["matches"], ["cube(size = [x,y,z], center = true);", "cubeBox();"])
+        self.assertEqual(result["cursor_start"], len(code)-3)
+        self.assertEqual(result["cursor_end"], len(code))
+        result = kernel.do_complete("%dis", 4)
+        self.assertTrue("%display" in result["matches"])
+        self.assertFalse("cube(size = [x,y,z], center = true);" in result["matches"])
+        self.assertEqual(kernel.do_complete("", 0)["status"], "ok")
+
+    def testManySymbols(self):
+        kernel = IOpenSCAD()
+        kernel.parser = Parser()
+        kernel.parser.parse(os.linesep.join(["module part{}() {{ cube({}); }}".format(i, i) for i in range(10000)]))
+        self.assertEqual(len(kernel.parser.symbolCompletions), 10000)
+        start = time.perf_counter()
+        for _ in range(100):
+            result = kernel.do_complete("part123", 7)
+        duration = (time.perf_counter()-start)/100
+        self.assertEqual(len(result["matches"]), 11)
+        self.assertLess(duration, 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+###
+# Unit Tests for the shared virtual display
+#
+
+import unittest
+import os
+import sys
+import stat
+import tempfile
+import shutil
+from iopenscad.display import VirtualDisplay, XVFB_RUN
+
+# fake Xvfb which reports display 42 with -displayfd and waits
+FAKE_XVFB = """#!{}
+import os, sys, time
+os.write(int(sys.argv[2]), b"42\\n")
+time.sleep(60)
+""".format(sys.executable)
+
+class MyTestDisplay(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xvfb = os.path.join(self.directory, "Xvfb")
+        with open(self.xvfb, "w") as f:
+            f.write(FAKE_XVFB)
+        os.chmod(self.xvfb, stat.S_IRWXU)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSharedDisplay(self):
+        display = VirtualDisplay(self.xvfb)
+        command, env = display.prepare(XVFB_RUN+"openscad")
+        self.assertEqual(command, "openscad")
+        self.assertEqual(env["DISPLAY"], ":42")
+        process = display.process
+        display.prepare(XVFB_RUN+"openscad")
+        self.assertTrue(display.process is process)
+        display.stop()
+        self.assertFalse(display.isRunning())
+        self.assertNotEqual(process.poll(), None)
+
+    def testNoDisplayNeeded(self):
+        display = VirtualDisplay(self.xvfb)
+        self.assertEqual(display.prepare("openscad"), ("openscad", None))
+        self.assertEqual(display.process, None)
+
+    def testFallbackWhenDied(self):
+        display = VirtualDisplay(self.xvfb)
+        display.prepare(XVFB_RUN+"openscad")
+        display.process.kill()
+        display.process.wait()
+        self.assertEqual(display.prepare(XVFB_RUN+"openscad"), (XVFB_RUN+"openscad", None))
+        self.assertTrue(display.failed)
+
+    def testFallbackWhenMissing(self):
+        display = VirtualDisplay(os.path.join(self.directory, "missing"))
+        self.assertEqual(display.prepare(XVFB_RUN+"openscad"), (XVFB_RUN+"openscad", None))
+
+
+if __name__ == '__main__': 
+    unittest.main() 
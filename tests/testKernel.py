@@ -0,0 +1,191 @@
+###
+# Unit Tests for the Kernel
+#
+
+import unittest
+import os
+import time
+import signal
+import asyncio
+import threading
+import tempfile
+import shutil
+import base64
+import zmq
+from unittest import mock
+from jupyter_client.session import Session
+from ipykernel.kernelbase import Kernel
+from iopenscad.kernel import IOpenSCAD
+from iopenscad.parser import Parser
+from iopenscad.cache import RenderCache
+from isolatedHome import IsolatedHome
+
+# copies the scad file to the result file: <command> in.scad -o out.txt
+COPY_COMMAND = "sh -c 'cp \"$0\" \"$2\"'"
+
+class MyTestKernel(IsolatedHome, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.kernel = IOpenSCAD()
+        self.kernel.parser = Parser()
+        self.kernel.parser.converter.cache = RenderCache(self.directory)
+        self.messages = []
+        self.kernel.send_response = lambda socket, msgType, content: self.messages.append((msgType, content))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def execute(self, code):
+        return asyncio.run(self.kernel.do_execute(code, False))
+
+    def testExecute(self):
+        self.kernel.parser.setScadCommand(COPY_COMMAND)
+        result = self.execute("%mime image/png"+os.linesep+"%display cube(1);")
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(self.messages[-1][0], "display_data")
+        self.assertTrue("image/png" in self.messages[-1][1]["data"])
+
+    def testInterrupt(self):
+        self.kernel.parser.setScadCommand("sh -c 'sleep 30'")
+        threading.Timer(0.5, os.kill, [os.getpid(), signal.SIGINT]).start()
+        start = time.time()
+        result = self.execute("%display cube(1);")
+        self.assertLess(time.time()-start, 10)
+        self.assertEqual(result["status"], "aborted")
+        self.assertTrue("aborted" in self.messages[-1][1]["text"])
+        self.assertEqual(self.kernel.parser.converter.process, None)
+        # the signal handler has been restored
+        self.assertNotEqual(signal.getsignal(signal.SIGINT), self.kernel.onInterrupt)
+
+    def testInterruptBeforeRender(self):
+        self.kernel.parser.setScadCommand("sh -c 'sleep 30'")
+        # the render thread is still busy when the interrupt arrives
+        released = threading.Event()
+        self.kernel.renderExecutor.submit(released.wait, 10)
+        threading.Timer(0.5, os.kill, [os.getpid(), signal.SIGINT]).start()
+        threading.Timer(1, released.set).start()
+        start = time.time()
+        result = self.execute("%display cube(1);")
+        self.assertLess(time.time()-start, 10)
+        self.assertEqual(result["status"], "aborted")
+        # the cancel does not apply to the next render
+        self.kernel.parser.setScadCommand(COPY_COMMAND)
+        self.assertEqual(self.execute("%display cube(2);")["status"], "ok")
+
+    def testRequestWhileRendering(self):
+        session = self.kernel.session = Session(key=b"")
+        def serialize(msgType):
+            return [zmq.Message(frame) for frame in session.serialize(session.msg(msgType, {}))]
+        async def run():
+            self.kernel.parser.setScadCommand("sh -c 'sleep 1; cp \"$0\" \"$2\"'")
+            execution = asyncio.ensure_future(self.kernel.do_execute("%display cube(1);", False))
+            await asyncio.sleep(0.5)
+            with mock.patch.object(self.kernel, "dispatch_shell") as dispatch, mock.patch.object(Kernel, "shell_main") as shellMain:
+                # the completion is answered right away, other requests wait for the cell
+                await self.kernel.shell_main(None, serialize("complete_request"))
+                await self.kernel.shell_main(None, serialize("execute_request"))
+            self.assertEqual(dispatch.call_count, 1)
+            self.assertTrue(dispatch.call_args.kwargs["concurrent"])
+            self.assertEqual(shellMain.call_count, 1)
+            self.assertEqual((await execution)["status"], "ok")
+        asyncio.run(run())
+
+    def testProgressive(self):
+        async def run():
+            self.kernel.parser.setScadCommand(COPY_COMMAND)
+            await self.kernel.do_execute("%progressive on", False)
+            code = "%mime text/x-scad"+os.linesep+"%display sphere(1, $fn=100);"
+            await self.kernel.do_execute(code, False)
+            # the full render is not timed in the profile of the next cell
+            profile = self.kernel.parser.profiler.start("next")
+            await self.kernel.fullRenders[self.kernel.getCellId(code)].task
+            self.kernel.parser.profiler.finish()
+            return profile
+        profile = asyncio.run(run())
+        self.assertEqual(profile.phases, {})
+        preview = [content for msgType, content in self.messages if msgType == "display_data"][-1]
+        update = self.messages[-1][1]
+        self.assertEqual(self.messages[-1][0], "update_display_data")
+        self.assertEqual(preview["transient"]["display_id"], update["transient"]["display_id"])
+        self.assertEqual(base64.b64decode(preview["data"]["text/x-scad"]).strip(), b"sphere(1, $fn=16);")
+        self.assertEqual(base64.b64decode(update["data"]["text/x-scad"]).strip(), b"sphere(1, $fn=100);")
+        self.assertEqual(self.kernel.fullRenders, {})
+
+    def testCancelFullRender(self):
+        # only the full render is slow
+        command = "sh -c 'grep -q fn=100 \"$0\" && sleep 30; cp \"$0\" \"$2\"'"
+        async def run():
+            self.kernel.parser.setScadCommand(command)
+            self.kernel.parser.progressive = True
+            code = "%display sphere(1, $fn=100);"
+            await self.kernel.do_execute(code, False)
+            fullRender = self.kernel.fullRenders[self.kernel.getCellId(code)]
+            await asyncio.sleep(0.5)
+            start = time.time()
+            # the execution of the same cell cancels the full render
+            await self.kernel.do_execute(code, False)
+            await fullRender.task
+            self.assertLess(time.time()-start, 10)
+            self.kernel.do_shutdown(False)
+            return fullRender
+        fullRender = asyncio.run(run())
+        self.assertTrue(fullRender.isCancelled)
+        self.assertEqual(fullRender.converter.process, None)
+        self.assertFalse("update_display_data" in [msgType for msgType, content in self.messages])
+
+    def testOtherCell(self):
+        command = "sh -c 'grep -q fn=100 \"$0\" && sleep 30; cp \"$0\" \"$2\"'"
+        async def run():
+            self.kernel.parser.setScadCommand(command)
+            self.kernel.parser.progressive = True
+            await self.kernel.do_execute("%display sphere(1, $fn=100);", False)
+            # without cell ids another cell does not cancel the full render
+            await self.kernel.do_execute("%display sphere(2, $fn=100);", False)
+            fullRenders = list(self.kernel.fullRenders.values())
+            self.kernel.do_shutdown(False)
+            for fullRender in fullRenders:
+                await fullRender.task
+            return fullRenders
+        fullRenders = asyncio.run(run())
+        self.assertEqual(len(fullRenders), 2)
+
+    def testCancelBeforeStart(self):
+        # the full render is cancelled before the render thread has started it
+        converter = self.kernel.parser.createConverter()
+        converter.stop()
+        start = time.time()
+        self.assertFalse(converter.convertData("sh -c 'sleep 30'", "cube(1);", "image/png"))
+        self.assertLess(time.time()-start, 10)
+        self.assertTrue(converter.isAborted)
+        converter.close()
+
+    def testSweep(self):
+        # writes the arguments into the result file (the last argument)
+        self.kernel.parser.setScadCommand("sh -c 'for a; do out=$a; done; echo \"$@\" > \"$out\"' x")
+        result = self.execute("%sweep size=1,2"+os.linesep+"%display cube(size);")
+        self.assertEqual(result["status"], "ok")
+        gallery = [content for msgType, content in self.messages if msgType == "display_data"][-1]
+        self.assertEqual(gallery["data"]["text/html"].count("<img"), 2)
+        self.assertTrue("Sweep: 2 renders" in self.messages[-1][1]["text"])
+
+    def testAnimate(self):
+        # a frame which is not a png is reported as error
+        self.kernel.parser.setScadCommand("sh -c 'for a; do out=$a; done; echo \"$@\" > \"$out\"' x")
+        result = self.execute("%animate 2"+os.linesep+"%display cube($t);")
+        self.assertEqual(result["status"], "ok")
+        self.assertTrue("Could not render the animation" in "".join([content.get("text", "") for msgType, content in self.messages]))
+
+    def testProfile(self):
+        self.kernel.parser.setScadCommand(COPY_COMMAND)
+        self.execute("%mime image/png"+os.linesep+"%display cube(1);")
+        self.execute("%profile 1")
+        text = self.messages[-1][1]["text"]
+        self.assertTrue("render" in text and "encode" in text and "send" in text)
+        row = text.splitlines()[-1].split()
+        self.assertTrue(float(row[1])>0)
+
+
+if __name__ == '__main__': 
+    unittest.main() 
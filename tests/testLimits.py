@@ -0,0 +1,122 @@
+###
+# Unit Tests for the render limits and statistics
+#
+
+import unittest
+import os
+import sys
+import time
+import shutil
+import threading
+from unittest import mock
+from iopenscad.limits import RenderLimits, RenderStats, RenderHistory
+from iopenscad.parser import Parser
+
+class MyTestLimits(unittest.TestCase):
+    def createParser(self, command):
+        parser = Parser()
+        parser.converter.cache.active = False
+        parser.setScadCommand(command)
+        parser.parse("%mime image/png"+os.linesep+"%display cube(1);")
+        parser.clearMessages()
+        return parser
+
+    def testUpdate(self):
+        limits = RenderLimits()
+        self.assertFalse(limits.hasProcessLimits())
+        limits.update(["time=10", "cpu=5", "memory=512"])
+        self.assertEqual((limits.time, limits.cpu, limits.memory), (10, 5, 512))
+        self.assertEqual(limits.info(), "Render limits: time=10 s, cpu=5 s, memory=512 MB")
+        self.assertRaises(Exception, limits.update, ["disk=1"])
+        self.assertRaises(Exception, limits.update, ["cpu"])
+
+    def testEnvironment(self):
+        os.environ["IOPENSCAD_TIME_LIMIT"] = "20"
+        try:
+            self.assertEqual(RenderLimits.fromEnvironment().time, 20)
+        finally:
+            del os.environ["IOPENSCAD_TIME_LIMIT"]
+
+    def testStats(self):
+        parser = self.createParser("true")
+        parser.renderMime()
+        self.assertTrue("Render: " in parser.getMessages())
+        history = parser.getRenderHistory()
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0].returnCode, 0)
+        self.assertEqual(history[0].resultType, "png")
+        self.assertTrue(history[0].peakMemory>0)
+        parser.parse("%renderStats 5")
+        self.assertTrue("png" in parser.getMessages())
+
+    def testTimeLimit(self):
+        parser = self.createParser("sh -c 'sleep 30'")
+        parser.converter.limits.time = 0.5
+        start = time.time()
+        parser.renderMime()
+        self.assertLess(time.time()-start, 10)
+        self.assertTrue(parser.isError)
+        self.assertTrue("time limit of 0.5 s" in parser.getMessages())
+
+    def testCpuLimit(self):
+        parser = self.createParser("sh -c 'while :; do :; done'")
+        parser.converter.limits.cpu = 1
+        parser.converter.limits.time = 30
+        parser.renderMime()
+        self.assertTrue(parser.isError)
+        self.assertTrue("CPU limit of 1 s" in parser.getMessages())
+        self.assertGreaterEqual(parser.getRenderHistory()[-1].cpuTime, 0.9)
+
+    def testMemoryLimit(self):
+        # reports the failed allocation like OpenSCAD
+        parser = self.createParser("sh -c '"+sys.executable+" -c \"bytearray(512*1024*1024)\" 2>/dev/null || { echo std::bad_alloc >&2; exit 1; }'")
+        parser.converter.limits.memory = 128
+        parser.renderMime()
+        self.assertTrue(parser.isError)
+        self.assertTrue("memory limit of 128 MB" in parser.getMessages())
+
+        # other errors are not caused by the limit
+        parser = self.createParser("false")
+        parser.converter.limits.memory = 128
+        parser.renderMime()
+        self.assertTrue(parser.isError)
+        self.assertFalse("memory limit" in parser.getMessages())
+
+    def testProcessLimits(self):
+        # the limits are already set when the command starts
+        for prlimit in [shutil.which("prlimit"), None]:
+            with mock.patch("shutil.which", return_value=prlimit):
+                parser = self.createParser("sh -c 'echo limits $(ulimit -t) $(ulimit -v) >&2; exit 1'")
+                parser.converter.limits.cpu = 7
+                parser.converter.limits.memory = 512
+                parser.renderMime()
+                self.assertTrue("limits 7 524288" in parser.getMessages(), parser.getMessages())
+
+    def testCancelWithCpuLimit(self):
+        parser = self.createParser("sh -c 'trap \"\" TERM; sleep 30'")
+        parser.converter.limits.cpu = 10
+        parser.converter.killTimeout = 0.2
+        timer = threading.Timer(0.5, parser.converter.cancel)
+        timer.start()
+        parser.renderMime()
+        timer.join()
+        self.assertTrue(parser.isAborted)
+        self.assertFalse("CPU limit" in parser.getMessages())
+
+    def testLimitsMagic(self):
+        parser = Parser()
+        parser.parse("%limits time=60 memory=1024")
+        self.assertEqual(parser.getMessages(), "Render limits: time=60 s, cpu=unlimited, memory=1024 MB")
+        parser.parse("%limits time")
+        self.assertTrue(parser.isError)
+
+    def testHistory(self):
+        history = RenderHistory(2)
+        for i in range(3):
+            history.add(RenderStats("openscad", "png", i))
+        self.assertEqual([stats.wallTime for stats in history.last()], [1, 2])
+        self.assertEqual(len(history.last(1)), 1)
+
+
+if __name__ == '__main__': 
+    unittest.main() 
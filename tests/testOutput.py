@@ -0,0 +1,143 @@
+###
+# Unit Tests for the collection and streaming of the render output
+#
+
+import unittest
+import os
+import codecs
+import tempfile
+import shutil
+from iopenscad.cache import RenderCache, Spool
+from iopenscad.output import MessageBuffer, LineSplitter
+from iopenscad.parser import Parser
+
+class MyTestOutput(unittest.TestCase):
+    def createParser(self, command):
+        parser = Parser()
+        parser.converter.cache.active = False
+        parser.setScadCommand(command)
+        parser.parse("%display cube(1);")
+        return parser
+
+    def testBuffer(self):
+        buffer = MessageBuffer(2, 2)
+        for i in range(10):
+            buffer.append(str(i)+"\n")
+        self.assertEqual(len(buffer), 10)
+        self.assertEqual(buffer.getText(), "0\n1\n... 6 lines omitted ..."+os.linesep+"8\n9\n")
+
+    def testLongLine(self):
+        buffer = MessageBuffer(maxLineLength=5)
+        buffer.append("0123456789\n")
+        self.assertEqual(buffer.getText(), "01234 ..."+os.linesep)
+
+    def testSplitter(self):
+        splitter = LineSplitter(codecs.getincrementaldecoder("utf-8")("replace"))
+        self.assertEqual(splitter.feed(b"a\nb"), ["a\n"])
+        self.assertEqual(splitter.feed(b"c\n\xc3"), ["bc\n"])
+        self.assertEqual(splitter.feed(b"\xa4\n"), ["\xe4\n"])
+        self.assertEqual(splitter.feed(b"end"), [])
+        self.assertEqual(splitter.feed(b""), ["end"])
+
+    def testMessages(self):
+        parser = self.createParser("sh -c 'echo out; echo err >&2'")
+        parser.renderMime()
+        messages = parser.getMessages()
+        self.assertTrue("out" in messages)
+        self.assertTrue("err" in messages)
+
+    def testBoundedMessages(self):
+        parser = self.createParser("sh -c 'seq 100000'")
+        parser.renderMime()
+        messages = parser.getMessages()
+        self.assertTrue("lines omitted" in messages)
+        self.assertTrue(messages.startswith("1\n2\n"))
+        self.assertTrue("100000\n" in messages)
+        self.assertLess(len(messages), 10000)
+
+    def testListener(self):
+        parser = self.createParser("sh -c 'echo 1; sleep 0.3; echo 2 >&2'")
+        received = []
+        parser.converter.outputListener = lambda name, text: received.append((name, text))
+        parser.renderMime()
+        self.assertEqual(received, [("stdout", "1\n"), ("stderr", "2\n")])
+        # the streamed output is not repeated in the messages
+        self.assertFalse("1\n" in parser.getMessages())
+        self.assertTrue("Render: " in parser.getMessages())
+
+    def testListenerError(self):
+        parser = self.createParser("sh -c 'echo ERROR: failed >&2; exit 1'")
+        parser.converter.outputListener = lambda name, text: None
+        parser.renderMime()
+        self.assertTrue(parser.isError)
+        # errors are reported with the output
+        self.assertTrue("ERROR: failed" in parser.getMessages())
+
+
+class MyTestPipe(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def createParser(self, command, code, pipe):
+        parser = Parser()
+        parser.converter.cache = RenderCache(os.path.join(self.directory, "cache"))
+        parser.converter.spool = Spool(self.directory)
+        parser.setScadCommand(command)
+        parser.converter.pipe = pipe
+        parser.parse("%display "+code)
+        return parser
+
+    def testPipe(self):
+        # more data than fits into the pipe buffers in both directions
+        code = "cube(1);"*200000
+        parser = self.createParser("sh -c 'echo start >&2; cat; echo $# >&2'", code, True)
+        self.assertEqual(parser.renderMimeData(), code.encode("utf-8"))
+        self.assertFalse(parser.isError)
+        self.assertTrue(parser.getMessages().startswith("start"+os.linesep+"4"))
+        self.assertEqual(os.listdir(self.directory), ["cache"])
+
+        parser.converter.execute = parser.converter.executePipe = None
+        self.assertEqual(parser.renderMimeData(), code.encode("utf-8"))
+        self.assertTrue("Render cache: hit" in parser.getMessages())
+
+    def testSpoolFile(self):
+        parser = self.createParser("sh -c 'cp \"$0\" \"$2\"'", "cube(1);", False)
+        self.assertEqual(parser.renderMimeData(), b"cube(1);")
+        self.assertEqual(parser.converter.spool.usage(), (0, 0))
+
+    def testArguments(self):
+        parser = self.createParser("sh -c 'echo \"$1\" >&2' 'a b'", "cube(1);", True)
+        parser.converter.cache.active = False
+        parser.renderMimeData()
+        self.assertTrue(parser.getMessages().startswith("--export-format"))
+
+    def testListenerCache(self):
+        parser = self.createParser("sh -c 'echo ECHO: 1 >&2; cat'", "cube(1);", True)
+        received = []
+        parser.converter.outputListener = lambda name, text: received.append(text)
+        parser.renderMimeData()
+        self.assertFalse("ECHO: 1" in parser.getMessages())
+        # the output is stored with the result
+        key = parser.converter.getCacheKey(parser.scadCommand, parser.mime, parser.getRenderInput(False)[1], [])
+        self.assertTrue("ECHO: 1" in parser.converter.cache.getMessages(key))
+
+        # a hit replays the output
+        received.clear()
+        parser.clearMessages()
+        parser.renderMimeData()
+        self.assertTrue("Render cache: hit" in parser.getMessages())
+        self.assertTrue("ECHO: 1" in "".join(received))
+        self.assertFalse("ECHO: 1" in parser.getMessages())
+
+    def testMissingCommand(self):
+        parser = self.createParser("iopenscad-missing-command", "cube(1);", True)
+        self.assertFalse(parser.renderMimeData())
+        self.assertTrue(parser.isError)
+        self.assertTrue("Could not execute iopenscad-missing-command" in parser.getMessages())
+
+
+if __name__ == '__main__': 
+    unittest.main() 
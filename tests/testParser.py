@@ -6,9 +6,11 @@ import unittest
 import os, re
 from iopenscad.parser import Parser
 from iopenscad.parser import Setup
+from iopenscad.parser import IncludeLibrary, IncludeRef
 from iopenscad.kernel import IOpenSCAD
+from isolatedHome import IsolatedHome
 
-class MyTestParser(unittest.TestCase):
+class MyTestParser(IsolatedHome, unittest.TestCase):
     def strip(self, txt):
         return txt.replace(os.linesep,"").strip()
 
@@ -183,6 +185,125 @@ class MyTestParser(unittest.TestCase):
         self.assertEqual(stmts[0].sourceCode, "a=1;"+os.linesep)
         self.assertEqual(stmts[1].sourceCode, "b=2;"+os.linesep)
 
+    def testManyStatements(self):
+        p = Parser()
+        cmd = "".join(["module m"+str(i)+"(){ cube("+str(i)+"); }"+os.linesep for i in range(200)])
+        p.parse(cmd+"%display m199();")
+        self.assertEqual(len(p.getStatementsOfType("module")), 200)
+        self.assertEqual(p.getStatementsOfType("module")[199].name, "m199")
+        self.assertTrue(p.displayRendered)
+
+    def testUseStatement(self):
+        p = Parser()
+        p.parse("use <MCAD/boxes.scad>;"+os.linesep+"roundedBox([1,1,1], 1);"+os.linesep)
+        result = p.getStatementsOfType("use")
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].name, "MCAD/boxes.scad")
+
+    def testIncludeWithoutSemicolon(self):
+        p = Parser()
+        p.parse("include <MCAD/boxes.scad>\nmodule m(){ cube(1); }\nx=2;")
+        result = p.getStatementsOfType("include")
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].name, "MCAD/boxes.scad")
+        self.assertEqual(result[0].sourceCode, "include <MCAD/boxes.scad>\n")
+        self.assertEqual(p.getStatementsOfType("module")[0].name, "m")
+        self.assertEqual(p.getStatementsOfType("=")[0].name, "x")
+
+    def testBracesInStringsAndComments(self):
+        p = Parser()
+        cmd = 'module test(){ /* } */ echo("}"); // }'+os.linesep+' cube(1); }'+os.linesep+"test();"
+        p.parse(cmd)
+        result = p.getStatementsOfType("module")
+        self.assertEqual(len(result), 1)
+        self.assertTrue(result[0].sourceCode.strip().endswith("cube(1); }"))
+        self.assertEqual(len(p.getStatementsOfType("-")), 1)
+
+    def testBlockStatements(self):
+        p = Parser()
+        p.parse("translate([1,0,0]) { cube(1); x = 1; }"+os.linesep+"if (a) { cube(); } else { sphere(); }"+os.linesep+"y=2;")
+        self.assertFalse(p.isError)
+        self.assertEqual([s.statementType for s in p.getStatements()], ["-", "-", "="])
+        self.assertEqual(p.getStatementsOfType("=")[0].name, "y")
+
+    def testReplaceInPlace(self):
+        p = Parser()
+        p.parse("a=1;"+os.linesep+"module m(){ cube(1); }"+os.linesep+"b=2;"+os.linesep)
+        p.parse("module m(){ cube(2); }"+os.linesep+"a=3;"+os.linesep)
+        stmts = p.getStatements()
+        self.assertEqual([s.name for s in stmts], ["a", "m", "b"])
+        self.assertEqual(stmts[0].sourceCode, "a=3;"+os.linesep)
+        self.assertTrue("cube(2)" in p.getStatementsOfType("module")[0].sourceCode)
+        self.assertEqual(p.getModuleNames(), ["m();"])
+        self.assertEqual([s.name for s in p.getStatementsOfType("=")], ["a", "b"])
+
+    def testSourceCodeCache(self):
+        p = Parser()
+        p.parse("a=1;"+os.linesep+"b=\xa02;"+os.linesep)
+        source = p.getSourceCode()
+        self.assertTrue(source is p.getSourceCode())
+        self.assertEqual(p.lineCount(), source.count("\n"))
+        self.assertFalse("\xa0" in source)
+        p.parse("a=3;"+os.linesep+"%display cube(a);"+os.linesep+"// x"+os.linesep)
+        source = p.getSourceCode()
+        self.assertEqual(self.strip(source), "a=3;b= 2;// x cube(a);")
+        self.assertEqual(p.lineCount(), source.count("\n"))
+        p.parse("%clear")
+        self.assertEqual(p.getSourceCode(), os.linesep)
+        self.assertEqual(p.lineCount(), os.linesep.count("\n"))
+
+    def testLibraryStatementsCache(self):
+        lib = IncludeRef("memo.scad", "memo.scad")
+        lib.content = "module a(){ cube(1); }"+os.linesep+"b=2;"+os.linesep
+        IncludeLibrary.dictionary[lib.name] = lib
+        p1 = Parser()
+        p1.parse("%include memo.scad")
+        p2 = Parser()
+        p2.parse("%use memo.scad")
+        IncludeLibrary.dictionary.pop(lib.name)
+        self.assertEqual(len(p1.getStatements()), 2)
+        self.assertTrue(p1.getStatementsOfType("module")[0] is p2.getStatementsOfType("module")[0])
+        self.assertTrue("Included number of statements: 2" in p2.getMessages())
+
+    def testPrune(self):
+        p = Parser()
+        p.parse(os.linesep.join(["use <lib.scad>;", "$fn = 20;", "size = 2;", "unused = 3;",
+            "function double(x) = 2*x;", "module part(){ cube(double(size)); }", "module other(){ sphere(unused); }",
+            "cube(5);", "// comment", ""]))
+        self.assertEqual(p.getRenderCode(), p.getSourceCode())
+        p.parse("%prune on")
+        self.assertTrue(p.prune)
+        p.parse("%display part();")
+        code = p.getRenderCode()
+        self.assertEqual(self.strip(code), "use <lib.scad>;$fn = 20;size = 2;function double(x) = 2*x;module part(){ cube(double(size)); } part();")
+        self.assertTrue("Pruned 4 of 9 statements" in p.getMessages())
+        p.parse("%prune invalid")
+        self.assertTrue(p.isError)
+
+        # a function literal is named by the variable
+        p = Parser()
+        p.parse(os.linesep.join(["wall = 2;", "f = function(x) x*2;", "g = function(x) x;", "module m(){ cube(f(1)); }", ""]))
+        self.assertEqual(p.getStatementsOfType("=")[1].name, "f")
+        p.parse("%prune on")
+        p.parse("%display m();")
+        self.assertEqual(self.strip(p.getRenderCode()), "f = function(x) x*2;module m(){ cube(f(1)); } m();")
+
+        # with an include all variables are kept
+        p = Parser()
+        p.parse(os.linesep.join(["include <lib.scad>;", "wall = 2;", "f = function(x) x*2;", "module m(){ cube(f(1)); }", "cube(5);", ""]))
+        p.parse("%prune on")
+        p.parse("%display m(); box();")
+        self.assertEqual(self.strip(p.getRenderCode()), "include <lib.scad>;wall = 2;f = function(x) x*2;module m(){ cube(f(1)); } m(); box();")
+
+    def testPruneModifier(self):
+        p = Parser()
+        p.parse(os.linesep.join(["n = 3;", "module part(){ cube(1); }", "x = 1;", ""]))
+        p.parse("%prune on")
+        p.parse("%display cube(10%n);")
+        self.assertEqual(self.strip(p.getRenderCode()), "n = 3; cube(10%n);")
+        p.parse("%display %part();")
+        self.assertEqual(self.strip(p.getRenderCode()), "module part(){ cube(1); } %part();")
+
     def testSetup(self):
         s = Setup()
         self.assertEqual(s.setup(""), "openscad")
@@ -0,0 +1,53 @@
+###
+# Unit Tests for the preview renders
+#
+
+import unittest
+from iopenscad.preview import PreviewSettings
+from iopenscad.parser import Parser
+
+# copies the scad file to the result file: <command> in.scad -o out.png
+COPY_COMMAND = "sh -c 'cp \"$0\" \"$2\"'"
+
+class MyTestPreview(unittest.TestCase):
+    def testRewrite(self):
+        preview = PreviewSettings()
+        self.assertEqual(preview.rewrite("$fn = 100; sphere(r=1, $fn=8);"), "$fn = 16; sphere(r=1, $fn=8);")
+        self.assertEqual(preview.rewrite("cylinder($fa=1, $fs = 0.1 , h=2);"), "cylinder($fa=12, $fs = 2 , h=2);")
+        self.assertEqual(preview.rewrite("$fn = res*(a+1);"), "$fn = min(16, res*(a+1));")
+        self.assertEqual(preview.rewrite("if ($fn==3) cube(1); // $fn=100"), "if ($fn==3) cube(1); // $fn=100")
+
+    def testCommand(self):
+        preview = PreviewSettings()
+        self.assertEqual(preview.getCommand("openscad", "image/png"), "openscad --preview")
+        self.assertEqual(preview.getCommand("openscad", "model/stl"), "openscad")
+        self.assertEqual(preview.getCommand(COPY_COMMAND, "image/png"), COPY_COMMAND)
+
+    def testPreviewAndFull(self):
+        parser = Parser()
+        parser.converter.cache.active = False
+        parser.setScadCommand(COPY_COMMAND)
+        parser.parse("%displayPreview sphere(1, $fn=100);")
+        self.assertEqual(parser.renderMimeData().strip(), b"sphere(1, $fn=16);")
+        self.assertTrue("Preview: $fn<=16" in parser.getMessages())
+        parser.parse("%displayFull")
+        self.assertTrue(parser.displayRendered)
+        self.assertEqual(parser.renderMimeData().strip(), b"sphere(1, $fn=100);")
+
+    def testSessionPreview(self):
+        parser = Parser()
+        parser.converter.cache.active = False
+        parser.setScadCommand(COPY_COMMAND)
+        parser.parse("%preview on fn=8")
+        self.assertEqual(parser.getMessages(), "Preview: $fn<=8, $fa>=12, $fs>=2 (on)")
+        parser.parse("%display circle(1, $fn=100);")
+        self.assertEqual(parser.renderMimeData().strip(), b"circle(1, $fn=8);")
+        parser.parse("%preview fn=0")
+        self.assertTrue(parser.isError)
+        parser.parse("%preview off")
+        parser.parse("%display circle(1, $fn=100);")
+        self.assertEqual(parser.renderMimeData().strip(), b"circle(1, $fn=100);")
+
+
+if __name__ == '__main__':
+    unittest.main()
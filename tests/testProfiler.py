@@ -0,0 +1,68 @@
+###
+# Unit Tests for the phase timers
+#
+
+import unittest
+import os
+import json
+import time
+import tempfile
+import shutil
+from iopenscad.profiler import Profiler
+from iopenscad.parser import Parser
+
+class MyTestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testPhases(self):
+        profiler = Profiler()
+        profiler.start(1)
+        with profiler.phase("parse"):
+            time.sleep(0.02)
+            with profiler.phase("scan"):
+                time.sleep(0.05)
+        profile = profiler.finish()
+        # the nested phase is not counted in the enclosing phase
+        self.assertTrue(0.05 <= profile.phases["scan"] < 0.07)
+        self.assertTrue(0.02 <= profile.phases["parse"] < 0.04)
+        self.assertTrue(profile.total >= 0.07)
+        self.assertEqual(len(profiler.last(5)), 1)
+        self.assertIsNone(profiler.finish())
+
+    def testLog(self):
+        logFile = os.path.join(self.directory, "profile.log")
+        profiler = Profiler(logFile=logFile)
+        for cell in [1, 2]:
+            profiler.start(cell)
+            with profiler.phase("render"):
+                pass
+            profiler.finish()
+        with open(logFile) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([entry["cell"] for entry in entries], [1, 2])
+        self.assertTrue("render" in entries[1]["phases"])
+
+    def testMagic(self):
+        parser = Parser()
+        profiler = parser.profiler
+        for cell in range(3):
+            profiler.start(cell+1)
+            parser.parse("module a() { cube(1); }")
+            profiler.finish()
+        parser.parse("%profile 2")
+        lines = parser.getMessages().splitlines()
+        self.assertEqual(lines[0], "Profile [ms]")
+        self.assertTrue("scan" in lines[1] and "parse" in lines[1])
+        self.assertEqual([line.split()[0] for line in lines[2:]], ["2", "3"])
+        parser.parse("%profile x")
+        self.assertTrue(parser.isError)
+        parser.parse("%profile clear")
+        self.assertEqual(len(profiler.last()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+###
+# Unit Tests for the renderers
+#
+
+import unittest
+import os
+import time
+import base64
+import asyncio
+import tempfile
+import shutil
+import threading
+from unittest import mock
+from iopenscad.renderer import FakeRenderer, ProcessRenderer, rendererFromEnvironment, createPng, createStl, PNG_SIGNATURE
+from iopenscad.parser import Parser, MimeConverter
+from iopenscad.cache import RenderCache
+from iopenscad.kernel import IOpenSCAD
+from isolatedHome import IsolatedHome
+
+class MyTestRenderer(IsolatedHome, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def createConverter(self, renderer):
+        converter = MimeConverter()
+        converter.cache = RenderCache(self.directory)
+        converter.renderer = renderer
+        return converter
+
+    def testResults(self):
+        png = createPng(5000)
+        self.assertEqual(len(png), 5000)
+        self.assertTrue(png.startswith(PNG_SIGNATURE) and png.endswith(b"IEND\xaeB`\x82"))
+        stl = createStl(5000)
+        self.assertTrue(4800 < len(stl) <= 5000)
+        self.assertTrue(stl.startswith(b"solid fake"))
+        self.assertEqual(len(FakeRenderer(size=100).getResult("off")), 100)
+
+    def testConvert(self):
+        renderer = FakeRenderer(0.05, 2000)
+        converter = self.createConverter(renderer)
+        data = converter.readResult(converter.convert("openscad", "cube(1);", "image/png"))
+        self.assertEqual(data, createPng(2000))
+        self.assertFalse(converter.isError)
+        self.assertTrue(converter.stats.wallTime >= 0.05)
+        self.assertEqual(len(converter.history), 1)
+
+        converter.pipe = True
+        self.assertEqual(converter.convertData("openscad", "cube(2);", "model/stl"), createStl(2000))
+        # the results of the fake renderer are not mixed with real renders in the cache
+        key = converter.getCacheKey("openscad", "image/png", "cube(1);", [])
+        converter.renderer = ProcessRenderer()
+        self.assertNotEqual(converter.getCacheKey("openscad", "image/png", "cube(1);", []), key)
+
+    def testCancel(self):
+        converter = self.createConverter(FakeRenderer(10))
+        converter.cache.active = False
+        threading.Timer(0.1, converter.cancel).start()
+        start = time.perf_counter()
+        converter.convert("openscad", "cube(1);", "image/png")
+        self.assertLess(time.perf_counter()-start, 1)
+        self.assertTrue(converter.isAborted)
+        self.assertTrue(converter.isError)
+
+    def testMagic(self):
+        parser = Parser()
+        parser.parse("%renderer fake latency=0.5 size=100")
+        renderer = parser.converter.renderer
+        self.assertEqual((renderer.name, renderer.latency, renderer.size), ("fake", 0.5, 100))
+        self.assertTrue("latency=0.5 s" in parser.getMessages())
+        self.assertTrue(parser.createConverter().renderer is renderer)
+        parser.parse("%renderer fake size=x")
+        self.assertTrue(parser.isError)
+        parser.parse("%renderer openscad")
+        self.assertEqual(parser.converter.renderer.name, "openscad")
+        parser.parse("%renderer other")
+        self.assertTrue(parser.isError)
+
+    def testEnvironment(self):
+        with mock.patch.dict(os.environ, {"IOPENSCAD_RENDERER": "fake", "IOPENSCAD_FAKE_LATENCY": "0.2", "IOPENSCAD_FAKE_SIZE": "300"}):
+            renderer = rendererFromEnvironment()
+        self.assertEqual((renderer.name, renderer.latency, renderer.size), ("fake", 0.2, 300))
+        with mock.patch.dict(os.environ, {"IOPENSCAD_RENDERER": ""}):
+            self.assertEqual(rendererFromEnvironment().name, "openscad")
+
+    def testExecute(self):
+        kernel = IOpenSCAD()
+        kernel.parser = Parser()
+        kernel.parser.converter.cache = RenderCache(self.directory)
+        kernel.parser.setScadCommand("openscad")
+        messages = []
+        kernel.send_response = lambda socket, msgType, content: messages.append((msgType, content))
+        result = asyncio.run(kernel.do_execute("%renderer fake size=1000"+os.linesep+"%display cube(1);", False))
+        self.assertEqual(result["status"], "ok")
+        msgType, content = messages[-1]
+        self.assertEqual(msgType, "display_data")
+        self.assertEqual(base64.b64decode(content["data"]["image/png"]), createPng(1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
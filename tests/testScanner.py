@@ -2,7 +2,7 @@
 
 import unittest
 import os, re
-from iopenscad.scanner import Scanner
+from iopenscad.scanner import Scanner, IDENTIFIER, NUMBER, STRING, COMMENT, PUNCTUATION, NEWLINE, WHITESPACE, MAGIC, BLOCK
 
 class MyTestScanner(unittest.TestCase):
 
@@ -20,6 +20,62 @@ class MyTestScanner(unittest.TestCase):
         end = s.findEndWithNewLine(str,1)
         self.assertEqual(str[end], "b")
 
+    def testEndFromPosition(self):
+        s = Scanner()
+        words = s.tokenize("a;b;c{d{e}};f{g;}h;if(i){}else{}j;", blocks=True).words
+        end = s.findEndOfStatement(words, 2)
+        self.assertEqual("".join(words[2:end]), "b;")
+        start = words.index("c")
+        end = s.findEndOfStatement(words, start)
+        self.assertEqual("".join(words[start:end]), "c{d{e}};")
+        start = words.index("f")
+        end = s.findEndOfStatement(words, start)
+        self.assertEqual("".join(words[start:end]), "f{g;}")
+        start = words.index("if")
+        end = s.findEndOfStatement(words, start)
+        self.assertEqual("".join(words[start:end]), "if(i){}else{}")
+
+    def testEndOfInclude(self):
+        s = Scanner()
+        for code, statement in [("include <a.scad>\nx=1;", "include <a.scad>"), ("include <a b.scad> ;x=1;", "include <a b.scad> ;"),
+                ("use <a.scad> x=1;", "use <a.scad>"), ("include a;x=1;", "include a;")]:
+            words = s.scann(code)
+            self.assertEqual("".join(words[0:s.findEndOfInclude(words)]), statement)
+
+    def testTokenTypes(self):
+        s = Scanner()
+        tokens = s.tokenize('%display a = 1.5; // x'+os.linesep+'b="}";')
+        self.assertEqual(tokens.words[0:8], ["%display", " ", "a", " ", "=", " ", "1.5", ";"])
+        self.assertEqual(tokens.types[0:7], [MAGIC, WHITESPACE, IDENTIFIER, WHITESPACE, PUNCTUATION, WHITESPACE, NUMBER])
+        self.assertEqual(tokens.token(9), (COMMENT, "// x", 18, 22))
+        self.assertEqual(tokens.types[10], NEWLINE)
+        self.assertEqual(tokens.token(13)[0:2], (STRING, '"}"'))
+
+    def testOffsets(self):
+        s = Scanner()
+        scad = 'module a($fn=10) { /* } */ echo("{"); }'
+        tokens = s.tokenize(scad)
+        self.assertEqual("".join(tokens.words), scad)
+        for pos in range(len(tokens)):
+            self.assertEqual(scad[tokens.start(pos):tokens.end(pos)], tokens.words[pos])
+        self.assertTrue("$fn" in tokens.words)
+        # with blocks the body is a single token
+        tokens = s.tokenize(scad, blocks=True)
+        self.assertEqual(tokens.words[-1], '{ /* } */ echo("{"); }')
+        self.assertEqual(tokens.types[-1], BLOCK)
+        self.assertEqual(s.findEndOfStatement(tokens.words), len(tokens))
+        self.assertEqual(s.tokenize("a{b{", blocks=True).words, ["a", "{b{"])
+        self.assertEqual(s.tokenize("a}b", blocks=True).words, ["a", "}", "b"])
+
+    def testModulo(self):
+        s = Scanner()
+        self.assertEqual(s.scann("a=10%n;"), ["a", "=", "10", "%", "n", ";"])
+        tokens = s.tokenize("x=1;"+os.linesep+"  %display %part(a%%b);")
+        self.assertEqual(tokens.words[5:13], ["  ", "%display", " ", "%", "part", "(", "a", "%"])
+        self.assertEqual(tokens.types[6:9], [MAGIC, WHITESPACE, PUNCTUATION])
+        self.assertEqual(tokens.types[9], IDENTIFIER)
+        self.assertEqual(s.scann("%%display cube(1);")[0], "%%display")
+
 
 if __name__ == '__main__': 
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,90 @@
+###
+# Unit Tests for the detection of the toolchain
+#
+
+import unittest
+import os
+import time
+import tempfile
+import shutil
+from unittest import mock
+from iopenscad.parser import Setup, Parser
+
+# fake openscad: reports a version and copies the scad file to the result file
+FAKE_OPENSCAD = """#!/bin/sh
+if [ "$1" = "--version" ]; then
+    echo "OpenSCAD version 2021.01"
+elif [ "$1" = "--export-format" ]; then
+    printf "\\211PNG"
+    cat
+else
+    cp "$1" "$3"
+fi
+"""
+
+class MyTestSetup(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.binary = os.path.join(self.directory, "openscad")
+        with open(self.binary, "w") as f:
+            f.write(FAKE_OPENSCAD)
+        os.chmod(self.binary, 0o755)
+        self.configFile = os.path.join(self.directory, "config", "toolchain.json")
+        self.env = mock.patch.dict(os.environ, {"PATH": self.directory+os.pathsep+os.environ["PATH"],
+            "DISPLAY": ":0", "XDG_CONFIG_HOME": os.path.join(self.directory, "config-home")})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.directory)
+
+    def testDetect(self):
+        setup = Setup(self.configFile)
+        toolchain = setup.getToolchain()
+        self.assertEqual(toolchain["name"], "openscad")
+        self.assertEqual(toolchain["binary"], self.binary)
+        self.assertEqual(toolchain["version"], "2021.01")
+        self.assertTrue(toolchain["capabilities"]["png"])
+        self.assertTrue(toolchain["capabilities"]["pipe"])
+        self.assertTrue(setup.usePipe(toolchain))
+        self.assertTrue(os.path.isfile(self.configFile))
+        self.assertEqual(setup.setup(""), "openscad")
+        self.assertEqual(setup.setup("openjscad"), "openjscad")
+
+    def testCachedToolchain(self):
+        Setup(self.configFile).getToolchain()
+        setup = Setup(self.configFile)
+        with mock.patch.object(setup, "detect", side_effect=Exception("detect called")):
+            self.assertEqual(setup.getToolchain()["binary"], self.binary)
+
+    def testChangedBinary(self):
+        Setup(self.configFile).getToolchain()
+        past = time.time()-100
+        os.utime(self.binary, (past, past))
+        setup = Setup(self.configFile)
+        with mock.patch.object(setup, "detect", return_value={"name": "openscad", "binary": None}) as detect:
+            setup.getToolchain()
+            detect.assert_called_once()
+
+    def testDefaultConfigFile(self):
+        self.assertEqual(Setup().configFile, os.path.join(self.directory, "config-home", "iopenscad", "toolchain.json"))
+
+    def testBackground(self):
+        parser = Parser()
+        parser.setupInBackground()
+        self.assertIsNotNone(parser.setupFuture)
+        self.assertEqual(parser.getScadCommand(), "openscad")
+        self.assertEqual(parser.toolchain["version"], "2021.01")
+        self.assertTrue(parser.converter.pipe)
+        self.assertIsNone(parser.setupFuture)
+
+    def testCommandOverridesDetection(self):
+        parser = Parser()
+        parser.setupInBackground()
+        parser.parse("%command openjscad")
+        self.assertEqual(parser.getScadCommand(), "openjscad")
+        self.assertFalse(parser.converter.pipe)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+###
+# Unit Tests for the signature index (inspect requests)
+#
+
+import unittest
+import os
+from iopenscad.signatures import Signature, getInspectName, getCommentText
+from iopenscad.kernel import IOpenSCAD
+from iopenscad.parser import Parser, IncludeRef, IncludeLibrary
+from isolatedHome import IsolatedHome
+
+class MyTestSignatures(IsolatedHome, unittest.TestCase):
+    def testParameters(self):
+        self.assertEqual(Signature.parseParameters("module box(size=[1,2,3], wall = 1 /* mm */, center) { cube(size); }"),
+            [("size", "[1,2,3]"), ("wall", "1"), ("center", None)])
+        self.assertEqual(Signature.parseParameters("function f(x, y=g(1,2)) = x*y;"), [("x", None), ("y", "g(1,2)")])
+        self.assertEqual(Signature.parseParameters("module empty() {}"), [])
+
+    def testComments(self):
+        self.assertEqual(getCommentText("// a box"+os.linesep), "a box")
+        self.assertEqual(getCommentText("/**"+os.linesep+" * a"+os.linesep+" * box"+os.linesep+" */"), "a"+os.linesep+"box")
+
+    def testInspectName(self):
+        self.assertEqual(getInspectName("box(1);", 1), "box")
+        self.assertEqual(getInspectName("box(1);", 3), "box")
+        self.assertEqual(getInspectName("box([1,2], ", 11), "box")
+        self.assertEqual(getInspectName("x = f(1", 7), "f")
+        self.assertEqual(getInspectName("cube(1);", 8), None)
+
+    def testIndex(self):
+        parser = Parser()
+        parser.parse(os.linesep.join(["// A box", "// with walls", "module box(size=1, wall=2) { cube(size); }", "",
+            "// unrelated", "", "function double(x) = 2*x;", ""]))
+        self.assertEqual(len(parser.signatures), 2)
+        self.assertEqual(parser.signatures.get("box").str(), "module box(size = 1, wall = 2)"+os.linesep+os.linesep+"A box"+os.linesep+"with walls")
+        self.assertEqual(parser.signatures.get("double").str(), "function double(x)")
+        parser.parse("module box(length) { cube(length); }")
+        self.assertEqual(parser.signatures.get("box").str(), "module box(length)")
+        parser.parse("%clear")
+        self.assertIsNone(parser.signatures.get("box"))
+
+    def testLazyParameters(self):
+        parser = Parser()
+        parser.parse("module box(size=1) { cube(size); }")
+        signature = parser.signatures.get("box")
+        self.assertIsNone(signature.parameters)
+        self.assertEqual(signature.getParameters(), [("size", "1")])
+
+    def testInspect(self):
+        kernel = IOpenSCAD()
+        kernel.parser = Parser()
+        lib = IncludeRef("inspect.scad", "inspect.scad")
+        lib.content = "// rounded cube"+os.linesep+"module roundedCube(size, r=1) { cube(size); }"+os.linesep
+        IncludeLibrary.dictionary[lib.name] = lib
+        kernel.parser.parse("%use inspect.scad")
+        IncludeLibrary.dictionary.pop(lib.name)
+        result = kernel.do_inspect("roundedCube(10, ", 16)
+        self.assertTrue(result["found"])
+        self.assertEqual(result["data"]["text/plain"], "module roundedCube(size, r = 1)"+os.linesep+os.linesep+"rounded cube")
+        result = kernel.do_inspect("roundedCube(10);", 3, detail_level=1)
+        self.assertTrue(result["data"]["text/plain"].endswith("module roundedCube(size, r=1) { cube(size); }"))
+        result = kernel.do_inspect("unknown(1);", 3)
+        self.assertEqual(result["status"], "ok")
+        self.assertFalse(result["found"])
+
+
+if __name__ == '__main__':
+    unittest.main()
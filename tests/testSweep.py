@@ -0,0 +1,100 @@
+###
+# Unit Tests for the parameter sweeps
+#
+
+import unittest
+import os
+import tempfile
+import shutil
+from iopenscad.sweep import Sweep
+from iopenscad.parser import Parser
+from iopenscad.cache import RenderCache
+
+# writes the arguments into the result file (the last argument)
+ARGS_COMMAND = "sh -c 'for a; do out=$a; done; echo \"$@\" > \"$out\"' x"
+
+class MyTestSweep(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def createParser(self, cell):
+        parser = Parser()
+        parser.converter.cache = RenderCache(os.path.join(self.directory, "cache"))
+        parser.setScadCommand(ARGS_COMMAND)
+        parser.parse(cell)
+        return parser
+
+    def testValues(self):
+        self.assertEqual(Sweep.parseValues("1, 2,3"), ["1", "2", "3"])
+        self.assertEqual(Sweep.parseValues("[1,2],[3,4]"), ["[1,2]", "[3,4]"])
+        self.assertEqual(Sweep.parseValues('"a,b","c"'), ['"a,b"', '"c"'])
+        self.assertEqual(Sweep.parseValues("10:10:30"), ["10", "20", "30"])
+        self.assertEqual(Sweep.parseValues("0:0.5:1,5"), ["0", "0.5", "1", "5"])
+        self.assertRaises(Exception, Sweep.parseValues, "1,,2")
+
+    def testArguments(self):
+        sweep = Sweep.fromArguments(["size=1,2", "label=\"a b\"", "-j", "2", "-o", "out"])
+        self.assertEqual(sweep.count(), 2)
+        self.assertEqual(sweep.jobs, 2)
+        self.assertEqual(sweep.outputDir, "out")
+        combination = sweep.combinations()[1]
+        self.assertEqual(sweep.getCommand("openscad", combination), "openscad -D size=2 -D 'label=\"a b\"'")
+        self.assertEqual(sweep.getFileName(combination, "stl"), os.path.join("out", "size=2_label=_a_b_.stl"))
+        self.assertRaises(Exception, Sweep.fromArguments, [])
+        self.assertRaises(Exception, Sweep.fromArguments, ["size"])
+        self.assertRaises(Exception, Sweep.fromArguments, ["a=1:1:100", "b=1:1:100"])
+
+    def testRenderSweep(self):
+        parser = self.createParser("%sweep size=1,2,3 wall=1,2"+os.linesep+"%display box(size, wall);")
+        results = parser.renderSweep()
+        self.assertFalse(parser.isError)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[5].label, "size=3, wall=2")
+        self.assertTrue(results[5].data.startswith(b"-D size=3 -D wall=2 "))
+        self.assertTrue("Sweep: 6 renders, 0 from the render cache, 0 errors" in parser.getMessages())
+
+        parser = self.createParser("%sweep size=1:3 wall=1,2 -o "+os.path.join(self.directory, "out")+os.linesep+"%display box(size, wall);")
+        results = parser.renderSweep()
+        self.assertTrue("Sweep: 6 renders, 6 from the render cache, 0 errors" in parser.getMessages())
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, "out"))), 6)
+        with open(results[0].fileName, "rb") as f:
+            self.assertEqual(f.read(), results[0].data)
+
+    def testErrors(self):
+        parser = self.createParser("%sweep size")
+        self.assertTrue(parser.isError)
+        # the display code is not rendered without the sweep
+        parser = self.createParser("%sweep size"+os.linesep+"%display cube(size);")
+        self.assertTrue(parser.isError)
+        self.assertFalse(parser.displayRendered)
+        self.assertIsNone(parser.sweep)
+        parser = self.createParser("%sweep size=1,2"+os.linesep+"%display box(size);")
+        parser.setScadCommand("false")
+        results = parser.renderSweep()
+        self.assertTrue(parser.isError)
+        self.assertTrue(all([result.isError for result in results]))
+
+    def testSmallSpool(self):
+        # the parallel renders must not evict the files of each other
+        parser = self.createParser("%spool files 2"+os.linesep+"%sweep size=1,2,3,4,5,6 -j 6"+os.linesep+"%display cube(size);")
+        parser.converter.cache.active = False
+        parser.setScadCommand("sh -c 'sleep 0.2; for a; do case $a in *.scad) cat \"$a\" > /dev/null || exit 1;; esac; out=$a; done; echo \"$@\" > \"$out\"' x")
+        results = parser.renderSweep()
+        self.assertFalse(parser.isError, parser.getMessages())
+        self.assertEqual(len([result for result in results if not result.isError]), 6)
+
+    def testCombinationError(self):
+        # the result file of the first combination can not be written: only this combination fails
+        outputDir = os.path.join(self.directory, "out")
+        os.makedirs(os.path.join(outputDir, "size=1.png"))
+        parser = self.createParser("%sweep size=1,2 -o "+outputDir+os.linesep+"%display cube(size);")
+        results = parser.renderSweep()
+        self.assertTrue(parser.isError)
+        self.assertEqual([result.isError for result in results], [True, False])
+        self.assertTrue("Sweep: 2 renders" in parser.getMessages())
+
+if __name__ == '__main__':
+    unittest.main()